@@ -0,0 +1,351 @@
+# Benchmark suite for the streaming paths of single_file_videos_web_server.py.
+#
+# Builds a temporary synthetic library (sparse files of realistic sizes in a deep
+# directory tree), starts the production server on it and drives it with simulated
+# players: an initial bytes=0- request, a suffix-range probe (players looking for a tail
+# moov), random seeks, catalog fetches and searches. Reports throughput and p50/p99 time
+# to first byte per request kind, peak server RSS, and micro-benchmarks of catalog scans
+# and secret token handling, then compares everything with a stored baseline.
+#
+#   python bench_video_server.py                     run and compare with bench_baseline.json
+#   python bench_video_server.py --engine both       threaded and async engines side by side
+#   python bench_video_server.py --save-baseline     store this run as the new baseline
+#
+# The exit status is 1 when a metric regressed by more than --tolerance.
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import single_file_videos_web_server as server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'bench_baseline.json')
+
+# Synthetic library shape
+LIBRARY_SEED = 20240601
+MIN_VIDEO_SIZE = 50 * 1024 * 1024
+MAX_VIDEO_SIZE = 4 * 1024 * 1024 * 1024
+RSS_FILE_SIZE = 2 * 1024 * 1024 * 1024   # Streamed completely to measure peak server RSS
+
+# Simulated player behaviour
+INITIAL_READ = 256 * 1024        # Bytes read from bytes=0- before the player seeks
+SEEK_READ = 1024 * 1024          # Bytes read after each seek
+SUFFIX_PROBE = 64 * 1024
+SEEKS_PER_SESSION = 3
+SEARCH_TERMS = ('ep', 'movie', '01', 'show', 'clip', 'part')
+
+# Secret token store sizes for the validation micro-benchmark (lookups timed per size)
+TOKEN_STORE_SIZES = (1000, 10000, 100000)
+TOKEN_VERIFY_LOOKUPS = 10000
+
+# Metric name suffixes that say which direction is better
+HIGHER_IS_BETTER = ('_per_s', '_mbps')
+LOWER_IS_BETTER = ('_ms', '_mb')
+# Counts that fail the comparison as soon as they exceed the baseline (no tolerance,
+# and a baseline of 0 counts)
+MUST_NOT_RISE = ('errors',)
+
+def build_library(root, files, depth, fanout):
+    rng = random.Random(LIBRARY_SEED)
+    dirs = ['']
+    level_dirs = ['']
+    for level in range(depth):
+        level_dirs = [os.path.join(d, f'season{level}_{i:02d}') for d in level_dirs for i in range(fanout)]
+        dirs += level_dirs
+    for d in dirs:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    names = []
+    for i in range(files):
+        rel = os.path.join(rng.choice(dirs), f'{rng.choice(SEARCH_TERMS)}_{i:05d}{rng.choice((".mp4", ".mp4", ".webm", ".mkv"))}')
+        size = int(rng.lognormvariate(20, 0.8))
+        with open(os.path.join(root, rel), 'wb') as f:
+            f.truncate(min(MAX_VIDEO_SIZE, max(MIN_VIDEO_SIZE, size)))
+        names.append(rel.replace(os.sep, '/'))
+    with open(os.path.join(root, 'rss_probe.mp4'), 'wb') as f:
+        f.truncate(RSS_FILE_SIZE)
+    return names, len(dirs)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(root, port, engine, threads):
+    cmd = [sys.executable, os.path.abspath(__file__), '--serve', root, '--port', str(port),
+           '--engine', engine, '--threads', str(threads)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/videos?limit=1')
+            conn.getresponse().read()
+            conn.close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{engine} server did not start')
+
+def peak_rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# One timed request: returns (time to first body byte, bytes read)
+def timed_get(port, path, headers=None, read=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        start = time.perf_counter()
+        conn.request('GET', path, headers=headers or {})
+        resp = conn.getresponse()
+        if resp.status >= 400:
+            raise RuntimeError(f'{path}: HTTP {resp.status}')
+        first = resp.read(1)
+        ttfb = time.perf_counter() - start
+        total = len(first)
+        while read is None or total < read:
+            chunk = resp.read(min(256 * 1024, read - total) if read is not None else 256 * 1024)
+            if not chunk:
+                break
+            total += len(chunk)
+        return ttfb, total
+    finally:
+        conn.close()
+
+class LoadResult:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ttfb = {}      # request kind -> [seconds]
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self, kind, ttfb, nbytes):
+        with self.lock:
+            self.ttfb.setdefault(kind, []).append(ttfb)
+            self.bytes += nbytes
+
+def player(port, names, deadline, result, seed):
+    rng = random.Random(seed)
+    while time.time() < deadline:
+        try:
+            roll = rng.random()
+            if roll < 0.05:
+                result.add('catalog', *timed_get(port, '/videos'))
+            elif roll < 0.15:
+                q = rng.choice(SEARCH_TERMS)
+                result.add('search', *timed_get(port, f'/videos?q={q}&limit=50'))
+            else:
+                path = '/video/' + rng.choice(names)
+                result.add('initial', *timed_get(port, path, {'Range': 'bytes=0-'}, read=INITIAL_READ))
+                result.add('suffix', *timed_get(port, path, {'Range': f'bytes=-{SUFFIX_PROBE}'}))
+                for _ in range(SEEKS_PER_SESSION):
+                    offset = rng.randrange(MIN_VIDEO_SIZE - SEEK_READ)
+                    result.add('seek', *timed_get(port, path, {'Range': f'bytes={offset}-'}, read=SEEK_READ))
+        except (OSError, RuntimeError, http.client.HTTPException):
+            with result.lock:
+                result.errors += 1
+
+def run_load(root, names, engine, players, duration, threads):
+    port = free_port()
+    proc = start_server(root, port, engine, threads)
+    try:
+        result = LoadResult()
+        start = time.time()
+        deadline = start + duration
+        with ThreadPoolExecutor(max_workers=players) as pool:
+            for i in range(players):
+                pool.submit(player, port, names, deadline, result, LIBRARY_SEED + i)
+        elapsed = time.time() - start
+
+        # Stream one large file end to end; peak RSS must not grow with file size
+        rss_start = time.perf_counter()
+        _, streamed = timed_get(port, '/video/rss_probe.mp4')
+        stream_seconds = time.perf_counter() - rss_start
+        rss = peak_rss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=server.SERVER_GRACEFUL_TIMEOUT + 5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    requests = sum(len(v) for v in result.ttfb.values())
+    metrics = {
+        'requests_per_s': requests / elapsed,
+        'throughput_mbps': result.bytes / elapsed / 1e6,
+        'full_stream_mbps': streamed / stream_seconds / 1e6,
+        'errors': result.errors,
+    }
+    if rss is not None:
+        metrics['peak_rss_mb'] = rss
+    for kind, values in sorted(result.ttfb.items()):
+        metrics[f'{kind}_ttfb_p50_ms'] = percentile(values, 50) * 1000
+        metrics[f'{kind}_ttfb_p99_ms'] = percentile(values, 99) * 1000
+    return metrics
+
+# In-process micro-benchmarks: catalog scans and secret token handling
+def run_micro(root):
+    metrics = {}
+    catalog = server.VideoCatalog(root)
+    start = time.perf_counter()
+    catalog.refresh(full=True)
+    metrics['catalog_full_scan_ms'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    catalog.refresh()
+    metrics['catalog_incremental_scan_ms'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    catalog.sorted_view('mtime')
+    metrics['catalog_sort_ms'] = (time.perf_counter() - start) * 1000
+
+    server.token_store = server.TokenStore()
+    n = 20000
+    start = time.perf_counter()
+    tokens = [server.issue_token('secret') for _ in range(n)]
+    metrics['token_issue_per_s'] = n / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for token in tokens:
+        server.consume_secret_token(token)
+    metrics['token_consume_per_s'] = n / (time.perf_counter() - start)
+    start = time.perf_counter()
+    server.token_store.sweep()
+    metrics['token_sweep_ms'] = (time.perf_counter() - start) * 1000
+
+    # Validation with the store holding 1k, 10k and 100k used tokens, the same number of
+    # lookups each time: the rates should stay level as the store grows
+    rng = random.Random(LIBRARY_SEED)
+    for size in TOKEN_STORE_SIZES:
+        server.token_store = server.TokenStore(max_size=max(size, server.TOKEN_STORE_MAX))
+        tokens = [server.issue_token('secret') for _ in range(size)]
+        for token in tokens:
+            server.consume_secret_token(token)
+        lookups = [rng.choice(tokens) for _ in range(TOKEN_VERIFY_LOOKUPS)]
+        start = time.perf_counter()
+        for token in lookups:
+            server.is_valid_secret_token(token)
+        metrics[f'token_verify_{size // 1000}k_per_s'] = TOKEN_VERIFY_LOOKUPS / (time.perf_counter() - start)
+    server.token_store = server.TokenStore()
+    return metrics
+
+# Metrics worse than the baseline by more than tolerance: [(name, baseline, current)]
+def compare(results, baseline, tolerance):
+    regressions = []
+    for section, metrics in results.items():
+        for name, value in metrics.items():
+            old = baseline.get(section, {}).get(name)
+            if old is None or value is None:
+                continue
+            if name in MUST_NOT_RISE:
+                if value > old:
+                    regressions.append((f'{section}.{name}', old, value))
+                continue
+            if not old:
+                continue
+            if name.endswith(HIGHER_IS_BETTER) and value < old * (1 - tolerance):
+                regressions.append((f'{section}.{name}', old, value))
+            elif name.endswith(LOWER_IS_BETTER) and value > old * (1 + tolerance):
+                regressions.append((f'{section}.{name}', old, value))
+    return regressions
+
+def format_report(results, regressions, baseline):
+    lines = []
+    for section, metrics in results.items():
+        lines.append(f'[{section}]')
+        for name, value in metrics.items():
+            old = baseline.get(section, {}).get(name)
+            note = f'  (baseline {old:.2f})' if isinstance(old, (int, float)) else ''
+            lines.append(f'  {name:32s} {value:12.2f}{note}')
+    if regressions:
+        lines.append('REGRESSIONS:')
+        for name, old, value in regressions:
+            lines.append(f'  {name}: {old:.2f} -> {value:.2f}')
+    else:
+        lines.append('No regressions against baseline.')
+    return '\n'.join(lines)
+
+def serve_child(args):
+    server.VIDEO_ROOT = args.serve
+    server.SECRET_VIDEO_ROOT = os.path.join(args.serve, '.secret')
+    server.CATALOG_SNAPSHOT_DIR = os.path.join(args.serve, '.snapshots')
+    server.app.logger.disabled = True
+    server.serve('127.0.0.1', args.port, workers=1, threads=args.threads, engine=args.engine)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the video server streaming paths')
+    parser.add_argument('--engine', choices=('threaded', 'async', 'both'), default='threaded')
+    parser.add_argument('--players', type=int, default=16, help='concurrent simulated players')
+    parser.add_argument('--duration', type=float, default=15, help='seconds of load per engine')
+    parser.add_argument('--threads', type=int, default=server.SERVER_THREADS, help='server request threads')
+    parser.add_argument('--files', type=int, default=2000, help='videos in the synthetic library')
+    parser.add_argument('--depth', type=int, default=4, help='directory tree depth')
+    parser.add_argument('--fanout', type=int, default=4, help='subdirectories per directory')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='write this run to the baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    parser.add_argument('--output', default=os.path.join(HERE, 'bench_output.txt'), help='report file')
+    # Internal: run the server on a library (used by the benchmark itself)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_child(args)
+        return 0
+
+    root = tempfile.mkdtemp(prefix='video_share_bench_')
+    try:
+        names, dir_count = build_library(root, args.files, args.depth, args.fanout)
+        print(f'Library: {len(names)} sparse videos in {dir_count} directories at {root}')
+        results = {'micro': run_micro(root)}
+        engines = ('threaded', 'async') if args.engine == 'both' else (args.engine,)
+        for engine in engines:
+            print(f'Load: {args.players} players for {args.duration:.0f}s on the {engine} engine')
+            results[engine] = run_load(root, names, engine, args.players, args.duration, args.threads)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    report = format_report(results, regressions, baseline)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,60 @@
-from flask import Flask, send_file, request, jsonify, render_template_string, session
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, g, has_request_context, request, jsonify, render_template_string, session
+from urllib.parse import unquote_to_bytes, urlencode
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+import argparse
+import atexit
+import base64
+import bisect
+import contextlib
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import math
+import multiprocessing.sharedctypes
+import operator
 import os
+import random
+import re
 import secrets
+import select
+import selectors
+import signal
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
 import time
 
+# Optional: brotli-compressed copies of the index page (pip install brotli)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Not on Windows, which runs a single process anyway
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Optional: filesystem watcher for instant catalog updates (pip install watchdog)
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(32)  # Generate random secret key for session
 
@@ -10,1037 +62,4896 @@ VIDEO_ROOT = r'D:\videos-share-resouce'
 SECRET_VIDEO_ROOT = r'D:\videos-secret-resouce'
 SECRET_PASSWORD = 'secret'
 
-# Store valid tokens and expiration times
-valid_tokens = {}
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.ogg', '.mkv', '.rmvb', '.avi', '.flv', '.mov')
 
-# Get video list
-def get_video_list(is_secret=False):
-    video_root = SECRET_VIDEO_ROOT if is_secret else VIDEO_ROOT
-    video_files = []
-    
-    # Return empty list if directory doesn't exist
-    if not os.path.exists(video_root):
-        return video_files
-    
-    for root, dirs, files in os.walk(video_root):
-        for file in files:
-            if file.lower().endswith(('.mp4', '.webm', '.ogg', '.mkv', '.rmvb', '.avi', '.flv', '.mov')):
-                rel_dir = os.path.relpath(root, video_root)
-                rel_file = os.path.join(rel_dir, file) if rel_dir != '.' else file
-                video_files.append(rel_file.replace('\\', '/'))
-    return video_files
-
-# Clean expired tokens
-def clean_expired_tokens():
-    current_time = time.time()
-    # Only delete truly expired tokens (positive timestamp and expired), don't delete used tokens (-1)
-    expired = [token for token, exp_time in valid_tokens.items() if exp_time > 0 and current_time > exp_time]
-    for token in expired:
-        del valid_tokens[token]
+# Catalog refresh settings (seconds)
+CATALOG_REFRESH_INTERVAL = 30       # Incremental refresh based on directory mtimes
+CATALOG_FULL_RESCAN_INTERVAL = 3600 # Full rescan also picks up files modified in place
+CATALOG_WATCH_DEBOUNCE = 1.0        # Delay after a filesystem event before refreshing
+CATALOG_SNAPSHOT_DIR = ''           # On-disk catalog snapshots for instant startup (empty = per-user data directory)
+CATALOG_SNAPSHOT_INTERVAL = 300     # Save directory mtime changes at most this often (listing changes at once), and on shutdown
+CATALOG_FOLLOW_INTERVAL = 2         # Workers that do not scan reload the scanning worker's snapshot this often
 
-@app.route('/')
-def index():
-    user_agent = request.headers.get('User-Agent', '').lower()
-    is_mobile = any(x in user_agent for x in ['mobile', 'android', 'iphone', 'ipad', 'ipod'])
-    
-    # Check if there's a secret space token
-    secret_token = request.args.get('secretnumber', '')
-    is_secret_mode = False
-    
-    if secret_token:
-        clean_expired_tokens()
-        if secret_token in valid_tokens:
-            token_status = valid_tokens[secret_token]
-            # Only unused tokens (positive timestamp) can access
-            if token_status > 0:
-                # Token is valid and newly generated, allow access to secret mode
-                is_secret_mode = True
-                # Mark token as used (set to -1 to indicate used, cannot be used to access homepage again)
-                valid_tokens[secret_token] = -1
-            else:
-                # Token already used (-1), don't allow access again
-                return render_template_string('<script>alert("Access link has expired and cannot be reused!"); window.location.href="/";</script>')
-        else:
-            # Token invalid or expired, redirect to normal mode
-            return render_template_string('<script>alert("Access link has expired!"); window.location.href="/";</script>')
-    
-    return render_template_string('''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Video Sharing Center</title>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        
-        body {
-            display: flex;
-            height: 100vh;
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            overflow: hidden;
-        }
-        
-        body.mobile {
-            flex-direction: column;
-        }
-        
-        #sidebar {
-            width: 320px;
-            background: rgba(255, 255, 255, 0.95);
-            backdrop-filter: blur(10px);
-            box-shadow: 2px 0 20px rgba(0,0,0,0.1);
-            overflow: hidden;
-            transition: all 0.3s ease;
-            z-index: 100;
-            display: flex;
-            flex-direction: column;
-        }
-        
-        /* Mobile sidebar styles */
-        body.mobile #sidebar {
-            width: 100%;
-            height: 40vh;
-            position: fixed;
-            bottom: 0;
-            left: 0;
-            border-radius: 20px 20px 0 0;
-            box-shadow: 0 -5px 30px rgba(0,0,0,0.3);
-            transform: translateY(0);
-            display: flex;
-            flex-direction: column;
-            overflow: hidden;
-        }
-        
-        body.mobile #sidebar.collapsed {
-            transform: translateY(calc(100% - 60px));
-        }
-        
-        #sidebar::-webkit-scrollbar { width: 8px; }
-        #sidebar::-webkit-scrollbar-track { background: #f1f1f1; }
-        #sidebar::-webkit-scrollbar-thumb { 
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            border-radius: 4px;
-        }
-        #sidebar::-webkit-scrollbar-thumb:hover { background: #764ba2; }
-        
-        .scrollable-content::-webkit-scrollbar { width: 6px; }
-        .scrollable-content::-webkit-scrollbar-track { background: #f1f1f1; }
-        .scrollable-content::-webkit-scrollbar-thumb { 
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            border-radius: 3px;
-        }
-        .scrollable-content::-webkit-scrollbar-thumb:hover { background: #764ba2; }
-        
-        .sidebar-header {
-            padding: 25px 20px;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            font-size: 24px;
-            font-weight: 600;
-            text-align: center;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.15);
-            position: relative;
-            cursor: pointer;
-            user-select: none;
-            flex-shrink: 0;
-        }
-        
-        body.mobile .sidebar-header {
-            padding: 15px 20px;
-            font-size: 18px;
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            flex-shrink: 0;
-        }
-        
-        .toggle-icon {
-            display: none;
-            font-size: 20px;
-            transition: transform 0.3s;
-        }
-        
-        body.mobile .toggle-icon {
-            display: block;
-        }
-        
-        body.mobile #sidebar.collapsed .toggle-icon {
-            transform: rotate(180deg);
-        }
-        
-        .search-box {
-            padding: 15px;
-            background: white;
-            border-bottom: 1px solid #e0e0e0;
-            flex-shrink: 0;
-        }
-        
-        body.mobile .search-box {
-            flex-shrink: 0;
-        }
-        
-        .search-box input {
-            width: 100%;
-            padding: 10px 15px;
-            border: 2px solid #e0e0e0;
-            border-radius: 25px;
-            font-size: 14px;
-            outline: none;
-            transition: all 0.3s;
-        }
-        
-        .search-box input:focus {
-            border-color: #667eea;
-            box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
-        }
-        
-        .video-item {
-            padding: 15px 20px;
-            cursor: pointer;
-            border-bottom: 1px solid #f0f0f0;
-            transition: all 0.3s ease;
-            display: flex;
-            align-items: center;
-            gap: 12px;
-            position: relative;
-        }
-        
-        body.mobile .video-item {
-            padding: 12px 15px;
-            font-size: 14px;
-        }
-        
-        .video-item::before {
-            content: '▶';
-            font-size: 12px;
-            color: #667eea;
-            opacity: 0;
-            transition: opacity 0.3s;
-        }
-        
-        body.mobile .video-item::before {
-            opacity: 1;
-            font-size: 10px;
-        }
-        
-        .video-item:hover {
-            background: linear-gradient(90deg, rgba(102, 126, 234, 0.1) 0%, rgba(118, 75, 162, 0.1) 100%);
-            padding-left: 25px;
-            transform: translateX(5px);
-        }
-        
-        body.mobile .video-item:hover {
-            transform: none;
-            padding-left: 15px;
-        }
-        
-        .video-item:hover::before { opacity: 1; }
-        
-        .video-item:active {
-            background: rgba(102, 126, 234, 0.2);
-        }
-        
-        .video-item.active {
-            background: linear-gradient(90deg, rgba(102, 126, 234, 0.15) 0%, rgba(118, 75, 162, 0.15) 100%);
-            border-left: 4px solid #667eea;
-            font-weight: 600;
-            color: #667eea;
-        }
-        
-        .video-name {
-            flex: 1;
-            overflow: hidden;
-            text-overflow: ellipsis;
-            white-space: nowrap;
-            font-size: 14px;
-        }
-        
-        #main {
-            flex: 1;
-            display: flex;
-            flex-direction: column;
-            align-items: center;
-            justify-content: center;
-            padding: 30px;
-            gap: 20px;
-        }
-        
-        body.mobile #main {
-            padding: 15px;
-            padding-bottom: calc(40vh + 15px);
-            height: 100vh;
-            overflow-y: auto;
-        }
-        
-        .player-container {
-            background: rgba(0, 0, 0, 0.8);
-            border-radius: 15px;
-            padding: 20px;
-            box-shadow: 0 10px 40px rgba(0,0,0,0.3);
-            max-width: 90%;
-            backdrop-filter: blur(10px);
-        }
-        
-        body.mobile .player-container {
-            width: 100%;
-            max-width: 100%;
-            padding: 15px;
-            border-radius: 10px;
-        }
-        
-        #player {
-            width: 100%;
-            max-width: 1000px;
-            border-radius: 10px;
-            box-shadow: 0 5px 20px rgba(0,0,0,0.4);
-        }
-        
-        body.mobile #player {
-            max-width: 100%;
-            border-radius: 8px;
-        }
-        
-        .video-title {
-            color: white;
-            font-size: 20px;
-            font-weight: 600;
-            text-align: center;
-            margin-top: 15px;
-            text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
-            max-width: 1000px;
-        }
-        
-        body.mobile .video-title {
-            font-size: 16px;
-            margin-top: 10px;
-            padding: 0 10px;
-        }
-        
-        .empty-state {
-            color: white;
-            font-size: 18px;
-            text-align: center;
-            opacity: 0.8;
-        }
-        
-        body.mobile .empty-state {
-            font-size: 16px;
-            padding: 20px;
-        }
-        
-        /* 可滚动内容容器 */
-        .scrollable-content {
-            flex: 1;
-            overflow-y: auto;
-            overflow-x: hidden;
-        }
-        
-        body.mobile .scrollable-content {
-            display: flex;
-            flex-direction: column;
-        }
-        
-        .video-count {
-            padding: 10px 20px;
-            background: rgba(102, 126, 234, 0.1);
-            text-align: center;
-            font-size: 13px;
-            color: #667eea;
-            font-weight: 500;
-            flex-shrink: 0;
-        }
-        
-        body.mobile .video-count {
-            padding: 8px 15px;
-            font-size: 12px;
-            flex-shrink: 0;
-        }
-        
-        .search-box {
-            padding: 15px;
-            background: white;
-            border-bottom: 1px solid #e0e0e0;
-        }
-        
-        body.mobile .search-box {
-            padding: 10px 15px;
-        }
-        
-        .search-box input {
-            width: 100%;
-            padding: 10px 15px;
-            border: 2px solid #e0e0e0;
-            border-radius: 25px;
-            font-size: 14px;
-            outline: none;
-            transition: all 0.3s;
-        }
-        
-        body.mobile .search-box input {
-            padding: 8px 12px;
-            font-size: 13px;
-        }
-        
-        /* 全屏播放按钮 */
-        .fullscreen-btn {
-            display: none;
-            position: absolute;
-            top: 20px;
-            right: 20px;
-            background: rgba(0,0,0,0.6);
-            color: white;
-            border: none;
-            border-radius: 50%;
-            width: 45px;
-            height: 45px;
-            font-size: 20px;
-            cursor: pointer;
-            z-index: 10;
-            backdrop-filter: blur(5px);
-        }
-        
-        body.mobile .fullscreen-btn {
-            display: block;
-        }
-        
-        .fullscreen-btn:active {
-            background: rgba(0,0,0,0.8);
-        }
-        
-        /* 全页面播放按钮 */
-        .fullpage-btn {
-            background: rgba(255,255,255,0.15);
-            color: white;
-            border: 1px solid rgba(255,255,255,0.3);
-            border-radius: 15px;
-            padding: 6px 12px;
-            font-size: 12px;
-            cursor: pointer;
-            display: flex;
-            align-items: center;
-            gap: 5px;
-            backdrop-filter: blur(5px);
-            user-select: none;
-            transition: all 0.3s ease;
-        }
-        
-        body.mobile .fullpage-btn {
-            padding: 5px 10px;
-            font-size: 11px;
-            gap: 4px;
-        }
-        
-        .fullpage-btn:hover {
-            background: rgba(255,255,255,0.25);
-        }
-        
-        .fullpage-btn:active {
-            background: rgba(255,255,255,0.3);
-        }
-        
-        .fullpage-btn.active {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            border-color: #667eea;
-        }
-        
-        .fullpage-icon {
-            font-size: 12px;
-        }
-        
-        body.mobile .fullpage-icon {
-            font-size: 11px;
-        }
-        
-        /* 按钮容器 */
-        .controls-container {
-            display: flex;
-            gap: 10px;
-            margin-bottom: 10px;
-            position: relative;
-            z-index: 10;
-        }
-        
-        body.mobile .controls-container {
-            gap: 8px;
-        }
-        
-        /* 全页面播放模式样式 */
-        body.fullpage-mode #sidebar {
-            display: none;
-        }
-        
-        body.fullpage-mode #main {
-            padding: 0;
-        }
-        
-        body.fullpage-mode .player-container {
-            max-width: 100%;
-            width: 100%;
-            height: 100vh;
-            border-radius: 0;
-            padding: 0;
-            display: flex;
-            flex-direction: column;
-            justify-content: center;
-            background: #000;
-            position: relative;
-        }
-        
-        body.fullpage-mode #player {
-            max-width: 100%;
-            width: 100%;
-            height: 100%;
-            border-radius: 0;
-            object-fit: contain;
-            position: absolute;
-            top: 0;
-            left: 0;
-            z-index: 1;
-        }
-        
-        body.fullpage-mode .video-title {
-            display: none;
-        }
-        
-        body.fullpage-mode .controls-container {
-            position: absolute;
-            top: 20px;
-            left: 20px;
-            z-index: 100;
-            margin-bottom: 0;
-        }
-        
-        /* 连续播放按钮 */
-        .autoplay-btn {
-            background: rgba(255,255,255,0.15);
-            color: white;
-            border: 1px solid rgba(255,255,255,0.3);
-            border-radius: 15px;
-            padding: 6px 12px;
-            font-size: 12px;
-            cursor: pointer;
-            display: flex;
-            align-items: center;
-            gap: 5px;
-            backdrop-filter: blur(5px);
-            user-select: none;
-            transition: all 0.3s ease;
-            min-width: 100px;
-        }
-        
-        body.mobile .autoplay-btn {
-            padding: 5px 10px;
-            font-size: 11px;
-            gap: 4px;
-            min-width: 90px;
-        }
-        
-        .autoplay-btn:hover {
-            background: rgba(255,255,255,0.25);
-        }
-        
-        .autoplay-btn:active {
-            background: rgba(255,255,255,0.3);
-        }
-        
-        .autoplay-btn.active {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            border-color: #667eea;
-        }
-        
-        .autoplay-icon {
-            font-size: 12px;
-        }
-        
-        body.mobile .autoplay-icon {
-            font-size: 11px;
-        }
-    </style>
-</head>
-<body class="{{ 'mobile' if is_mobile else 'desktop' }}">
-    <div id="main">
-        <button class="fullscreen-btn" id="fullscreenBtn" onclick="toggleFullscreen()">⛶</button>
-        <div class="player-container" id="playerContainer" style="display: none;">
-            <div class="controls-container">
-                <button class="autoplay-btn" id="autoplayBtn" onclick="toggleAutoplay()">
-                    <span class="autoplay-icon">🔁</span>
-                    <span id="autoplayText">Autoplay</span>
-                </button>
-                <button class="fullpage-btn" id="fullpageBtn" onclick="toggleFullpage()">
-                    <span class="fullpage-icon">⬜</span>
-                    <span id="fullpageText">Fullpage</span>
-                </button>
-            </div>
-            <video id="player" controls playsinline webkit-playsinline></video>
-            <div class="video-title" id="videoTitle"></div>
-        </div>
-        <div class="empty-state" id="emptyState">
-            <div>🎬</div>
-            <div style="margin-top: 10px;">Please select a video to play</div>
-        </div>
-    </div>
-    <div id="sidebar">
-        <div class="sidebar-header" id="sidebarHeader">
-            <span id="libraryTitle">{{ '🔒 Secret Library' if is_secret_mode else '🎬 Video Library' }}</span>
-            <span class="toggle-icon">▼</span>
-        </div>
-        <div class="search-box">
-            <input type="text" id="searchInput" placeholder="🔍 Search videos..." />
-        </div>
-        <div class="scrollable-content">
-            <div class="video-count" id="videoCount">Loading...</div>
-            <div id="videoList"></div>
-        </div>
-    </div>
-    
-    <!-- Password input dialog -->
-    <div id="passwordModal" style="display: none; position: fixed; top: 0; left: 0; right: 0; bottom: 0; background: rgba(0,0,0,0.8); z-index: 10000; align-items: center; justify-content: center;">
-        <div style="background: white; padding: 30px; border-radius: 15px; box-shadow: 0 10px 50px rgba(0,0,0,0.5); max-width: 400px; width: 90%;">
-            <h2 style="margin: 0 0 20px 0; color: #667eea; text-align: center;">🔐 Secret Space</h2>
-            <p style="margin: 0 0 20px 0; color: #666; text-align: center;">Please enter access password</p>
-            <input type="password" id="passwordInput" placeholder="Enter password" style="width: 100%; padding: 12px; border: 2px solid #e0e0e0; border-radius: 8px; font-size: 16px; margin-bottom: 15px; box-sizing: border-box;" />
-            <div style="display: flex; gap: 10px;">
-                <button onclick="cancelPassword()" style="flex: 1; padding: 12px; background: #ccc; color: white; border: none; border-radius: 8px; font-size: 16px; cursor: pointer;">Cancel</button>
-                <button onclick="verifyPassword()" style="flex: 1; padding: 12px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; border: none; border-radius: 8px; font-size: 16px; cursor: pointer;">Confirm</button>
-            </div>
-        </div>
-    </div>
-    
-<script>
-const videoListEl = document.getElementById('videoList');
-const player = document.getElementById('player');
-const playerContainer = document.getElementById('playerContainer');
-const emptyState = document.getElementById('emptyState');
-const videoTitle = document.getElementById('videoTitle');
-const searchInput = document.getElementById('searchInput');
-const videoCount = document.getElementById('videoCount');
-const sidebar = document.getElementById('sidebar');
-const sidebarHeader = document.getElementById('sidebarHeader');
-const passwordModal = document.getElementById('passwordModal');
-const passwordInput = document.getElementById('passwordInput');
-const isMobile = document.body.classList.contains('mobile');
-const isSecretMode = {{ 'true' if is_secret_mode else 'false' }};
-let currentVideo = null;
-let allVideos = [];
-let isAutoplayEnabled = false;
-let isFullpageMode = false;
+# Bytes read from disk per chunk when streaming a range
+STREAM_CHUNK_SIZE = 256 * 1024
+# Async engine: bytes per sendfile() call, so sent bytes are counted as a stream progresses
+SENDFILE_CHUNK_SIZE = 1024 * 1024
+# Browser cache lifetime for files of the normal library (revalidated by ETag afterwards)
+VIDEO_MAX_AGE = 3600
 
-// Get URL parameters
-const urlParams = new URLSearchParams(window.location.search);
-const secretToken = urlParams.get('secretnumber') || '';
+# Page size limits for the paginated /videos API
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+MATCH_COUNT_CACHE_ENTRIES = 256   # Cached match counts of searched/filtered listings
 
-// If in secret mode, listen for page refresh events
-if (isSecretMode) {
-    // Detect if page is refreshed (not first load)
-    const pageAccessedByReload = (
-        (window.performance.navigation && window.performance.navigation.type === 1) ||
-        window.performance
-            .getEntriesByType('navigation')
-            .map((nav) => nav.type)
-            .includes('reload')
-    );
-    
-    if (pageAccessedByReload) {
-        // Page refreshed, notify server to invalidate token
-        fetch('/invalidate-token?secretnumber=' + secretToken, {method: 'POST'});
-    }
-    
-    // Listen for beforeunload event
-    window.addEventListener('beforeunload', function() {
-        // Use sendBeacon to ensure request is sent
-        navigator.sendBeacon('/invalidate-token?secretnumber=' + secretToken);
-    });
-}
+# Virtual faststart for MP4s whose moov box is at the end of the file
+FASTSTART_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+FASTSTART_MAX_MOOV = 64 * 1024 * 1024     # Larger moov boxes are served as-is
+FASTSTART_CACHE_BYTES = 128 * 1024 * 1024 # Memory budget for cached rewritten headers
+FASTSTART_CACHE_ENTRIES = 4096
 
-// Load video list
-const videosUrl = secretToken ? '/videos?secretnumber=' + secretToken : '/videos';
-fetch(videosUrl).then(r => r.json()).then(list => {
-    allVideos = list;
-    renderVideoList(list);
-    videoCount.textContent = `Total ${list.length} videos`;
-    
-    // Auto-load last played video (use different key for secret mode)
-    const storageKey = isSecretMode ? 'lastSecretVideo' : 'lastVideo';
-    const lastVideo = localStorage.getItem(storageKey);
-    if (lastVideo && list.includes(lastVideo)) loadVideo(lastVideo);
-    
-    // Restore autoplay state
-    const autoplayKey = isSecretMode ? 'autoplaySecretEnabled' : 'autoplayEnabled';
-    const savedAutoplay = localStorage.getItem(autoplayKey);
-    if (savedAutoplay === 'true') {
-        isAutoplayEnabled = true;
-        updateAutoplayButton();
-    }
-    
-    // Restore fullpage mode state
-    if (lastVideo && list.includes(lastVideo)) {
-        restoreFullpageMode();
-    }
-});
+# HLS delivery from the MP4 sample index
+HLS_SEGMENT_DURATION = 6          # Target segment length in seconds (cut at keyframes)
+HLS_INDEX_CACHE_BYTES = 64 * 1024 * 1024  # Memory budget per worker process for parsed sample indexes
+HLS_INDEX_CACHE_ENTRIES = 32      # Parsed sample indexes kept in memory
+HLS_INDEX_BUILDS = 2              # Sample indexes parsed at the same time (extra requests wait, then get 503)
 
-function renderVideoList(list) {
-    videoListEl.innerHTML = '';
-    list.forEach(v => {
-        const div = document.createElement('div');
-        div.className = 'video-item';
-        div.innerHTML = `<span class="video-name" title="${v}">${v}</span>`;
-        div.onclick = () => loadVideo(v);
-        if (v === currentVideo) div.classList.add('active');
-        videoListEl.appendChild(div);
-    });
-}
+# Container metadata index (SQLite). Empty path = a file in the system temp directory
+METADATA_DB = ''
+METADATA_PROBE_BYTES = 1024 * 1024  # Matroska/WebM headers are read from this much of the file (other formats: 8 bytes)
+METADATA_SYNC_INTERVAL = 5          # Seconds between checks for catalog changes
 
-function loadVideo(v) {
-    currentVideo = v;
-    const videoUrl = secretToken ? 
-        '/video/' + encodeURIComponent(v) + '?secretnumber=' + secretToken : 
-        '/video/' + encodeURIComponent(v);
-    
-    player.src = videoUrl;
-    videoTitle.textContent = v;
-    
-    // Use different storage key
-    const storageKey = isSecretMode ? 'lastSecretVideo' : 'lastVideo';
-    const timeKey = isSecretMode ? 'secretVideoTime_' + v : 'videoTime_' + v;
-    
-    localStorage.setItem(storageKey, v);
-    player.currentTime = parseFloat(localStorage.getItem(timeKey)) || 0;
-    
-    playerContainer.style.display = 'block';
-    emptyState.style.display = 'none';
-    
-    // Update selected state
-    document.querySelectorAll('.video-item').forEach(item => {
-        item.classList.remove('active');
-        if (item.querySelector('.video-name').textContent === v) {
-            item.classList.add('active');
-        }
-    });
-    
-    // Mobile sidebar no longer auto-collapses
-    // if (isMobile) {
-    //     sidebar.classList.add('collapsed');
-    // }
-    
-    // Restore fullpage mode state
-    restoreFullpageMode();
-    
-    player.play();
+# Block cache for file reads. The budgets are for the whole server and are split evenly
+# between worker processes. 0 disables it.
+BLOCK_CACHE_BYTES = 256 * 1024 * 1024
+BLOCK_CACHE_BLOCK_SIZE = 256 * 1024     # Aligned block size, also the unit read from disk
+BLOCK_CACHE_PIN_BYTES = 64 * 1024 * 1024  # Budget for pinned heads of popular files
+BLOCK_CACHE_HEAD_BYTES = 4 * 1024 * 1024  # Head size pinned per popular file
+BLOCK_CACHE_PIN_AFTER = 3               # Reads of a file's first block before its head is pinned
+BLOCK_CACHE_TRACKED_FILES = 4096        # Files whose head reads are counted
+
+# Readahead hints for sequential streams (posix_fadvise, ignored where unavailable)
+READAHEAD_HINTS = True
+READAHEAD_TRIGGER = 1024 * 1024         # Bytes a range streams before it counts as sequential
+READAHEAD_WINDOW = 8 * 1024 * 1024      # Prefetch this far ahead of the read position
+READAHEAD_KEEP_BEHIND = 16 * 1024 * 1024  # Keep this much behind the position for small seeks back
+READAHEAD_DROP_BEHIND = True            # Drop pages further behind from the page cache
+READAHEAD_GAP = 256 * 1024              # A range starting this close after the previous one continues it
+READAHEAD_IDLE = 30                     # Seconds a client's last position is remembered
+READAHEAD_TRACKED_STREAMS = 4096
+
+# Admission control for video streams (limits are for the whole server, split across workers)
+ADMISSION_MAX_STREAMS = 0               # Concurrent file bodies, 0 = unlimited
+ADMISSION_MAX_QUEUE = 32                # Requests that may wait for a stream slot
+ADMISSION_QUEUE_TIMEOUT = 2.0           # Seconds a request waits before getting 503
+ADMISSION_RETRY_AFTER = 5               # Retry-After seconds sent with 503
+ADMISSION_DISK_READS = 8                # Concurrent disk reads per volume, 0 = unlimited
+
+# Bandwidth shaping in bytes per second, 0 = unlimited (changeable at runtime via /bandwidth)
+BANDWIDTH_GLOBAL_RATE = 0
+BANDWIDTH_CLIENT_RATE = 0               # Per client address
+BANDWIDTH_SMALL_RANGE = 4 * 1024 * 1024 # Ranges up to this size are treated as playback
+BANDWIDTH_SMALL_WEIGHT = 4              # Share multiplier for playback-sized ranges
+BANDWIDTH_BURST = 0.5                   # Seconds of unused bandwidth a bucket may save up
+BANDWIDTH_TRACKED_CLIENTS = 4096        # Slots of the shared per-client bucket table
+BANDWIDTH_CLIENT_PROBE = 8              # Slots searched for a client before evicting the idlest
+
+# Ranges beyond this count in one request are served as a single covering span
+MAX_RANGES = 16
+
+MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.ogg': 'video/ogg',
+    '.mkv': 'video/x-matroska',
+    '.rmvb': 'application/vnd.rn-realmedia-vbr',
+    '.avi': 'video/x-msvideo',
+    '.flv': 'video/x-flv',
+    '.mov': 'video/quicktime'
 }
 
-// Record playback progress
-player.ontimeupdate = function() {
-    if (currentVideo) {
-        const timeKey = isSecretMode ? 'secretVideoTime_' + currentVideo : 'videoTime_' + currentVideo;
-        localStorage.setItem(timeKey, player.currentTime);
-    }
-};
+# Clients allowed to use admin endpoints (transcoding)
+ADMIN_ADDRESSES = ('127.0.0.1', '::1')
+# Slow request logging and sampling profiler: requests whose view takes at least this many
+# seconds are logged with their timing spans; 0 disables both
+PROFILE_SLOW_REQUESTS = 0.0
+PROFILE_SAMPLE_RATE = 0.05       # Fraction of requests run under cProfile
+PROFILE_DIR = ''                 # Where slow sampled requests dump .prof files (empty = temp dir)
+PROFILE_REPORT_LINES = 25        # Functions listed in the logged report
+# Clients allowed to scrape /metrics (add the Prometheus server's address)
+METRICS_ADDRESSES = ADMIN_ADDRESSES
+METRICS_SHARE_INTERVAL = 5       # Seconds between metric snapshots of worker processes
+
+# Transcoding settings (requires ffmpeg)
+FFMPEG_BIN = 'ffmpeg'
+TRANSCODE_EXTENSIONS = ('.rmvb', '.mkv', '.avi', '.flv')
+TRANSCODE_ARGS = ['-c:v', 'libx264', '-crf', '23', '-preset', 'medium',
+                  '-c:a', 'aac', '-b:a', '192k', '-movflags', '+faststart']
+TRANSCODE_THREADS_PER_JOB = 2    # ffmpeg threads per job
+TRANSCODE_MAX_JOBS = 0           # Concurrent jobs per process, 0 = CPU cores / TRANSCODE_THREADS_PER_JOB
+TRANSCODE_STALE_PART = 600       # A .part output untouched this long is a crash leftover
+
+# Thumbnails and seek-preview sprites (requires ffmpeg)
+THUMB_CACHE_DIR = ''             # Empty = a folder in the system temp directory
+THUMB_CACHE_BYTES = 512 * 1024 * 1024
+THUMB_WORKERS = 2                # Concurrent ffmpeg processes per server process
+THUMB_MAX_PENDING = 64           # Further requests get the placeholder without queueing
+THUMB_TIMEOUT = 120              # Seconds before a stuck ffmpeg is killed
+THUMB_RETRY_AFTER = 300          # Seconds before an image that failed to render is tried again
+THUMB_RESCAN_INTERVAL = 60       # Re-read the cache directory (images other workers added or evicted)
+THUMB_WIDTH = 320
+THUMB_SEEK = 10                  # Seconds into the video to look for a thumbnail frame
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+SPRITE_TILE_WIDTH = 160
+
+# Production server settings
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 80
+SERVER_WORKERS = 0               # Worker processes, 0 = one per CPU core (always 1 on Windows)
+SERVER_THREADS = 32              # Request threads per worker (async engine: view threads)
+SERVER_ENGINE = 'threaded'       # 'threaded' or 'async' (asyncio event loop, sendfile streaming)
+SERVER_BACKLOG = 1024            # Listen queue length
+SERVER_KEEPALIVE_TIMEOUT = 15    # Idle seconds before a keep-alive connection is closed
+SERVER_IDLE_POLL = 0.25          # Threaded engine: how often idle connections check for waiting ones
+SERVER_REQUEST_TIMEOUT = 60      # Socket timeout while a request is being handled
+SERVER_GRACEFUL_TIMEOUT = 30     # Seconds active requests get to finish on shutdown
+MAX_REQUEST_BODY = 1024 * 1024   # Largest request body the async engine reads
+
+# Secret space token lifetimes and store limits
+TOKEN_LINK_TTL = 300            # Unused access link: user has 5 minutes to click it
+TOKEN_USED_TTL = 12 * 3600      # A token keeps granting /videos and /video access this long
+TOKEN_STORE_MAX = 10000         # Size cap, entries closest to expiry are evicted first (their tokens then stop working)
+TOKEN_SWEEP_INTERVAL = 60       # Seconds between background sweeps
+
+# Key for signing secret space tokens. Leave empty to generate one per start; set the same
+# value on every server process that should accept each other's tokens.
+TOKEN_SECRET = ''
+# Optional SQLite file shared by all server processes for the one-time-use and revocation
+# state of tokens. Empty keeps that state in memory (single process).
+TOKEN_REVOCATION_DB = ''
+
+_token_key = (TOKEN_SECRET or secrets.token_hex(32)).encode('utf-8')
+
+# Signed secret space tokens: "v1.<scope>.<link_expires>.<expires>.<nonce>.<signature>".
+# Any process holding TOKEN_SECRET can verify one without shared state; only the small
+# used/revoked list (keyed by nonce) needs sharing for one-time-use semantics.
+def _sign(payload):
+    digest = hmac.new(_token_key, payload.encode('ascii'), hashlib.sha256).digest()[:18]
+    return base64.urlsafe_b64encode(digest).decode('ascii')
+
+def issue_token(scope='secret'):
+    now = int(time.time())
+    nonce = secrets.token_urlsafe(12)
+    payload = f'v1.{scope}.{now + TOKEN_LINK_TTL:x}.{now + TOKEN_USED_TTL:x}.{nonce}'
+    return payload + '.' + _sign(payload)
+
+# Check signature, scope and expiry; returns (nonce, link_expires, expires) or None
+def verify_token(token, scope='secret'):
+    parts = token.split('.')
+    if len(parts) != 6 or parts[0] != 'v1' or parts[1] != scope:
+        return None
+    payload, signature = token.rsplit('.', 1)
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        link_expires, expires = int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if time.time() >= expires:
+        return None
+    return parts[4], link_expires, expires
+
+# Thread-safe in-process store of used/revoked token nonces. Lookups are a dict access;
+# expiry is tracked in a min-heap of (expires, key) so sweeping costs O(log n) per expired
+# entry. Heap entries made stale by overwrites are skipped lazily and compacted when they
+# pile up. When the size cap forces out entries that have not expired, the store keeps the
+# latest evicted expiry as a floor: a token expiring at or before it that has no entry is
+# treated as revoked, so eviction never makes a used link reusable or a revoked token valid.
+class TokenStore:
+    USED = 'used'
+    REVOKED = 'revoked'
+
+    def __init__(self, max_size=TOKEN_STORE_MAX):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.tokens = {}    # key -> (state, expires)
+        self.heap = []      # (expires, key)
+        self.floor = 0      # Latest expiry evicted by the size cap
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def _put(self, key, state, expires):
+        self.tokens[key] = (state, expires)
+        heapq.heappush(self.heap, (expires, key))
+        if len(self.heap) > 2 * len(self.tokens) + 64:
+            self.heap = [(exp, k) for k, (_, exp) in self.tokens.items()]
+            heapq.heapify(self.heap)
+        while len(self.tokens) > self.max_size:
+            self._pop_oldest()
+
+    # Pop the soonest-expiring live entry (skipping stale heap entries)
+    def _pop_oldest(self):
+        while self.heap:
+            expires, key = heapq.heappop(self.heap)
+            entry = self.tokens.get(key)
+            if entry is not None and entry[1] == expires:
+                del self.tokens[key]
+                self.floor = max(self.floor, expires)
+                return key
+        return None
+
+    # State of a key (USED, REVOKED) or None; expires is the token's own expiry, checked
+    # against the eviction floor when the key has no entry
+    def state(self, key, expires=None):
+        entry = self.tokens.get(key)
+        if entry is None:
+            if expires is not None and expires <= self.floor:
+                return self.REVOKED
+            return None
+        if entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    # Atomically mark a key used; False if it was already used or revoked
+    def mark_used(self, key, expires):
+        with self.lock:
+            if self.state(key, expires) is not None:
+                return False
+            self._put(key, self.USED, expires)
+            return True
+
+    def revoke(self, key, expires):
+        with self.lock:
+            self._put(key, self.REVOKED, expires)
+
+    # Drop every expired entry
+    def sweep(self):
+        now = time.time()
+        removed = 0
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                expires, key = heapq.heappop(self.heap)
+                entry = self.tokens.get(key)
+                if entry is not None and entry[1] == expires:
+                    del self.tokens[key]
+                    removed += 1
+        return removed
+
+# Same interface as TokenStore, backed by an SQLite file so several server processes
+# share one used/revoked list. Rows are tiny and expire with their token.
+class SqliteTokenStore:
+    USED = TokenStore.USED
+    REVOKED = TokenStore.REVOKED
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        # Not kept: connections must not be inherited by forked workers
+        db = sqlite3.connect(self.path, timeout=5)
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, state TEXT NOT NULL, expires REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS tokens_expires ON tokens (expires)')
+        db.close()
+
+    # One connection per thread
+    def _connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+            self.local.db = db
+        return db
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+
+    # expires is accepted for interface compatibility: nothing is evicted before it expires
+    def state(self, key, expires=None):
+        row = self._connect().execute('SELECT state FROM tokens WHERE key = ? AND expires > ?',
+                                      (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def mark_used(self, key, expires):
+        with self._connect() as db:
+            db.execute('DELETE FROM tokens WHERE key = ? AND expires <= ?', (key, time.time()))
+            cur = db.execute('INSERT OR IGNORE INTO tokens VALUES (?, ?, ?)', (key, self.USED, expires))
+            return cur.rowcount == 1
+
+    def revoke(self, key, expires):
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)', (key, self.REVOKED, expires))
+
+    def sweep(self):
+        with self._connect() as db:
+            return db.execute('DELETE FROM tokens WHERE expires <= ?', (time.time(),)).rowcount
+
+token_store = SqliteTokenStore(TOKEN_REVOCATION_DB) if TOKEN_REVOCATION_DB else TokenStore()
+token_sweeper = None
+
+def start_token_sweeper():
+    global token_sweeper
+    if token_sweeper is not None:
+        return
+    token_sweeper = threading.Thread(target=_sweep_tokens_forever, name='token-sweeper', daemon=True)
+    token_sweeper.start()
+
+def _sweep_tokens_forever():
+    while True:
+        time.sleep(TOKEN_SWEEP_INTERVAL)
+        try:
+            clean_expired_tokens()
+        except Exception:
+            app.logger.exception('Token sweep failed')
+
+# Generate a secret space access link token
+def issue_secret_token():
+    start_token_sweeper()
+    return issue_token('secret')
+
+# Use a token for the homepage: returns 'ok' once, then 'used'; 'invalid' if bad/expired
+def consume_secret_token(token):
+    verified = verify_token(token, 'secret')
+    if verified is None:
+        return 'invalid'
+    nonce, link_expires, expires = verified
+    state = token_store.state(nonce, expires)
+    if state == TokenStore.REVOKED:
+        return 'invalid'
+    if state == TokenStore.USED:
+        return 'used'
+    if time.time() >= link_expires:
+        return 'invalid'
+    return 'ok' if token_store.mark_used(nonce, expires) else 'used'
+
+# Token is correctly signed, unexpired and not revoked (used tokens included)
+def is_valid_secret_token(token):
+    verified = verify_token(token, 'secret')
+    return verified is not None and token_store.state(verified[0], verified[2]) != TokenStore.REVOKED
+
+def revoke_secret_token(token):
+    verified = verify_token(token, 'secret')
+    if verified is not None:
+        token_store.revoke(verified[0], verified[2])
+
+# In-process metrics rendered in the Prometheus text format. Counters and histograms are
+# plain numbers updated under one lock; gauges are read from callbacks at scrape time.
+# With several worker processes each worker writes a snapshot to a shared directory every
+# METRICS_SHARE_INTERVAL seconds and /metrics merges them. Counters of workers that have
+# exited are kept so totals never go backwards.
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}          # name -> (type, help, histogram buckets or gauge aggregation)
+        self.values = {}        # (name, labels) -> number, or [bucket counts..., sum, count]
+        self.gauges = []        # (name, callback returning [(labels, value)])
+        self.directory = None   # Snapshot directory shared by worker processes
+        self.thread = None
+
+    def counter(self, name, help_text):
+        self.meta[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self.meta[name] = ('histogram', help_text, tuple(buckets))
+
+    # aggregate: 'sum' across processes, or 'max' for values every process sees alike
+    def gauge(self, name, help_text, callback, aggregate='sum'):
+        self.meta[name] = ('gauge', help_text, aggregate)
+        self.gauges.append((name, callback))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.meta[name][2]
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(buckets) + 3)
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            values = [[name, list(labels), value if not isinstance(value, list) else list(value)]
+                      for (name, labels), value in self.values.items()]
+        for name, callback in self.gauges:
+            try:
+                values.extend([name, list(labels), value] for labels, value in callback())
+            except Exception:
+                pass
+        return values
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    # Write this process's snapshot for the other workers to merge
+    def dump(self):
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def start(self):
+        if self.directory is None or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.dump()
+            except OSError:
+                pass
+            time.sleep(METRICS_SHARE_INTERVAL)
+
+    def _collect(self):
+        snapshots = [(True, self.snapshot())]
+        if self.directory is not None:
+            for entry in os.scandir(self.directory):
+                pid = entry.name[:-5]
+                if not entry.name.endswith('.json') or not pid.isdigit() or int(pid) == os.getpid():
+                    continue
+                try:
+                    os.kill(int(pid), 0)
+                    alive = True
+                except OSError:
+                    alive = False
+                try:
+                    with open(entry.path) as f:
+                        snapshots.append((alive, json.load(f)))
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for alive, values in snapshots:
+            for name, labels, value in values:
+                meta = self.meta.get(name)
+                if meta is None or (meta[0] == 'gauge' and not alive):
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = value
+                elif isinstance(value, list):
+                    merged[key] = [a + b for a, b in zip(current, value)]
+                elif meta[0] == 'gauge' and meta[2] == 'max':
+                    merged[key] = max(current, value)
+                else:
+                    merged[key] = current + value
+        return merged
+
+    def render(self):
+        merged = self._collect()
+        lines = []
+        for name, (kind, help_text, extra) in self.meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(merged.items()):
+                if metric != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{name}{_prometheus_labels(labels)} {_prometheus_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(extra + (float('inf'),), value):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                    lines.append(f'{name}_bucket{_prometheus_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_prometheus_labels(labels)} {_prometheus_value(value[-2])}')
+                lines.append(f'{name}_count{_prometheus_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+def _prometheus_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RANGE_SIZE_BUCKETS = tuple(4 ** i * 1024 for i in range(12))    # 1 KiB .. 4 GiB
+
+metrics = Metrics()
+metrics.histogram('video_share_request_duration_seconds',
+                  'Time until the view returned its response, by route', LATENCY_BUCKETS)
+metrics.histogram('video_share_time_to_first_byte_seconds',
+                  'Time from request start to the first body byte of file responses', LATENCY_BUCKETS)
+metrics.counter('video_share_bytes_served_total', 'File body bytes sent, by library')
+metrics.histogram('video_share_stream_read_seconds', 'Time per file body spent reading (seek, disk, cache)',
+                  LATENCY_BUCKETS + (30, 60, 300, 900, 3600))
+metrics.histogram('video_share_stream_send_seconds', 'Time per file body spent writing to the client',
+                  LATENCY_BUCKETS + (30, 60, 300, 900, 3600))
+metrics.histogram('video_share_range_request_bytes', 'Bytes requested by Range requests', RANGE_SIZE_BUCKETS)
+metrics.histogram('video_share_catalog_scan_duration_seconds', 'Library scan duration', LATENCY_BUCKETS)
+metrics.gauge('video_share_active_connections', 'Open client connections',
+              lambda: [((), active_connections[0])])
+
+# Open connections of this process (updated by the serving engines)
+active_connections = [0]
+active_connections_lock = threading.Lock()
+
+def count_connection(delta):
+    with active_connections_lock:
+        active_connections[0] += delta
+
+# Timing spans of the current request, sent back in the Server-Timing header. Outside a
+# request (background threads) spans cost one perf_counter pair and are dropped.
+@contextlib.contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            spans = g.setdefault('spans', {})
+            spans[name] = spans.get(name, 0.0) + time.perf_counter() - start
+
+# Short hash of a listing or metadata table, the same in every worker process
+def content_digest(value):
+    return hashlib.blake2b(repr(value).encode(), digest_size=8).hexdigest()
+
+# Video catalog: scans a library once, keeps the result in memory and refreshes it
+# incrementally. A directory is only re-listed when its mtime changed, unchanged
+# directories are just stat'ed. The directory table is saved to a snapshot file so a
+# restart can serve the previous listing at once and revalidate it in the background.
+# With several worker processes only the one holding the snapshot's lock file scans; the
+# others reload the snapshot it saves whenever the listing changes. Snapshots are gzipped
+# JSON in a directory only this user can write, and are fully validated when loaded.
+CATALOG_SNAPSHOT_FORMAT = 2
+
+# Private per-user directory for the server's own state files
+def app_data_dir():
+    base = os.environ.get('LOCALAPPDATA') if os.name == 'nt' else os.environ.get('XDG_CACHE_HOME')
+    return os.path.join(base or os.path.join(os.path.expanduser('~'), '.cache'), 'video_share')
+
+# Create a directory readable only by this user; refuse one that others could write into
+def private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.name != 'nt':
+        st = os.stat(path)
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            raise PermissionError(f'{path} is writable by other users')
+    return path
+
+def _snapshot_name(name):
+    return isinstance(name, str) and name not in ('', '.', '..') and '/' not in name and os.sep not in name
+
+def _snapshot_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# Directory table from a decoded snapshot, in the form _scan_dir builds; None when malformed
+def parse_snapshot_dirs(raw):
+    if not isinstance(raw, dict) or '' not in raw:
+        return None
+    dirs = {}
+    for rel_dir, value in raw.items():
+        if not isinstance(rel_dir, str) or (rel_dir and not all(_snapshot_name(p) for p in rel_dir.split('/'))):
+            return None
+        if not isinstance(value, list) or len(value) != 3:
+            return None
+        mtime, files, subdirs = value
+        if not isinstance(mtime, int) or not isinstance(files, list) or not isinstance(subdirs, list):
+            return None
+        parsed = []
+        for f in files:
+            if not (isinstance(f, list) and len(f) == 3 and _snapshot_name(f[0])
+                    and isinstance(f[1], int) and _snapshot_number(f[2])):
+                return None
+            parsed.append(tuple(f))
+        if not all(_snapshot_name(name) for name in subdirs):
+            return None
+        dirs[rel_dir] = (mtime, parsed, subdirs)
+    return dirs
+
+class VideoCatalog:
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()       # Guards the published snapshot
+        self.scan_lock = threading.Lock()  # Only one scan at a time
+        self.wakeup = threading.Event()
+        self.dirs = {}      # rel_dir -> (mtime_ns, [(name, size, mtime)], [subdir names])
+        self.entries = []   # [(rel_path, size, mtime)] in walk order
+        self.paths = []
+        self.version = 0
+        self.instance = secrets.token_hex(4)
+        self.digest = content_digest([])
+        self.views = {}     # sort -> (version, sorted entries, sort keys)
+        self.changed = time.time()  # When the snapshot contents last changed
+        self.scanned = False
+        self.last_scan = 0
+        self.last_full_scan = 0
+        self.last_scan_duration = 0.0
+        self.observer = None
+        self.thread = None
+        self.saved_dirs = None
+        self.saved_version = None
+        self.last_save = 0
+        self.lock_file = None       # Held while this process is the one scanning
+        self.snapshot_mtime = None  # Snapshot file last loaded by a following process
+
+    # Scan the library; unchanged directories are reused unless full=True
+    def refresh(self, full=False):
+        with self.scan_lock:
+            start = time.perf_counter()
+            old_dirs = {} if full else self.dirs
+            new_dirs = {}
+            entries = []
+            if os.path.isdir(self.root):
+                self._scan_dir('', old_dirs, new_dirs, entries)
+            duration = time.perf_counter() - start
+
+            with self.lock:
+                if entries != self.entries or not self.scanned:
+                    self.entries = entries
+                    self.paths = [e[0] for e in entries]
+                    self.digest = content_digest(entries)
+                    self.version += 1
+                    self.changed = time.time()
+                self.dirs = new_dirs
+                self.scanned = True
+                self.last_scan = time.time()
+                if full:
+                    self.last_full_scan = self.last_scan
+                self.last_scan_duration = duration
+            metrics.observe('video_share_catalog_scan_duration_seconds', duration,
+                            library='secret' if self.root == SECRET_VIDEO_ROOT else 'normal',
+                            kind='full' if full else 'incremental')
+            app.logger.info('Catalog %s: %s scan, %d videos in %.3fs',
+                            self.root, 'full' if full else 'incremental', len(entries), duration)
+            return duration
+
+    def snapshot_path(self):
+        directory = CATALOG_SNAPSHOT_DIR or os.path.join(app_data_dir(), 'catalog')
+        return os.path.join(directory, 'catalog-' + hashlib.sha1(os.fsencode(self.root)).hexdigest()[:16] + '.json.gz')
+
+    # Publish the listing saved by a previous run; the first background refresh
+    # revalidates it. Returns False when there is no usable snapshot. follow=True is a
+    # worker that does not scan picking up a newer snapshot from the one that does.
+    def load_snapshot(self, follow=False):
+        try:
+            private_dir(os.path.dirname(self.snapshot_path()))
+            with open(self.snapshot_path(), 'rb') as f:
+                st = os.fstat(f.fileno())
+                if os.name != 'nt' and (st.st_uid != os.getuid() or st.st_mode & 0o022):
+                    return False
+                mtime = (st.st_ino, st.st_mtime_ns)   # Every save replaces the file
+                if follow and mtime == self.snapshot_mtime:
+                    return True
+                snapshot = json.loads(gzip.decompress(f.read()))
+        except (OSError, EOFError, ValueError):
+            return False
+        if not isinstance(snapshot, dict) or snapshot.get('format') != CATALOG_SNAPSHOT_FORMAT:
+            return False
+        saved, full_scan = snapshot.get('saved'), snapshot.get('full_scan')
+        dirs = parse_snapshot_dirs(snapshot.get('dirs'))
+        if snapshot.get('root') != self.root or dirs is None or not _snapshot_number(saved) or not _snapshot_number(full_scan):
+            return False
+        entries = []
+        self._walk_dirs('', dirs, entries)
+        with self.lock:
+            self.snapshot_mtime = mtime
+            if self.scanned and not follow:
+                return True
+            if entries != self.entries or not self.scanned:
+                self.entries = entries
+                self.paths = [e[0] for e in entries]
+                self.digest = content_digest(entries)
+                self.version += 1
+                self.changed = saved
+            self.dirs = self.saved_dirs = dirs
+            self.saved_version = self.version
+            self.scanned = True
+            self.last_scan = self.last_save = saved
+            # Keep the full-rescan schedule of the previous run
+            self.last_full_scan = full_scan
+        if not follow:
+            self.wakeup.set()
+            app.logger.info('Catalog %s: %d videos from snapshot, revalidating', self.root, len(entries))
+        return True
+
+    # Write the directory table atomically (several workers may save at once)
+    def save_snapshot(self):
+        with self.lock:
+            if not self.scanned:
+                return
+            dirs, version, full_scan = self.dirs, self.version, self.last_full_scan
+        path = self.snapshot_path()
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            private_dir(os.path.dirname(path))
+            snapshot = {'format': CATALOG_SNAPSHOT_FORMAT, 'root': self.root, 'saved': time.time(),
+                        'full_scan': full_scan, 'dirs': dirs}
+            data = gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'), 1)
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o600)
+            with open(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except (OSError, ValueError):
+            app.logger.exception('Could not save catalog snapshot %s', path)
+            return
+        self.saved_dirs = dirs
+        self.saved_version = version
+        self.last_save = time.time()
+
+    # Rebuild the walk-order entry list from a directory table without touching the disk
+    def _walk_dirs(self, rel_dir, dirs, entries):
+        cached = dirs.get(rel_dir)
+        if cached is None:
+            return
+        prefix = rel_dir + '/' if rel_dir else ''
+        for name, size, file_mtime in cached[1]:
+            entries.append((prefix + name, size, file_mtime))
+        for name in cached[2]:
+            self._walk_dirs(prefix + name, dirs, entries)
+
+    def _scan_dir(self, rel_dir, old_dirs, new_dirs, entries):
+        abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        try:
+            mtime = os.stat(abs_dir).st_mtime_ns
+        except OSError:
+            return
+        cached = old_dirs.get(rel_dir)
+        if cached and cached[0] == mtime:
+            files, subdirs = cached[1], cached[2]
+        else:
+            files, subdirs = [], []
+            try:
+                with os.scandir(abs_dir) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir():
+                                if not entry.is_symlink():
+                                    subdirs.append(entry.name)
+                            elif entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                                st = entry.stat()
+                                files.append((entry.name, st.st_size, st.st_mtime))
+                        except OSError:
+                            continue
+            except OSError:
+                return
+            files.sort()
+            subdirs.sort()
+        new_dirs[rel_dir] = (mtime, files, subdirs)
+
+        prefix = rel_dir + '/' if rel_dir else ''
+        for name, size, file_mtime in files:
+            entries.append((prefix + name, size, file_mtime))
+        for name in subdirs:
+            self._scan_dir(prefix + name, old_dirs, new_dirs, entries)
+
+    # Validator for the published snapshot. It is derived from the listing itself: forked
+    # workers refresh independently, so their version counters do not line up.
+    def etag(self):
+        return f'catalog-{self.digest}'
+
+    # Return the current snapshot, scanning synchronously only on first use
+    def get_paths(self):
+        if not self.scanned:
+            self.refresh(full=True)
+        if self.thread is None:
+            self.start()
+        return self.paths
+
+    # Snapshot sorted by one of SORT_KEYS, cached until the catalog version changes
+    # (metadata sorts are also rebuilt when the metadata index changes)
+    def sorted_view(self, sort):
+        with self.lock:
+            entries, version = self.entries, self.version
+            if sort in METADATA_SORT_KEYS:
+                version = (version, metadata_index.version)
+            view = self.views.get(sort)
+            if view is not None and view[0] == version:
+                return view[1], view[2]
+        if sort in METADATA_SORT_KEYS:
+            metadata_key = METADATA_SORT_KEYS[sort]
+            sort_key = lambda e: metadata_key(e, metadata_index.get(self.root, e))
+        else:
+            sort_key = SORT_KEYS[sort]
+        items = sorted(entries, key=sort_key)
+        keys = [sort_key(e) for e in items]
+        with self.lock:
+            if self.version == (version[0] if isinstance(version, tuple) else version):
+                self.views[sort] = (version, items, keys)
+        return items, keys
+
+    def status(self):
+        with self.lock:
+            return {
+                'root': self.root,
+                'count': len(self.entries),
+                'version': self.version,
+                'last_scan': self.last_scan,
+                'last_scan_duration': round(self.last_scan_duration, 6),
+                'scanning': self.lock_file is not None or fcntl is None,
+                'watching': self.observer is not None,
+            }
+
+    # Start the background refresher
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='catalog-refresh', daemon=True)
+        self.thread.start()
+        metadata_index.start()
+
+    # Become the process that scans this library, unless another live process already is
+    def _lead(self):
+        if fcntl is None or self.lock_file is not None:
+            return True
+        path = self.snapshot_path() + '.lock'
+        try:
+            private_dir(os.path.dirname(path))
+            lock_file = open(path, 'a')
+        except OSError:
+            return True
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        # Scanning from here on: pick up what the previous scanner saved, then watch
+        self.load_snapshot(follow=True)
+        self._watch()
+        return True
+
+    # Filesystem watcher that wakes the refresher, when watchdog is installed
+    def _watch(self):
+        if Observer is not None and os.path.isdir(self.root):
+            try:
+                self.observer = Observer()
+                self.observer.schedule(_CatalogEventHandler(self), self.root, recursive=True)
+                self.observer.daemon = True
+                self.observer.start()
+            except Exception:
+                self.observer = None
+
+    def _run(self):
+        while True:
+            if not self._lead():
+                time.sleep(CATALOG_FOLLOW_INTERVAL)
+                self.load_snapshot(follow=True)
+                continue
+            woken = self.wakeup.wait(CATALOG_REFRESH_INTERVAL)
+            if woken:
+                # Let a burst of filesystem events settle before rescanning
+                time.sleep(CATALOG_WATCH_DEBOUNCE)
+                self.wakeup.clear()
+            full = time.time() - self.last_full_scan >= CATALOG_FULL_RESCAN_INTERVAL
+            try:
+                self.refresh(full=full)
+            except Exception:
+                app.logger.exception('Catalog refresh failed for %s', self.root)
+            # Listing changes are saved at once so other workers see them; directory mtime
+            # changes alone wait for the interval
+            if self.version != self.saved_version or (
+                    time.time() - self.last_save >= CATALOG_SNAPSHOT_INTERVAL and self.dirs != self.saved_dirs):
+                self.save_snapshot()
+
+if Observer is not None:
+    class _CatalogEventHandler(FileSystemEventHandler):
+        def __init__(self, catalog):
+            self.catalog = catalog
+
+        def on_any_event(self, event):
+            self.catalog.wakeup.set()
+
+# Server-side sort orders for the paginated /videos API; the path makes every key unique
+SORT_KEYS = {
+    'name': lambda e: (e[0].casefold(), e[0]),
+    'mtime': lambda e: (e[2], e[0]),
+    'size': lambda e: (e[1], e[0]),
+}
+
+catalogs = {}
+catalogs_lock = threading.Lock()
+
+def get_catalog(is_secret=False):
+    with catalogs_lock:
+        catalog = catalogs.get(is_secret)
+        if catalog is None:
+            catalog = catalogs[is_secret] = VideoCatalog(SECRET_VIDEO_ROOT if is_secret else VIDEO_ROOT)
+        return catalog
+
+def save_catalog_snapshots():
+    with catalogs_lock:
+        loaded = list(catalogs.values())
+    for catalog in loaded:
+        if catalog.dirs != catalog.saved_dirs:
+            catalog.save_snapshot()
+
+# Get video list
+def get_video_list(is_secret=False):
+    with span('catalog'):
+        return get_catalog(is_secret).get_paths()
+
+# Container metadata (duration, resolution, codecs, bitrate) read from MP4 and Matroska/WebM
+# headers without decoding. Results persist in SQLite keyed by (library root, path) and are
+# re-probed only when a file's size or mtime changes, so restarts and other worker processes
+# reuse them. A background thread follows catalog changes; lookups are served from memory.
+# Only the worker holding the index's lock file probes; the others load what it stored, so
+# a new library is read from disk once and not once per worker.
+METADATA_FIELDS = ('container', 'duration', 'width', 'height', 'video_codec', 'audio_codec', 'bitrate', 'mime')
+
+class MetadataIndex:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.rows = {}          # root -> {rel_path: (size, mtime, *METADATA_FIELDS)}
+        self.synced = {}        # root -> (catalog instance, catalog version, prober or db data_version)
+        self.digests = {}       # root -> content_digest of its rows (for validators)
+        self.version = 0
+        self.changed = time.time()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.ready = False
+        self.lock_file = None   # Open while this process is the prober
+
+    # Become the probing process if no other process is (the lock dies with its holder)
+    def _lead(self):
+        if fcntl is None or self.lock_file is not None:
+            return True
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def _connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+            if not self.ready:
+                with db:
+                    db.execute('CREATE TABLE IF NOT EXISTS metadata (root TEXT, path TEXT, size INTEGER, mtime REAL, '
+                               'container TEXT, duration REAL, width INTEGER, height INTEGER, video_codec TEXT, '
+                               'audio_codec TEXT, bitrate INTEGER, mime TEXT, PRIMARY KEY (root, path))')
+                self.ready = True
+            self.local.db = db
+        return db
+
+    # Metadata dict for a catalog entry, None when not probed yet or stale
+    def get(self, root, entry):
+        row = self.rows.get(root, {}).get(entry[0])
+        if row is None or row[0] != entry[1] or row[1] != entry[2]:
+            return None
+        return dict(zip(METADATA_FIELDS, row[2:]))
+
+    # Bring the index in line with a catalog snapshot: probe new and changed files,
+    # forget removed ones. Rows another process already stored are reused; with
+    # probe=False only those are loaded and nothing is written.
+    def sync(self, catalog, probe=True):
+        with catalog.lock:
+            entries = catalog.entries
+        root = catalog.root
+        db = self._connect()
+        stored = {r[0]: r[1:] for r in db.execute(
+            'SELECT path, size, mtime, ' + ', '.join(METADATA_FIELDS) + ' FROM metadata WHERE root = ?', (root,))}
+        rows = {}
+        probed = []
+        for rel_path, size, mtime in entries:
+            row = stored.get(rel_path)
+            if row is None or row[0] != size or row[1] != mtime:
+                if not probe:
+                    continue
+                info = probe_video(os.path.join(root, rel_path), size)
+                row = (size, mtime) + tuple(info.get(k) for k in METADATA_FIELDS)
+                probed.append((root, rel_path) + row)
+            rows[rel_path] = row
+        removed = [(root, p) for p in stored if p not in rows] if probe else []
+        if probed or removed:
+            with db:
+                db.executemany('INSERT OR REPLACE INTO metadata VALUES (' + ', '.join('?' * 12) + ')', probed)
+                db.executemany('DELETE FROM metadata WHERE root = ? AND path = ?', removed)
+        with self.lock:
+            if rows != self.rows.get(root):
+                self.rows[root] = rows
+                self.digests[root] = content_digest(rows)
+                self.version += 1
+                self.changed = time.time()
+        return len(probed)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='metadata-index', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                prober = self._lead()
+                # Followers reload when the prober has committed something new
+                db_version = True if prober else self._connect().execute('PRAGMA data_version').fetchone()[0]
+            except (OSError, sqlite3.Error):
+                app.logger.exception('Metadata index %s unavailable', self.path)
+                prober, db_version = False, None
+            with catalogs_lock:
+                current = [c for c in catalogs.values() if c.scanned]
+            for catalog in current:
+                state = (catalog.instance, catalog.version, db_version)
+                if db_version is not None and self.synced.get(catalog.root) != state:
+                    try:
+                        start = time.perf_counter()
+                        probed = self.sync(catalog, probe=prober)
+                        self.synced[catalog.root] = state
+                        if probed:
+                            app.logger.info('Metadata %s: probed %d files in %.3fs',
+                                            catalog.root, probed, time.perf_counter() - start)
+                    except Exception:
+                        app.logger.exception('Metadata sync failed for %s', catalog.root)
+            self.wakeup.wait(METADATA_SYNC_INTERVAL)
+            self.wakeup.clear()
+
+metadata_index = MetadataIndex(METADATA_DB or os.path.join(tempfile.gettempdir(), 'video_share_metadata.db'))
+
+# Sort orders that need probed metadata; unknown values sort first
+METADATA_SORT_KEYS = {
+    'duration': lambda e, m: (m['duration'] if m and m['duration'] is not None else -1.0, e[0]),
+    'resolution': lambda e, m: ((m['width'] or 0) * (m['height'] or 0) if m else -1, e[0]),
+    'bitrate': lambda e, m: (m['bitrate'] if m and m['bitrate'] is not None else -1, e[0]),
+}
+
+# Probe one file; always returns a dict (only mime is set for unrecognised containers)
+def probe_video(file_path, size):
+    info = {'mime': MIME_TYPES.get(os.path.splitext(file_path)[1].lower(), 'video/mp4')}
+    try:
+        with open(file_path, 'rb') as f:
+            # Most formats are identified by 8 bytes; only Matroska needs a larger head
+            head = f.read(8)
+            if head[:4] == b'\x1a\x45\xdf\xa3':
+                info.update(probe_matroska(head + f.read(METADATA_PROBE_BYTES - 8)))
+            elif head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide'):
+                info.update(probe_mp4(f, size))
+    except (OSError, MP4Error, struct.error, IndexError, ValueError):
+        pass
+    if info.get('duration'):
+        info['bitrate'] = int(size * 8 / info['duration'])
+    return info
+
+def _mime_with_codecs(base, *codecs):
+    codecs = [c for c in codecs if c]
+    return f'{base}; codecs="{", ".join(codecs)}"' if codecs else base
+
+def probe_mp4(f, size):
+    moov = next((b for b in iter_file_boxes(f, 0, size) if b[0] == b'moov'), None)
+    if moov is None or moov[3] > FASTSTART_MAX_MOOV:
+        raise MP4Error('no usable moov box')
+    f.seek(moov[1] + moov[2])
+    data = f.read(moov[3] - moov[2])
+    info = {'container': 'mp4'}
+    boxes = {b[0]: b for b in iter_buffer_boxes(data, 0, len(data))}
+    if b'mvhd' in boxes:
+        start = boxes[b'mvhd'][1] + boxes[b'mvhd'][2]
+        if data[start] == 1:
+            timescale, duration = struct.unpack_from('>IQ', data, start + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', data, start + 12)
+        if timescale:
+            info['duration'] = duration / timescale
+    for trak in iter_buffer_boxes(data, 0, len(data)):
+        if trak[0] != b'trak':
+            continue
+        found = {b[0]: b for b in find_boxes(data, trak[1] + trak[2], trak[1] + trak[3], (b'tkhd', b'hdlr', b'stsd'))}
+        if b'hdlr' not in found or b'stsd' not in found:
+            continue
+        _, pos, header_size, box_size = found[b'hdlr']
+        handler = data[pos + header_size + 8:pos + header_size + 12]
+        _, pos, header_size, box_size = found[b'stsd']
+        entry = pos + header_size + 8
+        codec = mp4_codec_string(data, entry)
+        if handler == b'vide' and 'video_codec' not in info:
+            info['video_codec'] = codec
+            if b'tkhd' in found:
+                _, pos, _, box_size = found[b'tkhd']
+                width, height = struct.unpack_from('>II', data, pos + box_size - 8)
+                info['width'], info['height'] = width >> 16, height >> 16
+        elif handler == b'soun' and 'audio_codec' not in info:
+            info['audio_codec'] = codec
+    base = 'video/mp4' if 'video_codec' in info or 'audio_codec' not in info else 'audio/mp4'
+    info['mime'] = _mime_with_codecs(base, info.get('video_codec'), info.get('audio_codec'))
+    return info
+
+# RFC 6381 codec string for the first sample entry of an stsd box
+def mp4_codec_string(data, entry):
+    size, fourcc = struct.unpack_from('>I4s', data, entry)
+    name = fourcc.decode('latin-1').strip()
+    try:
+        return _mp4_codec_details(data, entry, size, fourcc, name)
+    except (MP4Error, struct.error, IndexError):
+        return name
+
+def _mp4_codec_details(data, entry, size, fourcc, name):
+    if fourcc in (b'avc1', b'avc3'):
+        # Visual sample entry header is 78 bytes; avcC follows
+        for box in iter_buffer_boxes(data, entry + 86, entry + size):
+            if box[0] == b'avcC':
+                start = box[1] + box[2]
+                return f'{name}.{data[start + 1]:02x}{data[start + 2]:02x}{data[start + 3]:02x}'
+    elif fourcc == b'mp4a':
+        # Audio sample entry header is 28 bytes; esds follows
+        for box in iter_buffer_boxes(data, entry + 36, entry + size):
+            if box[0] == b'esds':
+                return 'mp4a.' + _esds_codec(data, box[1] + box[2] + 4, box[1] + box[3])
+        return 'mp4a.40.2'
+    elif fourcc == b'Opus':
+        return 'opus'
+    return name
+
+# Object type (and AAC audio object type) from an MPEG-4 ES descriptor
+def _esds_codec(data, pos, end):
+    object_type = None
+    while pos < end:
+        tag = data[pos]
+        pos += 1
+        length = 0
+        for _ in range(4):
+            b = data[pos]
+            pos += 1
+            length = (length << 7) | (b & 0x7f)
+            if not b & 0x80:
+                break
+        if tag == 0x03:
+            flags = data[pos + 2]
+            pos += 3 + (2 if flags & 0x80 else 0)
+            if flags & 0x40:
+                pos += 1 + data[pos]
+            if flags & 0x20:
+                pos += 2
+        elif tag == 0x04:
+            object_type = data[pos]
+            pos += 13
+        elif tag == 0x05 and object_type == 0x40:
+            return f'40.{data[pos] >> 3}'
+        else:
+            pos += length
+    return f'{object_type:x}' if object_type is not None else '40.2'
+
+MATROSKA_CODECS = {
+    'V_VP8': 'vp8', 'V_VP9': 'vp9', 'V_AV1': 'av01', 'V_MPEG4/ISO/AVC': 'avc1',
+    'V_MPEGH/ISO/HEVC': 'hvc1', 'A_OPUS': 'opus', 'A_VORBIS': 'vorbis', 'A_AAC': 'mp4a.40.2',
+}
+
+def _ebml_vint(data, pos, keep_marker=False):
+    first = data[pos]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ValueError('invalid EBML length')
+    value = first if keep_marker else first & (0xff >> length)
+    for b in data[pos + 1:pos + length]:
+        value = (value << 8) | b
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, pos + length, unknown
+
+def _ebml_elements(data, pos, end):
+    while pos < end:
+        element_id, pos, _ = _ebml_vint(data, pos, keep_marker=True)
+        size, pos, unknown = _ebml_vint(data, pos)
+        stop = len(data) if unknown else min(pos + size, len(data))
+        yield element_id, pos, stop
+        if element_id == 0x1F43B675:    # Cluster: media data starts, headers are done
+            return
+        pos = stop
+
+def _ebml_uint(data, start, end):
+    return int.from_bytes(data[start:end], 'big')
+
+def probe_matroska(data):
+    info = {'container': 'matroska'}
+    doc_type = 'matroska'
+    timecode_scale = 1000000
+    duration = None
+    for element_id, start, end in _ebml_elements(data, 0, len(data)):
+        if element_id == 0x1A45DFA3:
+            for child, s, e in _ebml_elements(data, start, end):
+                if child == 0x4282:
+                    doc_type = data[s:e].decode('ascii', 'replace').rstrip('\0')
+        elif element_id == 0x18538067:
+            for child, s, e in _ebml_elements(data, start, end):
+                if child == 0x1549A966:
+                    for field, fs, fe in _ebml_elements(data, s, e):
+                        if field == 0x2AD7B1:
+                            timecode_scale = _ebml_uint(data, fs, fe)
+                        elif field == 0x4489:
+                            duration = struct.unpack('>f' if fe - fs == 4 else '>d', data[fs:fe])[0]
+                elif child == 0x1654AE6B:
+                    for track, ts, te in _ebml_elements(data, s, e):
+                        if track == 0xAE:
+                            _probe_matroska_track(data, ts, te, info)
+    info['container'] = doc_type
+    if duration is not None:
+        info['duration'] = duration * timecode_scale / 1e9
+    if doc_type == 'webm':
+        info['mime'] = _mime_with_codecs('video/webm', info.get('video_codec'), info.get('audio_codec'))
+    else:
+        info['mime'] = 'video/x-matroska'
+    return info
+
+def _probe_matroska_track(data, start, end, info):
+    track_type, codec_id, width, height = None, None, None, None
+    for field, s, e in _ebml_elements(data, start, end):
+        if field == 0x83:
+            track_type = _ebml_uint(data, s, e)
+        elif field == 0x86:
+            codec_id = data[s:e].decode('ascii', 'replace').rstrip('\0')
+        elif field == 0xE0:
+            for video_field, vs, ve in _ebml_elements(data, s, e):
+                if video_field == 0xB0:
+                    width = _ebml_uint(data, vs, ve)
+                elif video_field == 0xBA:
+                    height = _ebml_uint(data, vs, ve)
+    codec = MATROSKA_CODECS.get(codec_id, (codec_id or '').lower() or None)
+    if track_type == 1 and 'video_codec' not in info:
+        info['video_codec'] = codec
+        info['width'], info['height'] = width, height
+    elif track_type == 2 and 'audio_codec' not in info:
+        info['audio_codec'] = codec
+
+# Conditional GET: True when the client's cached copy is still current
+def is_not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+# Strong validator for a file: changes whenever it is replaced, resized or touched
+def file_etag(st):
+    return f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+# Clean expired tokens (run periodically by the token store's sweeper thread)
+def clean_expired_tokens():
+    with span('token-sweep'):
+        return token_store.sweep()
+
+INDEX_CSS = '''
+* { margin: 0; padding: 0; box-sizing: border-box; }
+
+body {
+    display: flex;
+    height: 100vh;
+    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    overflow: hidden;
+}
+
+body.mobile {
+    flex-direction: column;
+}
+
+#sidebar {
+    width: 320px;
+    background: rgba(255, 255, 255, 0.95);
+    backdrop-filter: blur(10px);
+    box-shadow: 2px 0 20px rgba(0,0,0,0.1);
+    overflow: hidden;
+    transition: all 0.3s ease;
+    z-index: 100;
+    display: flex;
+    flex-direction: column;
+}
+
+/* Mobile sidebar styles */
+body.mobile #sidebar {
+    width: 100%;
+    height: 40vh;
+    position: fixed;
+    bottom: 0;
+    left: 0;
+    border-radius: 20px 20px 0 0;
+    box-shadow: 0 -5px 30px rgba(0,0,0,0.3);
+    transform: translateY(0);
+    display: flex;
+    flex-direction: column;
+    overflow: hidden;
+}
+
+body.mobile #sidebar.collapsed {
+    transform: translateY(calc(100% - 60px));
+}
+
+#sidebar::-webkit-scrollbar { width: 8px; }
+#sidebar::-webkit-scrollbar-track { background: #f1f1f1; }
+#sidebar::-webkit-scrollbar-thumb { 
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    border-radius: 4px;
+}
+#sidebar::-webkit-scrollbar-thumb:hover { background: #764ba2; }
+
+.scrollable-content::-webkit-scrollbar { width: 6px; }
+.scrollable-content::-webkit-scrollbar-track { background: #f1f1f1; }
+.scrollable-content::-webkit-scrollbar-thumb { 
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    border-radius: 3px;
+}
+.scrollable-content::-webkit-scrollbar-thumb:hover { background: #764ba2; }
+
+.sidebar-header {
+    padding: 25px 20px;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    color: white;
+    font-size: 24px;
+    font-weight: 600;
+    text-align: center;
+    box-shadow: 0 2px 10px rgba(0,0,0,0.15);
+    position: relative;
+    cursor: pointer;
+    user-select: none;
+    flex-shrink: 0;
+}
+
+body.mobile .sidebar-header {
+    padding: 15px 20px;
+    font-size: 18px;
+    display: flex;
+    align-items: center;
+    justify-content: space-between;
+    flex-shrink: 0;
+}
+
+.toggle-icon {
+    display: none;
+    font-size: 20px;
+    transition: transform 0.3s;
+}
+
+body.mobile .toggle-icon {
+    display: block;
+}
+
+body.mobile #sidebar.collapsed .toggle-icon {
+    transform: rotate(180deg);
+}
+
+.search-box {
+    padding: 15px;
+    background: white;
+    border-bottom: 1px solid #e0e0e0;
+    flex-shrink: 0;
+}
+
+body.mobile .search-box {
+    flex-shrink: 0;
+}
+
+.search-box input {
+    width: 100%;
+    padding: 10px 15px;
+    border: 2px solid #e0e0e0;
+    border-radius: 25px;
+    font-size: 14px;
+    outline: none;
+    transition: all 0.3s;
+}
+
+.search-box input:focus {
+    border-color: #667eea;
+    box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
+}
+
+#videoList {
+    --row-height: 50px;
+    position: relative;
+    flex-shrink: 0;
+}
+
+body.mobile #videoList {
+    --row-height: 44px;
+}
+
+.video-item {
+    padding: 0 20px;
+    height: var(--row-height);
+    cursor: pointer;
+    border-bottom: 1px solid #f0f0f0;
+    transition: all 0.3s ease;
+    display: flex;
+    align-items: center;
+    gap: 12px;
+    position: absolute;
+    left: 0;
+    right: 0;
+}
+
+body.mobile .video-item {
+    padding: 0 15px;
+    font-size: 14px;
+}
+
+.video-item::before {
+    content: '▶';
+    font-size: 12px;
+    color: #667eea;
+    opacity: 0;
+    transition: opacity 0.3s;
+}
+
+body.mobile .video-item::before {
+    opacity: 1;
+    font-size: 10px;
+}
+
+.video-item:hover {
+    background: linear-gradient(90deg, rgba(102, 126, 234, 0.1) 0%, rgba(118, 75, 162, 0.1) 100%);
+    padding-left: 25px;
+    transform: translateX(5px);
+}
+
+body.mobile .video-item:hover {
+    transform: none;
+    padding-left: 15px;
+}
+
+.video-item:hover::before { opacity: 1; }
+
+.video-item:active {
+    background: rgba(102, 126, 234, 0.2);
+}
+
+.video-item.active {
+    background: linear-gradient(90deg, rgba(102, 126, 234, 0.15) 0%, rgba(118, 75, 162, 0.15) 100%);
+    border-left: 4px solid #667eea;
+    font-weight: 600;
+    color: #667eea;
+}
+
+.video-thumb {
+    width: 64px;
+    height: 36px;
+    object-fit: cover;
+    border-radius: 4px;
+    background: #e8eaf6;
+    flex-shrink: 0;
+}
+
+body.mobile .video-thumb {
+    width: 52px;
+    height: 30px;
+}
+
+.video-name {
+    flex: 1;
+    overflow: hidden;
+    text-overflow: ellipsis;
+    white-space: nowrap;
+    font-size: 14px;
+}
+
+#main {
+    flex: 1;
+    display: flex;
+    flex-direction: column;
+    align-items: center;
+    justify-content: center;
+    padding: 30px;
+    gap: 20px;
+}
+
+body.mobile #main {
+    padding: 15px;
+    padding-bottom: calc(40vh + 15px);
+    height: 100vh;
+    overflow-y: auto;
+}
+
+.player-container {
+    background: rgba(0, 0, 0, 0.8);
+    border-radius: 15px;
+    padding: 20px;
+    box-shadow: 0 10px 40px rgba(0,0,0,0.3);
+    max-width: 90%;
+    backdrop-filter: blur(10px);
+}
+
+body.mobile .player-container {
+    width: 100%;
+    max-width: 100%;
+    padding: 15px;
+    border-radius: 10px;
+}
+
+#player {
+    width: 100%;
+    max-width: 1000px;
+    border-radius: 10px;
+    box-shadow: 0 5px 20px rgba(0,0,0,0.4);
+}
+
+body.mobile #player {
+    max-width: 100%;
+    border-radius: 8px;
+}
+
+.video-title {
+    color: white;
+    font-size: 20px;
+    font-weight: 600;
+    text-align: center;
+    margin-top: 15px;
+    text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
+    max-width: 1000px;
+}
+
+body.mobile .video-title {
+    font-size: 16px;
+    margin-top: 10px;
+    padding: 0 10px;
+}
+
+.empty-state {
+    color: white;
+    font-size: 18px;
+    text-align: center;
+    opacity: 0.8;
+}
+
+body.mobile .empty-state {
+    font-size: 16px;
+    padding: 20px;
+}
+
+/* 可滚动内容容器 */
+.scrollable-content {
+    flex: 1;
+    overflow-y: auto;
+    overflow-x: hidden;
+    position: relative;
+}
+
+body.mobile .scrollable-content {
+    display: flex;
+    flex-direction: column;
+}
+
+.video-count {
+    padding: 10px 20px;
+    background: rgba(102, 126, 234, 0.1);
+    text-align: center;
+    font-size: 13px;
+    color: #667eea;
+    font-weight: 500;
+    flex-shrink: 0;
+}
+
+body.mobile .video-count {
+    padding: 8px 15px;
+    font-size: 12px;
+    flex-shrink: 0;
+}
+
+.search-box {
+    padding: 15px;
+    background: white;
+    border-bottom: 1px solid #e0e0e0;
+}
+
+body.mobile .search-box {
+    padding: 10px 15px;
+}
+
+.search-box input {
+    width: 100%;
+    padding: 10px 15px;
+    border: 2px solid #e0e0e0;
+    border-radius: 25px;
+    font-size: 14px;
+    outline: none;
+    transition: all 0.3s;
+}
+
+body.mobile .search-box input {
+    padding: 8px 12px;
+    font-size: 13px;
+}
+
+/* 全屏播放按钮 */
+.fullscreen-btn {
+    display: none;
+    position: absolute;
+    top: 20px;
+    right: 20px;
+    background: rgba(0,0,0,0.6);
+    color: white;
+    border: none;
+    border-radius: 50%;
+    width: 45px;
+    height: 45px;
+    font-size: 20px;
+    cursor: pointer;
+    z-index: 10;
+    backdrop-filter: blur(5px);
+}
+
+body.mobile .fullscreen-btn {
+    display: block;
+}
+
+.fullscreen-btn:active {
+    background: rgba(0,0,0,0.8);
+}
+
+/* 全页面播放按钮 */
+.fullpage-btn {
+    background: rgba(255,255,255,0.15);
+    color: white;
+    border: 1px solid rgba(255,255,255,0.3);
+    border-radius: 15px;
+    padding: 6px 12px;
+    font-size: 12px;
+    cursor: pointer;
+    display: flex;
+    align-items: center;
+    gap: 5px;
+    backdrop-filter: blur(5px);
+    user-select: none;
+    transition: all 0.3s ease;
+}
+
+body.mobile .fullpage-btn {
+    padding: 5px 10px;
+    font-size: 11px;
+    gap: 4px;
+}
+
+.fullpage-btn:hover {
+    background: rgba(255,255,255,0.25);
+}
+
+.fullpage-btn:active {
+    background: rgba(255,255,255,0.3);
+}
+
+.fullpage-btn.active {
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    border-color: #667eea;
+}
+
+.fullpage-icon {
+    font-size: 12px;
+}
+
+body.mobile .fullpage-icon {
+    font-size: 11px;
+}
+
+/* 按钮容器 */
+.controls-container {
+    display: flex;
+    gap: 10px;
+    margin-bottom: 10px;
+    position: relative;
+    z-index: 10;
+}
+
+body.mobile .controls-container {
+    gap: 8px;
+}
+
+/* 全页面播放模式样式 */
+body.fullpage-mode #sidebar {
+    display: none;
+}
+
+body.fullpage-mode #main {
+    padding: 0;
+}
+
+body.fullpage-mode .player-container {
+    max-width: 100%;
+    width: 100%;
+    height: 100vh;
+    border-radius: 0;
+    padding: 0;
+    display: flex;
+    flex-direction: column;
+    justify-content: center;
+    background: #000;
+    position: relative;
+}
+
+body.fullpage-mode #player {
+    max-width: 100%;
+    width: 100%;
+    height: 100%;
+    border-radius: 0;
+    object-fit: contain;
+    position: absolute;
+    top: 0;
+    left: 0;
+    z-index: 1;
+}
+
+body.fullpage-mode .video-title {
+    display: none;
+}
+
+body.fullpage-mode .controls-container {
+    position: absolute;
+    top: 20px;
+    left: 20px;
+    z-index: 100;
+    margin-bottom: 0;
+}
+
+/* 连续播放按钮 */
+.autoplay-btn {
+    background: rgba(255,255,255,0.15);
+    color: white;
+    border: 1px solid rgba(255,255,255,0.3);
+    border-radius: 15px;
+    padding: 6px 12px;
+    font-size: 12px;
+    cursor: pointer;
+    display: flex;
+    align-items: center;
+    gap: 5px;
+    backdrop-filter: blur(5px);
+    user-select: none;
+    transition: all 0.3s ease;
+    min-width: 100px;
+}
+
+body.mobile .autoplay-btn {
+    padding: 5px 10px;
+    font-size: 11px;
+    gap: 4px;
+    min-width: 90px;
+}
+
+.autoplay-btn:hover {
+    background: rgba(255,255,255,0.25);
+}
+
+.autoplay-btn:active {
+    background: rgba(255,255,255,0.3);
+}
+
+.autoplay-btn.active {
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    border-color: #667eea;
+}
+
+.autoplay-icon {
+    font-size: 12px;
+}
+
+body.mobile .autoplay-icon {
+    font-size: 11px;
+}
+'''
+
+INDEX_JS = '''
+const videoListEl = document.getElementById('videoList');
+const player = document.getElementById('player');
+const playerContainer = document.getElementById('playerContainer');
+const emptyState = document.getElementById('emptyState');
+const videoTitle = document.getElementById('videoTitle');
+const searchInput = document.getElementById('searchInput');
+const videoCount = document.getElementById('videoCount');
+const sidebar = document.getElementById('sidebar');
+const sidebarHeader = document.getElementById('sidebarHeader');
+const passwordModal = document.getElementById('passwordModal');
+const passwordInput = document.getElementById('passwordInput');
+const isMobile = document.body.classList.contains('mobile');
+const isSecretMode = document.body.dataset.secret === 'true';
+const scrollContainer = document.querySelector('.scrollable-content');
+let currentVideo = null;
+let currentIndex = -1;
+let allVideos = [];
+let allVideosLower = [];
+let videoIndex = new Map();
+let filteredIndices = [];
+let searchTimer = null;
+let isAutoplayEnabled = false;
+let isFullpageMode = false;
+
+// Get URL parameters
+const urlParams = new URLSearchParams(window.location.search);
+const secretToken = urlParams.get('secretnumber') || '';
+
+// If in secret mode, listen for page refresh events
+if (isSecretMode) {
+    // Detect if page is refreshed (not first load)
+    const pageAccessedByReload = (
+        (window.performance.navigation && window.performance.navigation.type === 1) ||
+        window.performance
+            .getEntriesByType('navigation')
+            .map((nav) => nav.type)
+            .includes('reload')
+    );
+
+    if (pageAccessedByReload) {
+        // Page refreshed, notify server to invalidate token
+        fetch('/invalidate-token?secretnumber=' + secretToken, {method: 'POST'});
+    }
+
+    // Listen for beforeunload event
+    window.addEventListener('beforeunload', function() {
+        // Use sendBeacon to ensure request is sent
+        navigator.sendBeacon('/invalidate-token?secretnumber=' + secretToken);
+    });
+}
+
+// Load video list
+const videosUrl = secretToken ? '/videos?secretnumber=' + secretToken : '/videos';
+fetch(videosUrl).then(r => r.json()).then(list => {
+    allVideos = list;
+    allVideosLower = list.map(v => v.toLowerCase());
+    videoIndex = new Map(list.map((v, i) => [v, i]));
+    filteredIndices = list.map((v, i) => i);
+    renderVideoList();
+    videoCount.textContent = `Total ${list.length} videos`;
+
+    // Auto-load last played video (use different key for secret mode)
+    const storageKey = isSecretMode ? 'lastSecretVideo' : 'lastVideo';
+    const lastVideo = localStorage.getItem(storageKey);
+    if (lastVideo && videoIndex.has(lastVideo)) loadVideo(lastVideo);
+
+    // Restore autoplay state
+    const autoplayKey = isSecretMode ? 'autoplaySecretEnabled' : 'autoplayEnabled';
+    const savedAutoplay = localStorage.getItem(autoplayKey);
+    if (savedAutoplay === 'true') {
+        isAutoplayEnabled = true;
+        updateAutoplayButton();
+    }
+
+    // Restore fullpage mode state
+    if (lastVideo && videoIndex.has(lastVideo)) {
+        restoreFullpageMode();
+    }
+});
+
+// Virtual list: only the rows inside the visible window (plus a small overscan) exist
+// in the DOM, so rendering cost does not grow with library size
+const ROW_OVERSCAN = 10;
+let rowHeight = 0;
+
+function getRowHeight() {
+    if (!rowHeight) {
+        rowHeight = parseFloat(getComputedStyle(videoListEl).getPropertyValue('--row-height')) || 50;
+    }
+    return rowHeight;
+}
+
+function renderVideoList() {
+    const height = getRowHeight();
+    videoListEl.style.height = (filteredIndices.length * height) + 'px';
+
+    const viewTop = scrollContainer.scrollTop - videoListEl.offsetTop;
+    const first = Math.max(0, Math.floor(viewTop / height) - ROW_OVERSCAN);
+    const last = Math.min(filteredIndices.length, Math.ceil((viewTop + scrollContainer.clientHeight) / height) + ROW_OVERSCAN);
+
+    const fragment = document.createDocumentFragment();
+    for (let row = first; row < last; row++) {
+        const index = filteredIndices[row];
+        const v = allVideos[index];
+        const div = document.createElement('div');
+        div.className = 'video-item';
+        div.style.top = (row * height) + 'px';
+        div.dataset.index = index;
+        const thumb = document.createElement('img');
+        thumb.className = 'video-thumb';
+        thumb.loading = 'lazy';
+        thumb.alt = '';
+        thumb.src = thumbUrl(v);
+        div.appendChild(thumb);
+        const name = document.createElement('span');
+        name.className = 'video-name';
+        name.title = v;
+        name.textContent = v;
+        div.appendChild(name);
+        if (index === currentIndex) div.classList.add('active');
+        fragment.appendChild(div);
+    }
+    videoListEl.replaceChildren(fragment);
+}
+
+let renderQueued = false;
+scrollContainer.addEventListener('scroll', function() {
+    if (renderQueued) return;
+    renderQueued = true;
+    requestAnimationFrame(() => {
+        renderQueued = false;
+        renderVideoList();
+    });
+}, { passive: true });
+window.addEventListener('resize', renderVideoList);
+
+// One delegated click handler instead of one per row
+videoListEl.addEventListener('click', function(e) {
+    const item = e.target.closest('.video-item');
+    if (item) loadVideo(allVideos[parseInt(item.dataset.index, 10)]);
+});
+
+function thumbUrl(v) {
+    return secretToken ?
+        '/thumb/' + encodeURIComponent(v) + '?secretnumber=' + secretToken :
+        '/thumb/' + encodeURIComponent(v);
+}
+
+function loadVideo(v) {
+    currentVideo = v;
+    currentIndex = videoIndex.has(v) ? videoIndex.get(v) : -1;
+    const videoUrl = secretToken ? 
+        '/video/' + encodeURIComponent(v) + '?secretnumber=' + secretToken : 
+        '/video/' + encodeURIComponent(v);
+
+    player.poster = thumbUrl(v);
+    player.src = videoUrl;
+    videoTitle.textContent = v;
+
+    // Use different storage key
+    const storageKey = isSecretMode ? 'lastSecretVideo' : 'lastVideo';
+    const timeKey = isSecretMode ? 'secretVideoTime_' + v : 'videoTime_' + v;
+
+    localStorage.setItem(storageKey, v);
+    player.currentTime = parseFloat(localStorage.getItem(timeKey)) || 0;
+
+    playerContainer.style.display = 'block';
+    emptyState.style.display = 'none';
+
+    // Update selected state (only rendered rows need touching)
+    videoListEl.querySelectorAll('.video-item').forEach(item => {
+        item.classList.toggle('active', parseInt(item.dataset.index, 10) === currentIndex);
+    });
+
+    // Mobile sidebar no longer auto-collapses
+    // if (isMobile) {
+    //     sidebar.classList.add('collapsed');
+    // }
+
+    // Restore fullpage mode state
+    restoreFullpageMode();
+
+    player.play();
+}
+
+// Record playback progress
+player.ontimeupdate = function() {
+    if (currentVideo) {
+        const timeKey = isSecretMode ? 'secretVideoTime_' + currentVideo : 'videoTime_' + currentVideo;
+        localStorage.setItem(timeKey, player.currentTime);
+    }
+};
+
+// Video ended event
+player.onended = function() {
+    if (isAutoplayEnabled && allVideos.length > 0) {
+        if (currentIndex !== -1 && currentIndex < allVideos.length - 1) {
+            // Play next video
+            loadVideo(allVideos[currentIndex + 1]);
+        } else if (currentIndex === allVideos.length - 1) {
+            // If last video, loop to first
+            loadVideo(allVideos[0]);
+        }
+    }
+};
+
+// Toggle autoplay state
+function toggleAutoplay() {
+    isAutoplayEnabled = !isAutoplayEnabled;
+    updateAutoplayButton();
+
+    // Save state to localStorage
+    const autoplayKey = isSecretMode ? 'autoplaySecretEnabled' : 'autoplayEnabled';
+    localStorage.setItem(autoplayKey, isAutoplayEnabled.toString());
+}
+
+// Update autoplay button state
+function updateAutoplayButton() {
+    const btn = document.getElementById('autoplayBtn');
+    const text = document.getElementById('autoplayText');
+
+    if (isAutoplayEnabled) {
+        btn.classList.add('active');
+        text.textContent = 'Autoplay: ON';
+    } else {
+        btn.classList.remove('active');
+        text.textContent = 'Autoplay: OFF';
+    }
+}
+
+// Search functionality
+searchInput.addEventListener('input', function() {
+    const keyword = this.value.toLowerCase();
+
+    // Detect if trigger word is entered
+    if (keyword === 'secret' && !isSecretMode) {
+        // Show password dialog
+        passwordModal.style.display = 'flex';
+        passwordInput.value = '';
+        passwordInput.focus();
+        // Clear search box
+        this.value = '';
+        return;
+    }
+
+    // Debounce filtering so fast typing only filters once
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => filterVideos(keyword), 150);
+});
+
+function filterVideos(keyword) {
+    filteredIndices = [];
+    for (let i = 0; i < allVideosLower.length; i++) {
+        if (allVideosLower[i].includes(keyword)) filteredIndices.push(i);
+    }
+    scrollContainer.scrollTop = 0;
+    renderVideoList();
+    videoCount.textContent = keyword ?
+        `${filteredIndices.length} / ${allVideos.length} videos` :
+        `Total ${allVideos.length} videos`;
+}
+
+// Password verification
+function verifyPassword() {
+    const password = passwordInput.value;
+
+    fetch('/verify-secret', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ password: password })
+    })
+    .then(r => r.json())
+    .then(data => {
+        if (data.success) {
+            // Password correct, redirect to secret space
+            window.location.href = '/?secretnumber=' + data.token;
+        } else {
+            alert('Wrong password!');
+            passwordInput.value = '';
+            passwordInput.focus();
+        }
+    })
+    .catch(err => {
+        alert('Verification failed, please try again');
+    });
+}
+
+// Cancel password input
+function cancelPassword() {
+    passwordModal.style.display = 'none';
+    passwordInput.value = '';
+}
+
+// Submit password on Enter key
+passwordInput.addEventListener('keypress', function(e) {
+    if (e.key === 'Enter') {
+        verifyPassword();
+    }
+});
+
+// Keyboard shortcuts (desktop only)
+if (!isMobile) {
+    document.addEventListener('keydown', function(e) {
+        if (e.target.tagName === 'INPUT') return;
+
+        // Prevent keyboard repeat (when holding key)
+        if (e.repeat) return;
+
+        if (e.key === ' ') {
+            e.preventDefault();
+            if (player.paused) player.play();
+            else player.pause();
+        }
+
+        // F key toggles fullpage mode
+        if (e.key === 'f' || e.key === 'F') {
+            e.preventDefault();
+            if (currentVideo) {
+                toggleFullpage();
+            }
+        }
+
+        // Esc key exits fullpage mode
+        if (e.key === 'Escape' && isFullpageMode) {
+            e.preventDefault();
+            toggleFullpage();
+        }
+    });
+}
+
+// Mobile sidebar toggle
+if (isMobile) {
+    sidebarHeader.addEventListener('click', function() {
+        sidebar.classList.toggle('collapsed');
+    });
+
+    // No longer auto-collapse on initialization
+    // setTimeout(() => {
+    //     if (!currentVideo) {
+    //         sidebar.classList.add('collapsed');
+    //     }
+    // }, 2000);
+}
+
+// Fullscreen functionality
+function toggleFullscreen() {
+    if (!document.fullscreenElement) {
+        if (player.requestFullscreen) {
+            player.requestFullscreen();
+        } else if (player.webkitRequestFullscreen) {
+            player.webkitRequestFullscreen();
+        } else if (player.webkitEnterFullscreen) {
+            player.webkitEnterFullscreen();
+        }
+    } else {
+        if (document.exitFullscreen) {
+            document.exitFullscreen();
+        } else if (document.webkitExitFullscreen) {
+            document.webkitExitFullscreen();
+        }
+    }
+}
+
+// Fullpage mode functionality
+function toggleFullpage() {
+    isFullpageMode = !isFullpageMode;
+    updateFullpageButton();
+
+    // Save state
+    const storageKey = isSecretMode ? 'fullpageSecretMode' : 'fullpageMode';
+    localStorage.setItem(storageKey, isFullpageMode.toString());
+}
+
+// Update fullpage button state
+function updateFullpageButton() {
+    const btn = document.getElementById('fullpageBtn');
+    const icon = document.querySelector('.fullpage-icon');
+    const text = document.getElementById('fullpageText');
+
+    if (isFullpageMode) {
+        document.body.classList.add('fullpage-mode');
+        btn.classList.add('active');
+        icon.textContent = '◱';
+        text.textContent = 'Fullpage: ON';
+    } else {
+        document.body.classList.remove('fullpage-mode');
+        btn.classList.remove('active');
+        icon.textContent = '⬜';
+        text.textContent = 'Fullpage: OFF';
+    }
+}
+
+// Restore fullpage mode state
+function restoreFullpageMode() {
+    const storageKey = isSecretMode ? 'fullpageSecretMode' : 'fullpageMode';
+    const savedFullpage = localStorage.getItem(storageKey);
+    if (savedFullpage === 'true' && currentVideo) {
+        isFullpageMode = true;
+        updateFullpageButton();
+    }
+}
+
+// Prevent double-tap zoom on mobile
+if (isMobile) {
+    let lastTouchEnd = 0;
+    document.addEventListener('touchend', function(e) {
+        const now = Date.now();
+        if (now - lastTouchEnd <= 300) {
+            e.preventDefault();
+        }
+        lastTouchEnd = now;
+    }, false);
+}
+'''
+
+INDEX_TEMPLATE = '''
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Video Sharing Center</title>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
+    <link rel="stylesheet" href="{{ css_url }}">
+</head>
+<body class="{{ 'mobile' if is_mobile else 'desktop' }}" data-secret="{{ 'true' if is_secret_mode else 'false' }}">
+    <div id="main">
+        <button class="fullscreen-btn" id="fullscreenBtn" onclick="toggleFullscreen()">⛶</button>
+        <div class="player-container" id="playerContainer" style="display: none;">
+            <div class="controls-container">
+                <button class="autoplay-btn" id="autoplayBtn" onclick="toggleAutoplay()">
+                    <span class="autoplay-icon">🔁</span>
+                    <span id="autoplayText">Autoplay</span>
+                </button>
+                <button class="fullpage-btn" id="fullpageBtn" onclick="toggleFullpage()">
+                    <span class="fullpage-icon">⬜</span>
+                    <span id="fullpageText">Fullpage</span>
+                </button>
+            </div>
+            <video id="player" controls playsinline webkit-playsinline></video>
+            <div class="video-title" id="videoTitle"></div>
+        </div>
+        <div class="empty-state" id="emptyState">
+            <div>🎬</div>
+            <div style="margin-top: 10px;">Please select a video to play</div>
+        </div>
+    </div>
+    <div id="sidebar">
+        <div class="sidebar-header" id="sidebarHeader">
+            <span id="libraryTitle">{{ '🔒 Secret Library' if is_secret_mode else '🎬 Video Library' }}</span>
+            <span class="toggle-icon">▼</span>
+        </div>
+        <div class="search-box">
+            <input type="text" id="searchInput" placeholder="🔍 Search videos..." />
+        </div>
+        <div class="scrollable-content">
+            <div class="video-count" id="videoCount">Loading...</div>
+            <div id="videoList"></div>
+        </div>
+    </div>
+    
+    <!-- Password input dialog -->
+    <div id="passwordModal" style="display: none; position: fixed; top: 0; left: 0; right: 0; bottom: 0; background: rgba(0,0,0,0.8); z-index: 10000; align-items: center; justify-content: center;">
+        <div style="background: white; padding: 30px; border-radius: 15px; box-shadow: 0 10px 50px rgba(0,0,0,0.5); max-width: 400px; width: 90%;">
+            <h2 style="margin: 0 0 20px 0; color: #667eea; text-align: center;">🔐 Secret Space</h2>
+            <p style="margin: 0 0 20px 0; color: #666; text-align: center;">Please enter access password</p>
+            <input type="password" id="passwordInput" placeholder="Enter password" style="width: 100%; padding: 12px; border: 2px solid #e0e0e0; border-radius: 8px; font-size: 16px; margin-bottom: 15px; box-sizing: border-box;" />
+            <div style="display: flex; gap: 10px;">
+                <button onclick="cancelPassword()" style="flex: 1; padding: 12px; background: #ccc; color: white; border: none; border-radius: 8px; font-size: 16px; cursor: pointer;">Cancel</button>
+                <button onclick="verifyPassword()" style="flex: 1; padding: 12px; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; border: none; border-radius: 8px; font-size: 16px; cursor: pointer;">Confirm</button>
+            </div>
+        </div>
+    </div>
+    
+<script src="{{ js_url }}"></script>
+</body>
+</html>
+'''
+
+# Fingerprinted static assets: served under a content-hash name with a long-lived immutable
+# cache policy, so the HTML shell stays tiny and repeat visits skip the CSS/JS entirely
+STATIC_ASSET_MAX_AGE = 365 * 24 * 3600
+
+def asset_name(stem, ext, content):
+    return f'{stem}.{hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]}.{ext}'
+
+CSS_URL = '/assets/' + asset_name('app', 'css', INDEX_CSS)
+JS_URL = '/assets/' + asset_name('app', 'js', INDEX_JS)
+
+# Asset name -> (mimetype, {content-coding: body}), compressed on first use
+static_assets = {}
+static_assets_lock = threading.Lock()
+
+# The page only varies by (is_mobile, is_secret_mode) and the asset names it links to,
+# so the template hash is a stable validator
+INDEX_TEMPLATE_HASH = hashlib.sha1((INDEX_TEMPLATE + CSS_URL + JS_URL).encode('utf-8')).hexdigest()[:16]
+
+# Pre-rendered index pages: (is_mobile, is_secret_mode) -> {content-coding: body}
+index_pages = {}
+index_pages_lock = threading.Lock()
+
+# Compress a body once with every content-coding we can serve
+def precompress(body):
+    variants = {'identity': body, 'gzip': gzip.compress(body, 9)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(body, quality=11)
+    return variants
+
+# Render the four index variants and their compressed copies (done once)
+def get_index_pages():
+    if index_pages:
+        return index_pages
+    with index_pages_lock:
+        if not index_pages:
+            pages = {}
+            with app.app_context():
+                for is_mobile in (False, True):
+                    for is_secret_mode in (False, True):
+                        with span('render'):
+                            html = render_template_string(INDEX_TEMPLATE, is_mobile=is_mobile, is_secret_mode=is_secret_mode,
+                                                          css_url=CSS_URL, js_url=JS_URL)
+                        pages[(is_mobile, is_secret_mode)] = precompress(html.encode('utf-8'))
+            index_pages.update(pages)
+    return index_pages
+
+def get_static_assets():
+    if static_assets:
+        return static_assets
+    with static_assets_lock:
+        if not static_assets:
+            static_assets.update({
+                CSS_URL.rsplit('/', 1)[1]: ('text/css', precompress(INDEX_CSS.encode('utf-8'))),
+                JS_URL.rsplit('/', 1)[1]: ('application/javascript', precompress(INDEX_JS.encode('utf-8'))),
+            })
+    return static_assets
+
+# Pick the best precompressed variant the client accepts
+def negotiate_encoding():
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return 'identity'
+
+@app.route('/')
+def index():
+    user_agent = request.headers.get('User-Agent', '').lower()
+    is_mobile = any(x in user_agent for x in ['mobile', 'android', 'iphone', 'ipad', 'ipod'])
+    
+    # Check if there's a secret space token
+    secret_token = request.args.get('secretnumber', '')
+    is_secret_mode = False
+    
+    if secret_token:
+        # Only unused tokens can access; consuming marks the token as used so the
+        # link cannot be used to access the homepage again
+        with span('token'):
+            token_status = consume_secret_token(secret_token)
+        if token_status == 'ok':
+            is_secret_mode = True
+        elif token_status == 'used':
+            # Token already used, don't allow access again
+            return render_template_string('<script>alert("Access link has expired and cannot be reused!"); window.location.href="/";</script>')
+        else:
+            # Token invalid or expired, redirect to normal mode
+            return render_template_string('<script>alert("Access link has expired!"); window.location.href="/";</script>')
+    
+    encoding = negotiate_encoding()
+    page = get_index_pages()[(is_mobile, is_secret_mode)]
+
+    if is_secret_mode:
+        # Secret pages consume their token, never let them be cached or revalidated
+        resp = app.response_class(page[encoding], mimetype='text/html')
+        resp.headers['Cache-Control'] = 'no-store'
+    else:
+        etag = f'index-{INDEX_TEMPLATE_HASH}-{"mobile" if is_mobile else "desktop"}-{encoding}'
+        if is_not_modified(etag):
+            resp = app.response_class(status=304)
+        else:
+            resp = app.response_class(page[encoding], mimetype='text/html')
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.vary.add('User-Agent')
+
+    if encoding != 'identity':
+        resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+@app.route('/assets/<name>')
+def static_asset(name):
+    asset = get_static_assets().get(name)
+    if asset is None:
+        return 'Not found', 404
+    mimetype, variants = asset
+    encoding = negotiate_encoding()
+
+    # The name already carries the content hash, so it doubles as the validator
+    etag = f'{name}-{encoding}'
+    if is_not_modified(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(variants[encoding], mimetype=mimetype)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f'public, max-age={STATIC_ASSET_MAX_AGE}, immutable'
+    if encoding != 'identity':
+        resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+# Verify password and generate token
+@app.route('/verify-secret', methods=['POST'])
+def verify_secret():
+    data = request.get_json()
+    password = data.get('password', '')
+    
+    if password == SECRET_PASSWORD:
+        # Generate signed token, the link is valid for TOKEN_LINK_TTL until clicked
+        token = issue_secret_token()
+        return jsonify({'success': True, 'token': token})
+    else:
+        return jsonify({'success': False})
+
+# Invalidate token
+@app.route('/invalidate-token', methods=['POST'])
+def invalidate_token():
+    secret_token = request.args.get('secretnumber', '')
+    if secret_token:
+        revoke_secret_token(secret_token)
+    return '', 204
+
+# Check if the request carries a secret space token
+def is_secret_request():
+    secret_token = request.args.get('secretnumber', '')
+    # Token exists means it's valid (including used tokens)
+    with span('token'):
+        is_secret = bool(secret_token) and is_valid_secret_token(secret_token)
+    g.library = 'secret' if is_secret else 'normal'
+    return is_secret
+
+# Opaque keyset cursor: the sort key of the last item returned. Unlike an offset it stays
+# correct when the catalog changes between pages.
+def encode_cursor(sort, order, key):
+    raw = json.dumps([sort, order, list(key)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, sort, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_order, key = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if cursor_sort != sort or cursor_order != order or not isinstance(key, list) or len(key) != 2:
+        return None
+    return tuple(key)
+
+# Walk the sorted snapshot from a cursor, yielding (entry, key) pairs matching keyword
+# and the optional match(entry) predicate
+def iter_videos(catalog, sort, order, cursor_key=None, keyword='', match=None):
+    items, keys = catalog.sorted_view(sort)
+    try:
+        if order == 'asc':
+            start = bisect.bisect_right(keys, cursor_key) if cursor_key is not None else 0
+            indices = range(start, len(items))
+        else:
+            end = bisect.bisect_left(keys, cursor_key) if cursor_key is not None else len(items)
+            indices = range(end - 1, -1, -1)
+    except TypeError:
+        # Cursor key of the wrong shape for this sort order
+        return
+    for i in indices:
+        entry = items[i]
+        if keyword and keyword not in entry[0].lower():
+            continue
+        if match is not None and not match(entry):
+            continue
+        yield entry, keys[i]
+
+def video_entry(entry, metadata=None):
+    item = {'path': entry[0], 'size': entry[1], 'mtime': entry[2]}
+    for field in METADATA_FIELDS:
+        if field != 'mime':
+            item[field] = metadata.get(field) if metadata else None
+    return item
+
+# Duration (seconds) and height (pixels) range filters; files without metadata never match
+METADATA_FILTERS = {
+    'min_duration': lambda m, v: m['duration'] is not None and m['duration'] >= v,
+    'max_duration': lambda m, v: m['duration'] is not None and m['duration'] <= v,
+    'min_height': lambda m, v: m['height'] is not None and m['height'] >= v,
+    'max_height': lambda m, v: m['height'] is not None and m['height'] <= v,
+}
+
+def metadata_filter(catalog):
+    active = [(METADATA_FILTERS[name], request.args.get(name, type=float))
+              for name in METADATA_FILTERS if name in request.args]
+    if not active:
+        return None
+    def match(entry):
+        metadata = metadata_index.get(catalog.root, entry)
+        return metadata is not None and all(value is not None and test(metadata, value) for test, value in active)
+    return match
+
+# Number of entries matching a search/filter, cached until the catalog (or, with metadata
+# filters, the metadata index) changes: every page of a filtered listing reports it
+match_counts = OrderedDict()
+match_counts_lock = threading.Lock()
+
+def count_videos(catalog, keyword, match, filters):
+    if not keyword and match is None:
+        return len(catalog.entries)
+    key = (catalog.root, catalog.version, metadata_index.version if match else None, keyword, filters)
+    with match_counts_lock:
+        if key in match_counts:
+            match_counts.move_to_end(key)
+            return match_counts[key]
+    count = sum(1 for _ in iter_videos(catalog, 'name', 'asc', None, keyword, match))
+    with match_counts_lock:
+        match_counts[key] = count
+        while len(match_counts) > MATCH_COUNT_CACHE_ENTRIES:
+            match_counts.popitem(last=False)
+    return count
+
+# Paginated / streamed variants of /videos, used when any paging parameter is given
+def paged_videos(catalog):
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    if (sort not in SORT_KEYS and sort not in METADATA_SORT_KEYS) or order not in ('asc', 'desc'):
+        return jsonify({'error': 'invalid sort or order'}), 400
+    keyword = request.args.get('q', '').lower()
+    match = metadata_filter(catalog)
+
+    cursor = request.args.get('cursor')
+    cursor_key = None
+    if cursor:
+        cursor_key = decode_cursor(cursor, sort, order)
+        if cursor_key is None:
+            return jsonify({'error': 'invalid cursor'}), 400
+
+    if request.args.get('format') == 'ndjson':
+        # Stream one JSON object per line; no limit unless asked for
+        limit = request.args.get('limit', type=int)
+        def generate():
+            for n, (entry, _) in enumerate(iter_videos(catalog, sort, order, cursor_key, keyword, match)):
+                if limit is not None and n >= limit:
+                    break
+                metadata = metadata_index.get(catalog.root, entry)
+                yield json.dumps(video_entry(entry, metadata), ensure_ascii=False) + '\n'
+        return app.response_class(generate(), mimetype='application/x-ndjson')
+
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    items = []
+    next_cursor = None
+    for entry, key in iter_videos(catalog, sort, order, cursor_key, keyword, match):
+        if len(items) == limit:
+            next_cursor = encode_cursor(sort, order, last_key)
+            break
+        items.append(video_entry(entry, metadata_index.get(catalog.root, entry)))
+        last_key = key
+    return jsonify({
+        'items': items,
+        'next_cursor': next_cursor,
+        'total': count_videos(catalog, keyword, match,
+                              tuple((name, request.args.get(name)) for name in METADATA_FILTERS if name in request.args)),
+        'version': catalog.digest,
+    })
+
+@app.route('/videos')
+def videos():
+    is_secret = is_secret_request()
+    catalog = get_catalog(is_secret)
+    video_list = get_video_list(is_secret=is_secret)
+    etag, changed = catalog.etag(), catalog.changed
+    paged = any(arg in request.args for arg in ('limit', 'cursor', 'sort', 'order', 'q', 'format', *METADATA_FILTERS))
+    if paged:
+        # Paged entries carry metadata, which changes independently of the file list
+        etag = f'{etag}-m{metadata_index.digests.get(catalog.root, "")}'
+        changed = max(changed, metadata_index.changed)
+
+    if is_not_modified(etag, changed):
+        resp = app.response_class(status=304)
+    elif paged:
+        resp = paged_videos(catalog)
+        if isinstance(resp, tuple):
+            return resp
+    else:
+        # Plain array: the original API, fine for small libraries
+        resp = jsonify(video_list)
+    resp.set_etag(etag)
+    resp.last_modified = changed
+    resp.headers['Cache-Control'] = 'private, no-cache' if is_secret else 'no-cache'
+    return resp
+
+# Admin endpoints are only served to clients on this machine
+def local_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.remote_addr not in ADMIN_ADDRESSES:
+            return 'Forbidden', 403
+        return view(*args, **kwargs)
+    return wrapper
+
+# Manually rescan the library and report scan duration
+@app.route('/rescan', methods=['POST'])
+@local_only
+def rescan():
+    is_secret = is_secret_request()
+    catalog = get_catalog(is_secret)
+    catalog.refresh(full=True)
+    # Other workers reload the saved result
+    catalog.save_snapshot()
+    catalog.start()
+    return jsonify(catalog.status())
+
+# Shared cache of fixed-size, aligned file blocks in front of disk reads. Eviction is a
+# segmented LRU: new blocks enter a probation segment and move to the protected segment on
+# a second hit, so a single long sequential read cannot flush blocks many viewers reuse.
+# The heads of popular files (the container header and first GOPs every new playback
+# requests) are pinned outside the LRU under their own budget.
+class BlockCache:
+    def __init__(self, max_bytes=BLOCK_CACHE_BYTES, block_size=BLOCK_CACHE_BLOCK_SIZE,
+                 pin_bytes=BLOCK_CACHE_PIN_BYTES, head_bytes=BLOCK_CACHE_HEAD_BYTES):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.pin_bytes = pin_bytes
+        self.head_blocks = max(1, head_bytes // block_size)
+        self.share = 1.0                    # Fraction of both budgets this process uses
+        self.lock = threading.Lock()
+        self.probation = OrderedDict()      # (file key, block index) -> bytes
+        self.protected = OrderedDict()
+        self.protected_bytes = 0
+        self.size = 0
+        self.pinned = {}                    # (file key, block index) -> bytes
+        self.pinned_files = OrderedDict()   # file key -> None, least recently used first
+        self.pinned_size = 0
+        self.head_reads = OrderedDict()     # file key -> number of reads of block 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, file_key, index):
+        key = (file_key, index)
+        with self.lock:
+            data = self.pinned.get(key)
+            if data is None:
+                data = self.protected.get(key)
+                if data is not None:
+                    self.protected.move_to_end(key)
+                else:
+                    data = self.probation.pop(key, None)
+                    if data is not None:
+                        self._protect(key, data)
+            if index == 0:
+                self._note_head(file_key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    def put(self, file_key, index, data):
+        key = (file_key, index)
+        with self.lock:
+            if key in self.pinned or key in self.protected or key in self.probation:
+                return
+            if file_key in self.pinned_files and index < self.head_blocks:
+                self.pinned[key] = data
+                self.pinned_size += len(data)
+                return
+            self.probation[key] = data
+            self.size += len(data)
+            self._evict()
+
+    def _protect(self, key, data):
+        self.protected[key] = data
+        self.protected_bytes += len(data)
+        # The protected segment holds at most 80% of the budget; overflow goes back to probation
+        while self.protected_bytes > self.max_bytes * self.share * 0.8 and self.protected:
+            old_key, old = self.protected.popitem(last=False)
+            self.protected_bytes -= len(old)
+            self.probation[old_key] = old
+
+    def _evict(self):
+        while self.size > self.max_bytes * self.share:
+            segment = self.probation if self.probation else self.protected
+            if not segment:
+                break
+            _, old = segment.popitem(last=False)
+            self.size -= len(old)
+            if segment is self.protected:
+                self.protected_bytes -= len(old)
+            self.evictions += 1
+
+    # Count reads of a file's first block; pin its head once it is popular enough
+    def _note_head(self, file_key):
+        if file_key in self.pinned_files:
+            self.pinned_files.move_to_end(file_key)
+            return
+        count = self.head_reads.pop(file_key, 0) + 1
+        self.head_reads[file_key] = count
+        while len(self.head_reads) > BLOCK_CACHE_TRACKED_FILES:
+            self.head_reads.popitem(last=False)
+        head_size = self.head_blocks * self.block_size
+        pin_bytes = self.pin_bytes * self.share
+        if count < BLOCK_CACHE_PIN_AFTER or head_size > pin_bytes:
+            return
+        while self.pinned_files and len(self.pinned_files) * head_size + head_size > pin_bytes:
+            self._unpin(next(iter(self.pinned_files)))
+        self.pinned_files[file_key] = None
+        # Head blocks already cached move out of the LRU segments
+        for index in range(self.head_blocks):
+            key = (file_key, index)
+            for segment in (self.probation, self.protected):
+                data = segment.pop(key, None)
+                if data is not None:
+                    self.size -= len(data)
+                    if segment is self.protected:
+                        self.protected_bytes -= len(data)
+                    self.pinned[key] = data
+                    self.pinned_size += len(data)
+
+    def _unpin(self, file_key):
+        del self.pinned_files[file_key]
+        for index in range(self.head_blocks):
+            data = self.pinned.pop((file_key, index), None)
+            if data is not None:
+                self.pinned_size -= len(data)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'block_size': self.block_size,
+                'bytes': self.size,
+                'max_bytes': int(self.max_bytes * self.share),
+                'probation_blocks': len(self.probation),
+                'protected_blocks': len(self.protected),
+                'pinned_files': len(self.pinned_files),
+                'pinned_bytes': self.pinned_size,
+                'pin_budget': int(self.pin_bytes * self.share),
+                'process_share': self.share,
+            }
+
+block_cache = BlockCache() if BLOCK_CACHE_BYTES > 0 else None
+
+# Kernel readahead hints for sequential streams. A range is treated as sequential once it
+# has streamed READAHEAD_TRIGGER bytes, or right away when it starts where the same
+# client's previous range of the same file ended (players fetching in pieces). Sequential
+# streams ask the kernel to prefetch the next READAHEAD_WINDOW (WILLNEED) and to drop what
+# is more than READAHEAD_KEEP_BEHIND behind the read position (DONTNEED), so one large
+# file cannot push the rest of the library out of the page cache.
+class AccessPatterns:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = OrderedDict()    # (client, file key) -> (next offset, time, advised until, dropped until)
+
+    # State of the client's previous range when this one continues it, else None
+    def continues(self, key, start):
+        with self.lock:
+            state = self.streams.get(key)
+        if state is not None and 0 <= start - state[0] <= READAHEAD_GAP and time.monotonic() - state[1] <= READAHEAD_IDLE:
+            return state
+        return None
+
+    def record(self, key, end, advised_until, dropped_until):
+        with self.lock:
+            self.streams.pop(key, None)
+            self.streams[key] = (end, time.monotonic(), advised_until, dropped_until)
+            while len(self.streams) > READAHEAD_TRACKED_STREAMS:
+                self.streams.popitem(last=False)
+
+access_patterns = AccessPatterns()
+
+class ReadaheadAdvisor:
+    def __init__(self, fd, client, file_key):
+        self.fd = fd
+        self.key = (client, file_key)
+        self.start = self.pos = 0
+        self.sequential = False
+        self.advised_until = 0
+        self.dropped_until = 0
+
+    def begin(self, start):
+        self.start = self.pos = self.advised_until = self.dropped_until = start
+        previous = access_patterns.continues(self.key, start)
+        self.sequential = previous is not None
+        if previous is not None:
+            self.advised_until = max(start, previous[2])
+            self.dropped_until = previous[3]
+
+    def advance(self, pos):
+        self.pos = pos
+        if not self.sequential:
+            if pos - self.start < READAHEAD_TRIGGER:
+                return
+            self.sequential = True
+        try:
+            if pos + READAHEAD_WINDOW // 2 >= self.advised_until:
+                start = max(pos, self.advised_until)
+                self.advised_until = pos + READAHEAD_WINDOW
+                os.posix_fadvise(self.fd, start, self.advised_until - start, os.POSIX_FADV_WILLNEED)
+            drop_until = pos - READAHEAD_KEEP_BEHIND
+            if READAHEAD_DROP_BEHIND and drop_until - self.dropped_until >= READAHEAD_WINDOW:
+                os.posix_fadvise(self.fd, self.dropped_until, drop_until - self.dropped_until, os.POSIX_FADV_DONTNEED)
+                self.dropped_until = drop_until
+        except OSError:
+            pass
+
+    def finish(self):
+        access_patterns.record(self.key, self.pos, self.advised_until, self.dropped_until)
+
+# Bandwidth shaping for file bodies. A per-client token bucket caps each client; a global
+# bucket caps the server, and chunks waiting for it are granted by a scheduler thread in
+# start-time fair queuing order per client, so a download manager with many parallel
+# ranges gets the same share as a single player. Ranges up to BANDWIDTH_SMALL_RANGE (what
+# players fetch) count with BANDWIDTH_SMALL_WEIGHT against their client's share.
+# Settings and both kinds of buckets live in shared memory created before workers fork:
+# POST /bandwidth on any worker reconfigures all of them, a client's parallel ranges are
+# capped together whichever workers serve them, and a busy worker can use the whole global
+# rate while the others are idle. The fair queuing order is kept per worker.
+class BandwidthShaper:
+    FIELDS = ('global_rate', 'client_rate', 'small_range', 'small_weight', 'burst')
+
+    def __init__(self):
+        self.settings = multiprocessing.sharedctypes.RawArray('d', [
+            BANDWIDTH_GLOBAL_RATE, BANDWIDTH_CLIENT_RATE, BANDWIDTH_SMALL_RANGE,
+            BANDWIDTH_SMALL_WEIGHT, BANDWIDTH_BURST])
+        # Shared buckets: the time each is free again (monotonic clock, the same in every process)
+        self.shared_lock = multiprocessing.Lock()
+        self.global_next = multiprocessing.sharedctypes.RawValue('d', 0.0)
+        self.client_keys = multiprocessing.sharedctypes.RawArray('q', BANDWIDTH_TRACKED_CLIENTS)
+        self.client_next = multiprocessing.sharedctypes.RawArray('d', BANDWIDTH_TRACKED_CLIENTS)
+        self.cond = threading.Condition()
+        self.queue = []             # (virtual start, seq, bytes, grant callback)
+        self.seq = 0
+        self.virtual = 0.0
+        self.finish = {}            # client -> virtual finish of its last queued chunk
+        self.granted_bytes = 0
+        self.thread = None
+
+    @property
+    def active(self):
+        return self.settings[0] > 0 or self.settings[1] > 0
+
+    def config(self):
+        return dict(zip(self.FIELDS, self.settings))
+
+    def configure(self, **values):
+        for name, value in values.items():
+            value = float(value)
+            if value < 0:
+                raise ValueError(f'{name} must not be negative')
+            self.settings[self.FIELDS.index(name)] = value
+
+    def is_small(self, length):
+        return length <= self.settings[2]
+
+    # Seconds to wait for the client's own bucket (reserving n bytes from it)
+    def _client_delay(self, client, n):
+        rate = self.settings[1]
+        if rate <= 0:
+            return 0
+        # Stable across processes (str hashes are not), never 0 (an empty slot)
+        key = int.from_bytes(hashlib.blake2b(client.encode(), digest_size=8).digest(), 'little', signed=True) | 1
+        with self.shared_lock:
+            now = time.monotonic()
+            slot = self._client_slot(key)
+            start = max(self.client_next[slot], now - self.settings[4])
+            self.client_next[slot] = start + n / rate
+        return start - now
+
+    # The client's slot in the shared table (linear probing); a client not found takes the
+    # probed slot that has been idle longest, losing that slot's bucket state
+    def _client_slot(self, key):
+        size = len(self.client_keys)
+        victim = None
+        for i in range(BANDWIDTH_CLIENT_PROBE):
+            slot = (key + i) % size
+            if self.client_keys[slot] == key:
+                return slot
+            if victim is None or self.client_next[slot] < self.client_next[victim]:
+                victim = slot
+        self.client_keys[victim] = key
+        self.client_next[victim] = 0.0
+        return victim
+
+    def _enqueue(self, client, n, small, grant):
+        weight = self.settings[3] if small and self.settings[3] > 0 else 1.0
+        with self.cond:
+            start = max(self.virtual, self.finish.get(client, 0.0))
+            self.finish[client] = start + n / weight
+            if len(self.finish) > BANDWIDTH_TRACKED_CLIENTS:
+                self.finish = {c: t for c, t in self.finish.items() if t > self.virtual}
+            heapq.heappush(self.queue, (start, self.seq, n, grant))
+            self.seq += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='bandwidth', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    # Grant queued chunks in virtual-time order as the global bucket allows
+    def _run(self):
+        with self.cond:
+            while True:
+                if not self.queue:
+                    self.cond.wait()
+                    continue
+                rate = self.settings[0]
+                if rate > 0:
+                    with self.shared_lock:
+                        now = time.monotonic()
+                        wait = self.global_next.value - now
+                        if wait <= 0:
+                            start = max(self.global_next.value, now - self.settings[4])
+                            self.global_next.value = start + self.queue[0][2] / rate
+                    if wait > 0:
+                        self.cond.wait(wait)
+                        continue
+                start, _, n, grant = heapq.heappop(self.queue)
+                self.virtual = start
+                self.granted_bytes += n
+                grant()
+
+    # Block until n more bytes may be sent to client (threaded serving path)
+    def acquire(self, client, n, small=False):
+        delay = self._client_delay(client, n)
+        if delay > 0:
+            time.sleep(delay)
+        if self.settings[0] > 0:
+            granted = threading.Event()
+            self._enqueue(client, n, small, granted.set)
+            granted.wait()
+
+    async def acquire_async(self, client, n, small=False):
+        import asyncio
+        delay = self._client_delay(client, n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.settings[0] > 0:
+            loop = asyncio.get_running_loop()
+            granted = loop.create_future()
+            def grant():
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+            self._enqueue(client, n, small, grant)
+            await granted
+
+    def stats(self):
+        with self.cond:
+            return {
+                'queued_chunks': len(self.queue),
+                'clients': len(self.finish),
+                'granted_bytes': self.granted_bytes,
+            }
+
+shaper = BandwidthShaper()
+
+# Admission control for streams. Each process admits up to its share of
+# ADMISSION_MAX_STREAMS concurrent file bodies; further requests wait in a short queue for
+# at most ADMISSION_QUEUE_TIMEOUT and are otherwise answered 503 with Retry-After, so a
+# burst degrades into quick retries instead of every viewer buffering. Disk reads are
+# separately limited per volume (device) to ADMISSION_DISK_READS at a time; the async
+# engine reads on its pool under the limit instead of using sendfile() when it is set.
+class AdmissionController:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.share = 1.0            # Fraction of ADMISSION_MAX_STREAMS this process admits
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.disks = {}             # device -> [semaphore, reads in progress, reads waited, asyncio semaphore]
+
+    @property
+    def limit(self):
+        return math.ceil(ADMISSION_MAX_STREAMS * self.share) if ADMISSION_MAX_STREAMS > 0 else 0
+
+    # Take a stream slot, waiting in the queue if needed; False when the caller should 503
+    def admit(self):
+        limit = self.limit
+        with self.cond:
+            if not limit or (self.active < limit and not self.waiting):
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= ADMISSION_MAX_QUEUE:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            deadline = time.monotonic() + ADMISSION_QUEUE_TIMEOUT
+            try:
+                while self.active >= limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self.cond.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+    def _disk(self, device):
+        disk = self.disks.get(device)
+        if disk is None:
+            with self.cond:
+                disk = self.disks.setdefault(device, [threading.BoundedSemaphore(ADMISSION_DISK_READS), 0, 0, None])
+        return disk
+
+    # f.read(n) while holding one of the volume's disk read slots
+    def disk_read(self, device, f, n):
+        if ADMISSION_DISK_READS <= 0:
+            return f.read(n)
+        disk = self._disk(device)
+        if not disk[0].acquire(blocking=False):
+            with self.cond:
+                disk[2] += 1
+            disk[0].acquire()
+        with self.cond:
+            disk[1] += 1
+        try:
+            return f.read(n)
+        finally:
+            with self.cond:
+                disk[1] -= 1
+            disk[0].release()
+
+    # Async engine: read n bytes at offset on the executor while holding one of the
+    # volume's disk read slots. The slot is awaited on the event loop, and it is released
+    # before the caller writes the data to the client.
+    async def disk_read_async(self, device, f, offset, n, executor):
+        import asyncio
+        disk = self._disk(device)
+        if disk[3] is None:
+            disk[3] = asyncio.Semaphore(ADMISSION_DISK_READS)
+        if disk[3].locked():
+            with self.cond:
+                disk[2] += 1
+
+        def read():
+            f.seek(offset)
+            return f.read(n)
+
+        async with disk[3]:
+            with self.cond:
+                disk[1] += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, read)
+            finally:
+                with self.cond:
+                    disk[1] -= 1
+
+    def status(self):
+        with self.cond:
+            return {
+                'active_streams': self.active,
+                'max_streams': self.limit,
+                'waiting': self.waiting,
+                'max_queue': ADMISSION_MAX_QUEUE,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'disk_reads': {str(device): {'in_progress': d[1], 'waited': d[2], 'max': ADMISSION_DISK_READS}
+                               for device, d in self.disks.items()},
+            }
+
+admission = AdmissionController()
+
+def admission_rejected():
+    resp = app.response_class('Server busy, retry shortly', 503)
+    resp.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+# A file-backed body is a list of segments: bytes objects (multipart headers) and
+# (offset, length) pairs read from the file. The WSGI path streams it with iter_segments();
+# the asyncio engine hands the (offset, length) pairs to loop.sendfile().
+def iter_segments(f, segments, client=None, on_close=None):
+    try:
+        st = os.fstat(f.fileno())
+        file_key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        advisor = None
+        if client is not None and READAHEAD_HINTS and hasattr(os, 'posix_fadvise'):
+            advisor = ReadaheadAdvisor(f.fileno(), client, file_key)
+        for segment in segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            chunks = _read_range(f, *segment, file_key=file_key)
+            if client is not None and shaper.active:
+                chunks = _shaped(chunks, client, shaper.is_small(segment[1]))
+            if advisor is None:
+                yield from chunks
+                continue
+            advisor.begin(segment[0])
+            pos = segment[0]
+            try:
+                for chunk in chunks:
+                    pos += len(chunk)
+                    advisor.advance(pos)
+                    yield chunk
+            finally:
+                advisor.finish()
+    finally:
+        f.close()
+        if on_close is not None:
+            on_close()
+
+# Time to first byte and bytes sent for one file body
+class StreamStats:
+    def __init__(self, start, library, status):
+        self.start = start
+        self.library = library
+        self.status = status
+        self.started = False
+
+    # The response has started reaching the client
+    def first_byte(self):
+        if not self.started:
+            self.started = True
+            if self.start is not None:
+                metrics.observe('video_share_time_to_first_byte_seconds',
+                                time.perf_counter() - self.start, status=str(self.status))
+
+    def sent(self, n):
+        self.first_byte()
+        metrics.inc('video_share_bytes_served_total', n, library=self.library)
+
+# Also times the body: 'read' is spent producing chunks (seek, disk or cache read, shaping),
+# 'send' is spent by the server writing them to the client
+def _counted(body, stats):
+    read = send = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            chunk = next(body, None)
+            read += time.perf_counter() - start
+            if chunk is None:
+                break
+            stats.sent(len(chunk))
+            start = time.perf_counter()
+            yield chunk
+            send += time.perf_counter() - start
+    finally:
+        body.close()
+        metrics.observe('video_share_stream_read_seconds', read)
+        metrics.observe('video_share_stream_send_seconds', send)
+
+def _call_once(func):
+    lock = threading.Lock()
+    called = []
+    def wrapper():
+        with lock:
+            if called:
+                return
+            called.append(True)
+        func()
+    return wrapper
+
+def _shaped(chunks, client, small):
+    for chunk in chunks:
+        shaper.acquire(client, len(chunk), small)
+        yield chunk
+
+# Stream length bytes from an open file in fixed-size chunks so memory per stream stays
+# constant whatever the range size. The file is closed when the response is closed,
+# including when the client disconnects mid-stream.
+def iter_file_range(f, start, length):
+    return iter_segments(f, [(start, length)])
+
+# Response whose body is streamed from an open file; file_body keeps (file, segments)
+# available to serving engines that can send the file natively. on_close runs once when
+# the body is finished or the response is closed without being streamed (HEAD, sendfile).
+def file_response(f, segments, status, on_close=None, **kwargs):
+    if on_close is not None:
+        on_close = _call_once(on_close)
+    body = iter_segments(f, segments, client=request.remote_addr, on_close=on_close)
+    stats = StreamStats(request.environ.get('metrics.start'), g.get('library', 'normal'), status)
+    resp = app.response_class(_counted(body, stats), status, direct_passthrough=True, **kwargs)
+    resp.stream_stats = stats
+    resp.call_on_close(f.close)
+    if on_close is not None:
+        resp.call_on_close(on_close)
+    resp.file_body = (f, segments)
+    return resp
+
+def _read_range(f, start, length, file_key=None):
+    if file_key is not None and block_cache is not None:
+        yield from _read_cached_range(f, start, length, file_key)
+        return
+    device = file_key[0] if file_key is not None else None
+    f.seek(start)
+    remaining = length
+    while remaining > 0:
+        data = admission.disk_read(device, f, min(STREAM_CHUNK_SIZE, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+# Same as _read_range, but through the block cache: whole aligned blocks are read from
+# disk and cached, and the requested bytes are sliced out of them
+def _read_cached_range(f, start, length, file_key):
+    block_size = block_cache.block_size
+    pos, end = start, start + length
+    while pos < end:
+        index = pos // block_size
+        block = block_cache.get(file_key, index)
+        if block is None:
+            f.seek(index * block_size)
+            block = admission.disk_read(file_key[0], f, block_size)
+            if not block:
+                break
+            block_cache.put(file_key, index, block)
+        offset = pos - index * block_size
+        if offset == 0 and end - pos >= len(block):
+            piece = block
+        else:
+            piece = block[offset:offset + end - pos]
+        if not piece:
+            break
+        pos += len(piece)
+        yield piece
+
+# Parse a Range header against the entity size (RFC 7233).
+# Returns None when the header should be ignored (full 200 response), an empty list
+# when no range is satisfiable (416), otherwise sorted, coalesced (start, end) pairs.
+def parse_range_header(header, size):
+    unit, sep, spec = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            if not last:
+                return None
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                continue
+            ranges.append((max(0, size - suffix), size - 1))
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            if start >= size:
+                continue
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        return []
+
+    # Coalesce overlapping and adjacent ranges
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    # Too many pieces: serve one span covering them all instead
+    if len(merged) > MAX_RANGES:
+        merged = [(merged[0][0], merged[-1][1])]
+    return merged
+
+# Check If-Range against the current validators; a mismatch means send the full entity
+def if_range_matches(etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('W/'):
+        # Weak entity tags never match If-Range
+        return False
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is None:
+        return False
+    return int(if_range.date.timestamp()) == int(mtime)
+
+# MP4 (ISO BMFF) box parsing. Boxes are (type, start, header_size, size) tuples.
+MP4_CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf', b'mvex', b'udta'}
+
+class MP4Error(ValueError):
+    pass
+
+# Walk the boxes of a file between start and end
+def iter_file_boxes(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            break
+        size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise MP4Error('truncated box header')
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise MP4Error(f'bad size for box {box_type!r} at {pos}')
+        yield box_type, pos, header_size, size
+        pos += size
+
+# Walk the boxes of an in-memory buffer between start and end
+def iter_buffer_boxes(data, start, end):
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise MP4Error(f'bad size for box {box_type!r} at {pos}')
+        yield box_type, pos, header_size, size
+        pos += size
+
+# Find every box of the given types inside container boxes, depth first
+def find_boxes(data, start, end, types):
+    for box in iter_buffer_boxes(data, start, end):
+        box_type, pos, header_size, size = box
+        if box_type in types:
+            yield box
+        elif box_type in MP4_CONTAINER_BOXES:
+            yield from find_boxes(data, pos + header_size, pos + size, types)
+
+# Shift stco/co64 chunk offsets that point into [low, high) by delta, in place
+def patch_chunk_offsets(moov, low, high, delta):
+    for box_type, pos, header_size, size in find_boxes(moov, 0, len(moov), (b'stco', b'co64')):
+        count = struct.unpack_from('>I', moov, pos + header_size + 4)[0]
+        table = pos + header_size + 8
+        fmt = f'>{count}{"I" if box_type == b"stco" else "Q"}'
+        if table + struct.calcsize(fmt) > pos + size:
+            raise MP4Error('truncated chunk offset table')
+        offsets = [o + delta if low <= o < high else o for o in struct.unpack_from(fmt, moov, table)]
+        if box_type == b'stco' and offsets and max(offsets) > 0xFFFFFFFF:
+            # Would need rewriting stco as co64, which changes box sizes
+            raise MP4Error('patched offset does not fit in stco')
+        struct.pack_into(fmt, moov, table, *offsets)
+
+# Byte layout of an MP4 whose moov box sits after its media data, rearranged so moov comes
+# first ("faststart") without touching the file: pieces are (virtual_start, length, source)
+# where source is a bytes object (the patched moov) or a file offset.
+class VirtualFaststart:
+    def __init__(self, pieces, size):
+        self.pieces = pieces
+        self.starts = [p[0] for p in pieces]
+        self.size = size
+        self.header_bytes = sum(p[1] for p in pieces if isinstance(p[2], bytes))
+
+    # Segments (bytes / (offset, length)) for a range of the virtual file
+    def segments(self, start, length):
+        result = []
+        end = start + length
+        i = bisect.bisect_right(self.starts, start) - 1
+        while length > 0 and i < len(self.pieces):
+            vstart, plen, source = self.pieces[i]
+            skip = start - vstart
+            take = min(plen - skip, end - start)
+            if isinstance(source, bytes):
+                result.append(source[skip:skip + take])
+            else:
+                result.append((source + skip, take))
+            start += take
+            length -= take
+            i += 1
+        return result
+
+# Build the faststart layout for a file, or None when it already is faststart (or is not
+# an MP4 we can rewrite)
+def build_faststart_layout(file_path, size):
+    with open(file_path, 'rb') as f:
+        boxes = list(iter_file_boxes(f, 0, size))
+        moov = next((b for b in boxes if b[0] == b'moov'), None)
+        first_mdat = next((b for b in boxes if b[0] == b'mdat'), None)
+        if moov is None or first_mdat is None or moov[1] < first_mdat[1]:
+            return None
+        if moov[3] > FASTSTART_MAX_MOOV:
+            return None
+        f.seek(moov[1])
+        moov_data = bytearray(f.read(moov[3]))
+    if len(moov_data) != moov[3]:
+        raise MP4Error('truncated moov')
+
+    # moov is inserted in front of the first mdat, so everything between the first mdat and
+    # the old moov position moves forward (to higher offsets) by len(moov): add it to those chunk offsets
+    patch_chunk_offsets(moov_data, first_mdat[1], moov[1], moov[3])
+    moov_data = bytes(moov_data)
+
+    pieces = []
+    vpos = 0
+    for box_type, pos, header_size, box_size in boxes:
+        if box_type == b'moov':
+            continue
+        if pos == first_mdat[1]:
+            pieces.append((vpos, len(moov_data), moov_data))
+            vpos += len(moov_data)
+        if pieces and not isinstance(pieces[-1][2], bytes) and pieces[-1][2] + pieces[-1][1] == pos:
+            # Merge adjacent file ranges
+            last = pieces[-1]
+            pieces[-1] = (last[0], last[1] + box_size, last[2])
+        else:
+            pieces.append((vpos, box_size, pos))
+        vpos += box_size
+    if vpos != size:
+        # Trailing bytes too short to be a box: the boxes do not cover the file, serve it as is
+        return None
+    return VirtualFaststart(pieces, vpos)
+
+# Cached faststart layouts keyed by (path, size, mtime); None results are cached too
+faststart_cache = OrderedDict()
+faststart_cache_bytes = 0
+faststart_lock = threading.Lock()
+
+def get_faststart_layout(file_path, st):
+    global faststart_cache_bytes
+    key = (file_path, st.st_size, st.st_mtime_ns)
+    with faststart_lock:
+        if key in faststart_cache:
+            faststart_cache.move_to_end(key)
+            return faststart_cache[key]
+    try:
+        layout = build_faststart_layout(file_path, st.st_size)
+    except (OSError, MP4Error, struct.error):
+        layout = None
+    with faststart_lock:
+        if key not in faststart_cache:
+            faststart_cache[key] = layout
+            faststart_cache_bytes += layout.header_bytes if layout else 0
+            while faststart_cache_bytes > FASTSTART_CACHE_BYTES or len(faststart_cache) > FASTSTART_CACHE_ENTRIES:
+                _, old = faststart_cache.popitem(last=False)
+                faststart_cache_bytes -= old.header_bytes if old else 0
+    return layout
+
+@app.route('/video/<path:filename>')
+def video(filename):
+    is_secret = is_secret_request()
+    video_root = SECRET_VIDEO_ROOT if is_secret else VIDEO_ROOT
+    file_path = os.path.join(video_root, filename)
+    
+    with span('stat'):
+        if not os.path.isfile(file_path):
+            return 'File not found', 404
+        st = os.stat(file_path)
+    size = st.st_size
+    ext = os.path.splitext(filename)[1].lower()
+
+    # MP4s with the moov box at the end are served with a virtual faststart layout
+    with span('layout'):
+        layout = get_faststart_layout(file_path, st) if ext in FASTSTART_EXTENSIONS else None
+    if layout is None:
+        body_segments = lambda start, length: [(start, length)]
+        etag = file_etag(st)
+    else:
+        body_segments = layout.segments
+        etag = file_etag(st) + '-faststart'
+    cache_control = 'private, no-store' if is_secret else f'public, max-age={VIDEO_MAX_AGE}'
+
+    if is_not_modified(etag, st.st_mtime):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.last_modified = st.st_mtime
+        resp.headers['Cache-Control'] = cache_control
+        return resp
+
+    # MIME type from the probed container and codecs, else guessed from the extension
+    metadata = metadata_index.get(video_root, (filename, size, st.st_mtime))
+    mimetype = metadata['mime'] if metadata and metadata['mime'] else MIME_TYPES.get(ext, 'video/mp4')
+
+    ranges = None
+    range_header = request.headers.get('Range', None)
+    if range_header and if_range_matches(etag, st.st_mtime):
+        ranges = parse_range_header(range_header, size)
+
+    for byte1, byte2 in ranges or ():
+        metrics.observe('video_share_range_request_bytes', byte2 - byte1 + 1)
+
+    if ranges == []:
+        resp = app.response_class('Requested range not satisfiable', 416)
+        resp.headers['Content-Range'] = f'bytes */{size}'
+        resp.headers['Accept-Ranges'] = 'bytes'
+        return resp
+
+    # Wait briefly for a stream slot, else ask the client to retry
+    with span('admission'):
+        admitted = admission.admit()
+    if not admitted:
+        return admission_rejected()
+    try:
+        with span('open'):
+            f = open(file_path, 'rb')
+    except OSError:
+        admission.release()
+        raise
+    if ranges is None:
+        resp = file_response(f, body_segments(0, size), 200, on_close=admission.release, mimetype=mimetype)
+        length = size
+    elif len(ranges) == 1:
+        byte1, byte2 = ranges[0]
+        length = byte2 - byte1 + 1
+        resp = file_response(f, body_segments(byte1, length), 206, on_close=admission.release, mimetype=mimetype)
+        resp.headers['Content-Range'] = f'bytes {byte1}-{byte2}/{size}'
+    else:
+        # multipart/byteranges body
+        boundary = secrets.token_hex(16)
+        segments = []
+        for byte1, byte2 in ranges:
+            segments.append((f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                             f'Content-Range: bytes {byte1}-{byte2}/{size}\r\n\r\n').encode())
+            segments.extend(body_segments(byte1, byte2 - byte1 + 1))
+            segments.append(b'\r\n')
+        segments.append(f'--{boundary}--\r\n'.encode())
+        length = sum(len(s) if isinstance(s, bytes) else s[1] for s in segments)
+        resp = file_response(f, segments, 206, on_close=admission.release,
+                             content_type=f'multipart/byteranges; boundary={boundary}')
+
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['Content-Length'] = str(length)
+    resp.headers['Cache-Control'] = cache_control
+    resp.set_etag(etag)
+    resp.last_modified = st.st_mtime
+    return resp
+
+# HLS delivery without transcoding: the MP4 sample tables (stts/ctts/stss/stsz/stsc/stco)
+# give every sample's file offset, size and timing. Segments are cut at video keyframes and
+# sent as fragmented MP4 (a small moof header in front of sample data read straight from
+# the original file), which is what HLS players accept for MP4 media.
+def mp4_box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def mp4_full_box(box_type, version, flags, payload):
+    return mp4_box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+def _child_box(data, box, box_type):
+    _, pos, header_size, size = box
+    return next((b for b in iter_buffer_boxes(data, pos + header_size, pos + size) if b[0] == box_type), None)
+
+class HlsTrack:
+    def __init__(self, track_id, handler, timescale, trak):
+        self.track_id = track_id
+        self.handler = handler
+        self.timescale = timescale
+        self.trak = trak            # (type, pos, header_size, size) within moov
+        self.offsets = array('I')
+        self.sizes = array('I')
+        self.dts = array('I')       # A sample's duration is the next sample's dts minus its own
+        self.end = 0                # dts just past the last sample
+        self.ctos = None            # Composition offsets, None when the track has no ctts
+        self.sync = None            # Sorted sync sample indices, None when every sample is sync
+
+    @property
+    def end_time(self):
+        return self.end / self.timescale
+
+    def duration(self, i):
+        return (self.dts[i + 1] if i + 1 < len(self.dts) else self.end) - self.dts[i]
+
+    @property
+    def nbytes(self):
+        arrays = (self.offsets, self.sizes, self.dts, self.ctos, self.sync)
+        return sum(a.itemsize * len(a) for a in arrays if a is not None)
+
+# 32-bit array when every value fits, 64-bit otherwise (the index is kept per cached file)
+def _compact_array(limit):
+    return array('I' if limit < 1 << 32 else 'q')
+
+# Big-endian uint32 table straight into an array, without a Python loop per entry
+def _uint32_table(data, start, count):
+    table = array('I')
+    table.frombytes(data[start:start + count * 4])
+    if len(table) != count:
+        raise MP4Error('truncated sample table')
+    if sys.byteorder == 'little':
+        table.byteswap()
+    return table
+
+# Read one trak's sample tables into flat arrays. The tables are run-length coded, so
+# the expansion works a run or a chunk at a time rather than a sample at a time.
+def parse_hls_track(moov, trak, file_size):
+    _, pos, header_size, size = trak
+    found = {b[0]: b for b in find_boxes(moov, pos + header_size, pos + size,
+             (b'tkhd', b'mdhd', b'hdlr', b'stts', b'ctts', b'stss', b'stsz', b'stsc', b'stco', b'co64'))}
+    for required in (b'tkhd', b'mdhd', b'hdlr', b'stts', b'stsz', b'stsc'):
+        if required not in found:
+            raise MP4Error(f'missing {required.decode()} box')
+
+    def payload(box_type):
+        _, p, h, s = found[box_type]
+        return p + h, p + s
+
+    start, _ = payload(b'tkhd')
+    track_id = struct.unpack_from('>I', moov, start + (20 if moov[start] == 1 else 12))[0]
+    start, _ = payload(b'mdhd')
+    timescale = struct.unpack_from('>I', moov, start + (20 if moov[start] == 1 else 12))[0]
+    start, _ = payload(b'hdlr')
+    handler = bytes(moov[start + 8:start + 12])
+    track = HlsTrack(track_id, handler, timescale, trak)
+    if handler not in (b'vide', b'soun') or not timescale:
+        return track
+
+    # Sample sizes
+    start, _ = payload(b'stsz')
+    sample_size, count = struct.unpack_from('>II', moov, start + 4)
+    if sample_size:
+        track.sizes = array('I', [sample_size]) * count
+    else:
+        track.sizes = _uint32_table(moov, start + 12, count)
+
+    # Decode timestamps
+    start, _ = payload(b'stts')
+    entries = struct.unpack_from('>I', moov, start + 4)[0]
+    runs = struct.unpack_from(f'>{entries * 2}I', moov, start + 8)
+    track.end = sum(n * delta for n, delta in zip(runs[::2], runs[1::2]))
+    track.dts = _compact_array(track.end)
+    dts = 0
+    for n, delta in zip(runs[::2], runs[1::2]):
+        track.dts.extend(range(dts, dts + n * delta, delta) if delta else array(track.dts.typecode, [dts]) * n)
+        dts += n * delta
+
+    # Composition offsets (read as signed: version 0 files use the same bit pattern for negative offsets)
+    if b'ctts' in found:
+        start, _ = payload(b'ctts')
+        entries = struct.unpack_from('>I', moov, start + 4)[0]
+        runs = struct.unpack_from('>' + 'Ii' * entries, moov, start + 8)
+        if all(n == 1 for n in runs[::2]):
+            track.ctos = array('i', runs[1::2])
+        else:
+            track.ctos = array('i')
+            for n, offset in zip(runs[::2], runs[1::2]):
+                track.ctos.extend(array('i', [offset]) * n)
+
+    # Sync samples (1-based in the file)
+    if b'stss' in found:
+        start, _ = payload(b'stss')
+        entries = struct.unpack_from('>I', moov, start + 4)[0]
+        track.sync = array('I', (i - 1 for i in _uint32_table(moov, start + 8, entries)))
+
+    # Chunk offsets, then sample offsets: a chunk's samples follow each other, so each one
+    # sits at the chunk offset plus the sizes of the samples before it in that chunk
+    if b'stco' in found:
+        start, _ = payload(b'stco')
+        entries = struct.unpack_from('>I', moov, start + 4)[0]
+        chunk_offsets = _uint32_table(moov, start + 8, entries)
+    elif b'co64' in found:
+        start, _ = payload(b'co64')
+        entries = struct.unpack_from('>I', moov, start + 4)[0]
+        chunk_offsets = struct.unpack_from(f'>{entries}Q', moov, start + 8)
+    else:
+        raise MP4Error('missing chunk offsets')
+    start, _ = payload(b'stsc')
+    entries = struct.unpack_from('>I', moov, start + 4)[0]
+    runs = [struct.unpack_from('>III', moov, start + 8 + i * 12) for i in range(entries)]
+    track.offsets = _compact_array(file_size)
+    if all(per_chunk == 1 for _, per_chunk, _ in runs) and runs and runs[0][0] == 1:
+        track.offsets.extend(chunk_offsets[:count])
+    else:
+        before = array('q', itertools.accumulate(track.sizes, initial=0))
+        sample = 0
+        for i, (first_chunk, per_chunk, _) in enumerate(runs):
+            last_chunk = runs[i + 1][0] - 1 if i + 1 < len(runs) else len(chunk_offsets)
+            for chunk in range(first_chunk - 1, last_chunk):
+                if sample >= count:
+                    break
+                n = min(per_chunk, count - sample)
+                track.offsets.extend(map(operator.add, before[sample:sample + n],
+                                         itertools.repeat(chunk_offsets[chunk] - before[sample], n)))
+                sample += n
+
+    if not (len(track.offsets) == len(track.dts) == count) or (track.ctos is not None and len(track.ctos) != count):
+        raise MP4Error('inconsistent sample tables')
+    return track
+
+# Copy of a box with its sample tables emptied (for the fragmented init segment)
+def _strip_sample_tables(moov, box):
+    box_type, pos, header_size, size = box
+    if box_type == b'stbl':
+        stsd = _child_box(moov, box, b'stsd')
+        if stsd is None:
+            raise MP4Error('missing stsd box')
+        empty = (mp4_full_box(b'stts', 0, 0, struct.pack('>I', 0))
+                 + mp4_full_box(b'stsc', 0, 0, struct.pack('>I', 0))
+                 + mp4_full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0))
+                 + mp4_full_box(b'stco', 0, 0, struct.pack('>I', 0)))
+        return mp4_box(b'stbl', bytes(moov[stsd[1]:stsd[1] + stsd[3]]) + empty)
+    if box_type in MP4_CONTAINER_BOXES:
+        children = [_strip_sample_tables(moov, child)
+                    for child in iter_buffer_boxes(moov, pos + header_size, pos + size)
+                    if child[0] != b'edts']
+        return mp4_box(box_type, b''.join(children))
+    return bytes(moov[pos:pos + size])
+
+class HlsIndex:
+    def __init__(self, moov, tracks, primary):
+        self.tracks = tracks
+        self.primary = primary
+        self.boundaries = self._cut_segments()
+        mvhd = next(b for b in iter_buffer_boxes(moov, 0, len(moov)) if b[0] == b'mvhd')
+        traks = b''.join(_strip_sample_tables(moov, t.trak) for t in tracks)
+        trex = b''.join(mp4_full_box(b'trex', 0, 0, struct.pack('>IIIII', t.track_id, 1, 0, 0, 0)) for t in tracks)
+        self.init_segment = (mp4_box(b'ftyp', b'iso6' + struct.pack('>I', 0) + b'iso6isommp41')
+                             + mp4_box(b'moov', bytes(moov[mvhd[1]:mvhd[1] + mvhd[3]]) + traks + mp4_box(b'mvex', trex)))
+
+    # Segment start times in seconds, cut at primary-track sync samples
+    def _cut_segments(self):
+        track = self.primary
+        target = HLS_SEGMENT_DURATION * track.timescale
+        candidates = track.sync if track.sync is not None else range(len(track.dts))
+        boundaries = [0.0]
+        last = track.dts[0] if track.dts else 0
+        for i in candidates:
+            if track.dts[i] - last >= target:
+                boundaries.append(track.dts[i] / track.timescale)
+                last = track.dts[i]
+        return boundaries + [track.end_time]
+
+    def playlist(self, query):
+        durations = [self.boundaries[i + 1] - self.boundaries[i] for i in range(len(self.boundaries) - 1)]
+        lines = ['#EXTM3U', '#EXT-X-VERSION:7', f'#EXT-X-TARGETDURATION:{math.ceil(max(durations, default=0))}',
+                 '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-INDEPENDENT-SEGMENTS',
+                 f'#EXT-X-MAP:URI="init.mp4{query}"']
+        for i, duration in enumerate(durations):
+            lines.append(f'#EXTINF:{duration:.6f},')
+            lines.append(f'{i}.m4s{query}')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    # moof header and file ranges for a segment: (header bytes, [(offset, length)], total size)
+    def segment(self, index):
+        t0, t1 = self.boundaries[index], self.boundaries[index + 1]
+        last = index == len(self.boundaries) - 2
+        runs = []
+        for track in self.tracks:
+            ts = track.timescale
+            first = bisect.bisect_left(track.dts, round(t0 * ts))
+            end = len(track.dts) if last else bisect.bisect_left(track.dts, round(t1 * ts))
+            runs.append((track, first, end))
+
+        moof_size = 8 + 16 + sum(8 + 16 + 20 + 20 + 16 * (end - first) for _, first, end in runs)
+        data_offset = moof_size + 8
+        trafs = []
+        ranges = []
+        for track, first, end in runs:
+            entries = []
+            for i in range(first, end):
+                flags = 0x02000000 if track.sync is None or track.handler != b'vide' or self._is_sync(track, i) else 0x01010000
+                cto = track.ctos[i] if track.ctos is not None else 0
+                entries.append(struct.pack('>IIIi', track.duration(i), track.sizes[i], flags, cto))
+                offset, size = track.offsets[i], track.sizes[i]
+                if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                    ranges[-1] = (ranges[-1][0], ranges[-1][1] + size)
+                else:
+                    ranges.append((offset, size))
+            base_dts = track.dts[first] if first < len(track.dts) else 0
+            trun = mp4_full_box(b'trun', 1, 0x000F01, struct.pack('>Ii', end - first, data_offset) + b''.join(entries))
+            tfhd = mp4_full_box(b'tfhd', 0, 0x020000, struct.pack('>I', track.track_id))
+            tfdt = mp4_full_box(b'tfdt', 1, 0, struct.pack('>Q', base_dts))
+            trafs.append(mp4_box(b'traf', tfhd + tfdt + trun))
+            data_offset += sum(track.sizes[first:end])
+
+        moof = mp4_box(b'moof', mp4_full_box(b'mfhd', 0, 0, struct.pack('>I', index + 1)) + b''.join(trafs))
+        data_size = sum(length for _, length in ranges)
+        header = moof + struct.pack('>I4s', 8 + data_size, b'mdat')
+        return header, ranges, len(header) + data_size
+
+    # Memory held by the index, for the cache budget
+    @property
+    def nbytes(self):
+        return sum(t.nbytes for t in self.tracks) + len(self.init_segment) + 8 * len(self.boundaries)
+
+    @staticmethod
+    def _is_sync(track, i):
+        j = bisect.bisect_left(track.sync, i)
+        return j < len(track.sync) and track.sync[j] == i
+
+def build_hls_index(file_path, size):
+    with open(file_path, 'rb') as f:
+        moov = next((b for b in iter_file_boxes(f, 0, size) if b[0] == b'moov'), None)
+        if moov is None:
+            raise MP4Error('no moov box')
+        f.seek(moov[1] + moov[2])
+        data = bytearray(f.read(moov[3] - moov[2]))
+    tracks = [parse_hls_track(data, trak, size) for trak in iter_buffer_boxes(data, 0, len(data)) if trak[0] == b'trak']
+    tracks = [t for t in tracks if t.handler in (b'vide', b'soun') and t.dts]
+    if not tracks:
+        raise MP4Error('no audio or video samples')
+    primary = next((t for t in tracks if t.handler == b'vide'), tracks[0])
+    return HlsIndex(data, tracks, primary)
+
+# HLS indexes cached per (path, size, mtime); failures are cached as the error message.
+# Building an index is CPU work on the request thread, so only HLS_INDEX_BUILDS run at once
+# and requests for a file whose index is being built wait for that build.
+hls_cache = OrderedDict()
+hls_cache_bytes = 0
+hls_lock = threading.Lock()
+hls_building = {}
+hls_builds = threading.BoundedSemaphore(HLS_INDEX_BUILDS)
+
+def _hls_entry_bytes(index):
+    return len(index) if isinstance(index, str) else index.nbytes
+
+# Returns the index, an error message, or None when too many builds are running
+def get_hls_index(file_path, st):
+    global hls_cache_bytes
+    key = (file_path, st.st_size, st.st_mtime_ns)
+    with hls_lock:
+        if key in hls_cache:
+            hls_cache.move_to_end(key)
+            return hls_cache[key]
+        building = hls_building.get(key)
+        if building is None:
+            hls_building[key] = threading.Event()
+    if building is not None:
+        if not building.wait(ADMISSION_QUEUE_TIMEOUT):
+            return None
+        return get_hls_index(file_path, st)
+    try:
+        if not hls_builds.acquire(timeout=ADMISSION_QUEUE_TIMEOUT):
+            return None
+        try:
+            index = build_hls_index(file_path, st.st_size)
+        except (MP4Error, struct.error, IndexError, StopIteration) as e:
+            index = str(e) or 'unsupported MP4'
+        finally:
+            hls_builds.release()
+        with hls_lock:
+            hls_cache[key] = index
+            hls_cache_bytes += _hls_entry_bytes(index)
+            while hls_cache_bytes > HLS_INDEX_CACHE_BYTES or len(hls_cache) > HLS_INDEX_CACHE_ENTRIES:
+                _, old = hls_cache.popitem(last=False)
+                hls_cache_bytes -= _hls_entry_bytes(old)
+    finally:
+        with hls_lock:
+            hls_building.pop(key).set()
+    return index
+
+# Resolve an HLS request to (file path, stat, index) or an error response
+def resolve_hls(filename):
+    is_secret = is_secret_request()
+    file_path = os.path.join(SECRET_VIDEO_ROOT if is_secret else VIDEO_ROOT, filename)
+    if not os.path.isfile(file_path):
+        return None, ('File not found', 404)
+    if not filename.lower().endswith(FASTSTART_EXTENSIONS):
+        return None, ('HLS is only available for MP4 files', 415)
+    st = os.stat(file_path)
+    index = get_hls_index(file_path, st)
+    if index is None:
+        return None, admission_rejected()
+    if isinstance(index, str):
+        return None, (f'Unsupported MP4: {index}', 415)
+    cache_control = 'private, no-store' if is_secret else f'public, max-age={VIDEO_MAX_AGE}'
+    return (file_path, st, index, cache_control), None
+
+@app.route('/hls/<path:filename>/index.m3u8')
+def hls_playlist(filename):
+    resolved, error = resolve_hls(filename)
+    if error:
+        return error
+    file_path, st, index, cache_control = resolved
+    token = request.args.get('secretnumber', '')
+    query = '?' + urlencode({'secretnumber': token}) if token else ''
+    resp = app.response_class(index.playlist(query), mimetype='application/vnd.apple.mpegurl')
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
+@app.route('/hls/<path:filename>/init.mp4')
+def hls_init(filename):
+    resolved, error = resolve_hls(filename)
+    if error:
+        return error
+    file_path, st, index, cache_control = resolved
+    resp = app.response_class(index.init_segment, mimetype='video/mp4')
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
+@app.route('/hls/<path:filename>/<int:segment>.m4s')
+def hls_segment(filename, segment):
+    resolved, error = resolve_hls(filename)
+    if error:
+        return error
+    file_path, st, index, cache_control = resolved
+    if segment >= len(index.boundaries) - 1:
+        return 'Segment not found', 404
+    header, ranges, length = index.segment(segment)
+    if not admission.admit():
+        return admission_rejected()
+    try:
+        f = open(file_path, 'rb')
+    except OSError:
+        admission.release()
+        raise
+    resp = file_response(f, [header] + ranges, 200, on_close=admission.release, mimetype='video/mp4')
+    resp.headers['Content-Length'] = str(length)
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
+# Batch transcoding of formats browsers cannot play into faststart MP4 (the same ffmpeg
+# settings excange.bat uses). Jobs run as ffmpeg subprocesses on a bounded pool; output
+# goes to "<name>.mp4.part" and is renamed into place only when ffmpeg succeeds. The .part
+# file is created exclusively, so it also claims the job against other worker processes;
+# a .part nobody has written to for TRANSCODE_STALE_PART seconds is a crash leftover.
+class TranscodeJob:
+    def __init__(self, job_id, is_secret, source, output):
+        self.id = job_id
+        self.is_secret = is_secret
+        self.source = source
+        self.output = output
+        self.state = 'queued'       # queued, running, done, failed, skipped, cancelled
+        self.progress = 0.0
+        self.duration = None
+        self.error = ''
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.process = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'library': 'secret' if self.is_secret else 'normal',
+            'source': self.source,
+            'output': self.output,
+            'state': self.state,
+            'progress': round(self.progress, 4),
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+class TranscodeManager:
+    def __init__(self, max_jobs=TRANSCODE_MAX_JOBS):
+        if max_jobs <= 0:
+            max_jobs = max(1, (os.cpu_count() or 1) // TRANSCODE_THREADS_PER_JOB)
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.jobs = {}          # id -> TranscodeJob
+        self.active = {}        # source path -> job id (queued or running)
+        self.next_id = 1
+        self.pool = None
+
+    # Queue every non-browser-playable file of a library that has no up-to-date MP4
+    def scan(self, is_secret=False):
+        catalog = get_catalog(is_secret)
+        get_video_list(is_secret)
+        queued = []
+        for rel_path, size, mtime in catalog.entries:
+            if not rel_path.lower().endswith(TRANSCODE_EXTENSIONS):
+                continue
+            job = self.submit(is_secret, rel_path)
+            if job is not None:
+                queued.append(job)
+        return queued
+
+    def submit(self, is_secret, rel_path):
+        root = SECRET_VIDEO_ROOT if is_secret else VIDEO_ROOT
+        source = os.path.join(root, rel_path)
+        output = os.path.splitext(source)[0] + '.mp4'
+        if transcode_up_to_date(source, output):
+            return None
+        with self.lock:
+            if source in self.active:
+                return None
+            job = TranscodeJob(self.next_id, is_secret, rel_path, os.path.relpath(output, root).replace('\\', '/'))
+            self.next_id += 1
+            self.jobs[job.id] = job
+            self.active[source] = job.id
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='transcode')
+        self.pool.submit(self._run, job, source, output)
+        return job
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.state == 'queued':
+                job.state = 'cancelled'
+            elif job.state == 'running' and job.process is not None:
+                job.state = 'cancelled'
+                job.process.terminate()
+            return job
+
+    def list_jobs(self):
+        with self.lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def _run(self, job, source, output):
+        part = output + '.part'
+        claimed = False  # Only the job that created the .part may remove it
+        try:
+            if job.state == 'cancelled':
+                return
+            if transcode_up_to_date(source, output) or not claim_part_file(part):
+                job.state = 'skipped'
+                return
+            claimed = True
+            job.state = 'running'
+            job.started = time.time()
+            self._transcode(job, source, part)
+            if job.state == 'running':
+                os.replace(part, output)
+                job.state = 'done'
+                job.progress = 1.0
+                get_catalog(job.is_secret).wakeup.set()
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            if claimed and job.state != 'done':
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass
+            with self.lock:
+                self.active.pop(source, None)
+
+    def _transcode(self, job, source, part):
+        cmd = [FFMPEG_BIN, '-hide_banner', '-nostdin', '-y', '-i', source,
+               '-threads', str(TRANSCODE_THREADS_PER_JOB), *TRANSCODE_ARGS,
+               '-f', 'mp4', '-progress', 'pipe:1', '-nostats', part]
+        job.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, text=True, errors='replace')
+        stderr_tail = []
+
+        # ffmpeg prints the input duration on stderr; drain it on a side thread
+        def read_stderr():
+            for line in job.process.stderr:
+                if job.duration is None:
+                    m = FFMPEG_DURATION_RE.search(line)
+                    if m:
+                        h, mi, s = m.groups()
+                        job.duration = int(h) * 3600 + int(mi) * 60 + float(s)
+                stderr_tail.append(line.strip())
+                del stderr_tail[:-20]
+        reader = threading.Thread(target=read_stderr, daemon=True)
+        reader.start()
+
+        # -progress reports key=value lines; out_time_us is the output position
+        for line in job.process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key in ('out_time_us', 'out_time_ms') and job.duration and value.isdigit():
+                job.progress = min(1.0, int(value) / 1e6 / job.duration)
+        code = job.process.wait()
+        reader.join(timeout=5)
+        if job.state == 'running' and code != 0:
+            job.state = 'failed'
+            job.error = next((l for l in reversed(stderr_tail) if l), f'ffmpeg exited with {code}')
+
+    # Kill running ffmpeg processes (on shutdown); their .part files are removed
+    def stop(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            if job.state in ('queued', 'running'):
+                job.state = 'cancelled'
+                if job.process is not None and job.process.poll() is None:
+                    job.process.terminate()
+
+FFMPEG_DURATION_RE = re.compile(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+# Output exists and is at least as new as its source
+def transcode_up_to_date(source, output):
+    try:
+        return os.stat(output).st_mtime >= os.stat(source).st_mtime
+    except OSError:
+        return False
+
+# Exclusively create the temp output; replaces .part files left behind by a crash
+def claim_part_file(part):
+    for _ in range(2):
+        try:
+            os.close(os.open(part, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(part).st_mtime < TRANSCODE_STALE_PART:
+                    return False
+                os.remove(part)
+            except OSError:
+                return False
+    return False
+
+transcoder = TranscodeManager()
+atexit.register(transcoder.stop)
+
+# Queue transcoding jobs for the library (secret library with a token)
+@app.route('/transcode/scan', methods=['POST'])
+@local_only
+def transcode_scan():
+    jobs = transcoder.scan(is_secret_request())
+    return jsonify({'queued': [job.to_dict() for job in jobs], 'max_jobs': transcoder.max_jobs})
+
+@app.route('/transcode/jobs')
+@local_only
+def transcode_jobs():
+    return jsonify({'jobs': transcoder.list_jobs(), 'max_jobs': transcoder.max_jobs})
+
+@app.route('/transcode/jobs/<int:job_id>/cancel', methods=['POST'])
+@local_only
+def transcode_cancel(job_id):
+    job = transcoder.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'no such job'}), 404
+    return jsonify(job.to_dict())
+
+# Thumbnails and seek-preview sprites, generated by ffmpeg on a small background pool and
+# kept on disk under a byte budget (least recently used files are removed first). Cache
+# files are named by a hash of (library, path, mtime, size), so a changed video gets new
+# images. Requests for images that are not ready yet get a placeholder right away.
+class ThumbnailCache:
+    def __init__(self, directory, max_bytes=THUMB_CACHE_BYTES, workers=THUMB_WORKERS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.files = None           # cache file name -> size, in LRU order
+        self.total = 0
+        self.loaded = 0
+        self.pending = set()
+        self.failed = {}            # cache file name -> when rendering it failed
+        self.pool = None
+
+    # Index the directory; it is shared with other worker processes, so this is redone
+    # periodically. Images this process knows keep their LRU order, new ones go first.
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.jpg') and entry.is_file():
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name, st.st_size))
+        found.sort()
+        sizes = {name: size for _, name, size in found}
+        known = [name for name in (self.files or ()) if name in sizes]
+        known_set = set(known)
+        order = [name for _, name, _ in found if name not in known_set] + known
+        self.files = OrderedDict((name, sizes[name]) for name in order)
+        self.total = sum(self.files.values())
+        self.loaded = time.monotonic()
+        now = time.time()
+        self.failed = {name: t for name, t in self.failed.items() if now - t < THUMB_RETRY_AFTER}
+
+    def _add(self, name, size):
+        self.total += size - self.files.pop(name, 0)
+        self.files[name] = size
+
+    @staticmethod
+    def key(kind, is_secret, rel_path, st):
+        raw = f'{kind}\0{int(is_secret)}\0{rel_path}\0{st.st_mtime_ns}\0{st.st_size}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest() + '.jpg'
+
+    # Path of a ready image, or None after queueing its generation
+    def get(self, kind, source, name):
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            if self.files is None or time.monotonic() - self.loaded >= THUMB_RESCAN_INTERVAL:
+                self._load()
+            if name in self.files:
+                self.files.move_to_end(name)
+                if os.path.isfile(path):
+                    return path
+                self.total -= self.files.pop(name)
+            elif os.path.isfile(path):
+                # Rendered by another worker process since the last scan
+                self._add(name, os.path.getsize(path))
+                return path
+            if name in self.pending or len(self.pending) >= THUMB_MAX_PENDING:
+                return None
+            if time.time() - self.failed.get(name, 0) < THUMB_RETRY_AFTER:
+                return None
+            self.failed.pop(name, None)
+            self.pending.add(name)
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumb')
+        self.pool.submit(self._generate, kind, source, name)
+        return None
+
+    def _generate(self, kind, source, name):
+        path = os.path.join(self.directory, name)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            if os.path.isfile(path):
+                # Another worker finished it while this job was queued
+                ok = True
+            else:
+                ok = render_thumbnail(source, tmp) if kind == 'thumb' else render_sprite(source, tmp)
+                if ok:
+                    os.replace(tmp, path)
+            if ok:
+                size = os.path.getsize(path)
+        except OSError:
+            ok = False
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self.lock:
+            self.pending.discard(name)
+            if not ok:
+                self.failed[name] = time.time()
+                return
+            self._add(name, size)
+            while self.total > self.max_bytes and len(self.files) > 1:
+                old, old_size = self.files.popitem(last=False)
+                self.total -= old_size
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass
+
+def _run_ffmpeg(cmd):
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True, errors='replace',
+                                timeout=THUMB_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result
+
+def render_thumbnail(source, output):
+    # Pick a representative frame a few seconds in; short clips fall back to the start
+    for seek in (THUMB_SEEK, 0):
+        cmd = [FFMPEG_BIN, '-hide_banner', '-nostdin', '-y', '-ss', str(seek), '-i', source,
+               '-vf', f'thumbnail,scale={THUMB_WIDTH}:-2', '-frames:v', '1', '-update', '1', '-f', 'image2',
+               '-c:v', 'mjpeg', output]
+        result = _run_ffmpeg(cmd)
+        if result is not None and result.returncode == 0 and os.path.isfile(output) and os.path.getsize(output):
+            return True
+    return False
+
+def render_sprite(source, output):
+    # ffmpeg prints the duration even when given no output
+    result = _run_ffmpeg([FFMPEG_BIN, '-hide_banner', '-nostdin', '-i', source])
+    m = FFMPEG_DURATION_RE.search(result.stderr) if result is not None else None
+    if not m:
+        return False
+    h, mi, s = m.groups()
+    duration = int(h) * 3600 + int(mi) * 60 + float(s)
+    if duration <= 0:
+        return False
+    tiles = SPRITE_COLUMNS * SPRITE_ROWS
+    # Only keyframes are decoded, which keeps long videos cheap
+    cmd = [FFMPEG_BIN, '-hide_banner', '-nostdin', '-y', '-skip_frame', 'nokey', '-i', source,
+           '-vf', f'fps={tiles}/{duration:.3f},scale={SPRITE_TILE_WIDTH}:-2,tile={SPRITE_COLUMNS}x{SPRITE_ROWS}',
+           '-frames:v', '1', '-update', '1', '-f', 'image2', '-c:v', 'mjpeg', output]
+    result = _run_ffmpeg(cmd)
+    return result is not None and result.returncode == 0 and os.path.isfile(output) and os.path.getsize(output) > 0
+
+THUMB_PLACEHOLDER = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="160" height="90" viewBox="0 0 160 90">'
+    '<rect width="160" height="90" fill="#e8eaf6"/>'
+    '<path d="M68 30 L96 45 L68 60 Z" fill="#667eea" opacity="0.6"/></svg>'
+)
+
+thumbnails = ThumbnailCache(THUMB_CACHE_DIR or os.path.join(tempfile.gettempdir(), 'video-share-thumbs'))
+
+def image_response(kind, filename):
+    is_secret = is_secret_request()
+    file_path = os.path.join(SECRET_VIDEO_ROOT if is_secret else VIDEO_ROOT, filename)
+    if not os.path.isfile(file_path):
+        return 'File not found', 404
+    st = os.stat(file_path)
+    name = ThumbnailCache.key(kind, is_secret, filename, st)
+    path = thumbnails.get(kind, file_path, name)
+    if path is None:
+        resp = app.response_class(THUMB_PLACEHOLDER, mimetype='image/svg+xml')
+        resp.headers['Cache-Control'] = 'no-store'
+        resp.headers['Retry-After'] = '5'
+        return resp
+
+    etag = name[:-4]
+    cache_control = 'private, no-store' if is_secret else f'public, max-age={VIDEO_MAX_AGE}'
+    if is_not_modified(etag):
+        resp = app.response_class(status=304)
+    else:
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return 'File not found', 404
+        resp = file_response(f, [(0, os.fstat(f.fileno()).st_size)], 200, mimetype='image/jpeg')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = cache_control
+    return resp
+
+# Poster-frame thumbnail of a video
+@app.route('/thumb/<path:filename>')
+def thumb(filename):
+    return image_response('thumb', filename)
+
+# Seek-preview sprite: SPRITE_COLUMNS x SPRITE_ROWS tiles evenly spaced over the duration,
+# left to right, top to bottom
+@app.route('/sprite/<path:filename>')
+def sprite(filename):
+    resp = image_response('sprite', filename)
+    if not isinstance(resp, tuple):
+        resp.headers['X-Sprite-Grid'] = f'{SPRITE_COLUMNS}x{SPRITE_ROWS}'
+    return resp
+
+# Block cache hit/miss counters, for sizing BLOCK_CACHE_BYTES
+@app.route('/block-cache')
+@local_only
+def block_cache_stats():
+    if block_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(block_cache.stats(), enabled=True))
+
+@app.before_request
+def start_request_timer():
+    request.environ['metrics.start'] = time.perf_counter()
+    metrics.start()
+    # Opt-in profiling of a sample of requests (one at a time)
+    if PROFILE_SLOW_REQUESTS > 0 and random.random() < PROFILE_SAMPLE_RATE and profile_lock.acquire(blocking=False):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profiler = profiler
+        except ValueError:
+            # Another profiler is active in this interpreter
+            profile_lock.release()
+
+@app.after_request
+def add_server_timing(resp):
+    spans = g.get('spans', {})
+    start = request.environ.get('metrics.start')
+    total = time.perf_counter() - start if start is not None else None
+    timings = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in spans.items()]
+    if total is not None:
+        timings.append(f'app;dur={total * 1000:.2f}')
+    if timings:
+        resp.headers['Server-Timing'] = ', '.join(timings)
+    if PROFILE_SLOW_REQUESTS > 0 and total is not None and total >= PROFILE_SLOW_REQUESTS:
+        app.logger.warning('Slow request %s %s: %.1f ms (%s)', request.method, request.full_path.rstrip('?'),
+                           total * 1000, ', '.join(timings))
+        g.slow = True
+    return resp
+
+# Stop the sample profiler; slow requests get a .prof dump and a short report in the log
+@app.teardown_request
+def finish_profile(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+        if g.get('slow'):
+            import pstats
+            directory = PROFILE_DIR or os.path.join(tempfile.gettempdir(), 'video_share_profiles')
+            os.makedirs(directory, exist_ok=True)
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "index"}.prof'
+            profiler.dump_stats(os.path.join(directory, name))
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_REPORT_LINES)
+            app.logger.warning('Profile saved to %s\n%s', os.path.join(directory, name), report.getvalue())
+    finally:
+        profile_lock.release()
+
+profile_lock = threading.Lock()
+
+@app.after_request
+def record_request_duration(resp):
+    start = request.environ.get('metrics.start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('video_share_request_duration_seconds', time.perf_counter() - start,
+                        route=route, method=request.method, status=str(resp.status_code))
+    return resp
 
-// Video ended event
-player.onended = function() {
-    if (isAutoplayEnabled && allVideos.length > 0) {
-        // Find current video index
-        const currentIndex = allVideos.indexOf(currentVideo);
-        if (currentIndex !== -1 && currentIndex < allVideos.length - 1) {
-            // Play next video
-            loadVideo(allVideos[currentIndex + 1]);
-        } else if (currentIndex === allVideos.length - 1) {
-            // If last video, loop to first
-            loadVideo(allVideos[0]);
-        }
-    }
-};
+metrics.gauge('video_share_active_streams', 'File bodies holding an admission slot',
+              lambda: [((), admission.active)])
+metrics.gauge('video_share_token_store_entries', 'Used and revoked secret space tokens tracked',
+              lambda: [((), len(token_store))], aggregate='max')
+metrics.gauge('video_share_catalog_videos', 'Videos in each library',
+              lambda: [((('library', 'secret' if s else 'normal'),), len(c.entries)) for s, c in list(catalogs.items())],
+              aggregate='max')
+metrics.gauge('video_share_block_cache_bytes', 'Bytes held by the block cache',
+              lambda: [((), block_cache.size + block_cache.pinned_size)] if block_cache is not None else [])
 
-// Toggle autoplay state
-function toggleAutoplay() {
-    isAutoplayEnabled = !isAutoplayEnabled;
-    updateAutoplayButton();
-    
-    // Save state to localStorage
-    const autoplayKey = isSecretMode ? 'autoplaySecretEnabled' : 'autoplayEnabled';
-    localStorage.setItem(autoplayKey, isAutoplayEnabled.toString());
-}
+# Prometheus scrape endpoint
+@app.route('/metrics')
+def metrics_endpoint():
+    if request.remote_addr not in METRICS_ADDRESSES:
+        return 'Forbidden', 403
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-// Update autoplay button state
-function updateAutoplayButton() {
-    const btn = document.getElementById('autoplayBtn');
-    const text = document.getElementById('autoplayText');
-    
-    if (isAutoplayEnabled) {
-        btn.classList.add('active');
-        text.textContent = 'Autoplay: ON';
-    } else {
-        btn.classList.remove('active');
-        text.textContent = 'Autoplay: OFF';
-    }
-}
+# Stream slots and per-volume disk read occupancy of this process
+@app.route('/admission')
+@local_only
+def admission_status():
+    return jsonify(admission.status())
 
-// Search functionality
-searchInput.addEventListener('input', function() {
-    const keyword = this.value.toLowerCase();
-    
-    // Detect if trigger word is entered
-    if (keyword === 'secret' && !isSecretMode) {
-        // Show password dialog
-        passwordModal.style.display = 'flex';
-        passwordInput.value = '';
-        passwordInput.focus();
-        // Clear search box
-        this.value = '';
-        return;
-    }
-    
-    const filtered = allVideos.filter(v => v.toLowerCase().includes(keyword));
-    renderVideoList(filtered);
-    videoCount.textContent = `${filtered.length} / ${allVideos.length} videos`;
-});
+# Bandwidth shaping settings (GET) and runtime changes (POST JSON or form fields, any of
+# global_rate, client_rate, small_range, small_weight, burst)
+@app.route('/bandwidth', methods=['GET', 'POST'])
+@local_only
+def bandwidth():
+    if request.method == 'POST':
+        values = request.get_json(silent=True) or request.form.to_dict()
+        unknown = set(values) - set(BandwidthShaper.FIELDS)
+        if unknown:
+            return jsonify({'error': 'unknown settings: ' + ', '.join(sorted(unknown))}), 400
+        try:
+            shaper.configure(**values)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify(dict(shaper.config(), **shaper.stats()))
 
-// Password verification
-function verifyPassword() {
-    const password = passwordInput.value;
-    
-    fetch('/verify-secret', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ password: password })
-    })
-    .then(r => r.json())
-    .then(data => {
-        if (data.success) {
-            // Password correct, redirect to secret space
-            window.location.href = '/?secretnumber=' + data.token;
-        } else {
-            alert('Wrong password!');
-            passwordInput.value = '';
-            passwordInput.focus();
-        }
-    })
-    .catch(err => {
-        alert('Verification failed, please try again');
-    });
-}
+# Keep-alive aware request handler: a connection waiting for its next request gives its
+# thread up after SERVER_KEEPALIVE_TIMEOUT, or at once when another connection is waiting
+# for a thread; active requests get SERVER_REQUEST_TIMEOUT per socket operation
+class PooledRequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
 
-// Cancel password input
-function cancelPassword() {
-    passwordModal.style.display = 'none';
-    passwordInput.value = '';
-}
+    def handle_one_request(self):
+        if not self.server.wait_for_request(self.connection):
+            self.close_connection = True
+            return
+        self.connection.settimeout(SERVER_REQUEST_TIMEOUT)
+        return super().handle_one_request()
 
-// Submit password on Enter key
-passwordInput.addEventListener('keypress', function(e) {
-    if (e.key === 'Enter') {
-        verifyPassword();
-    }
-});
+# WSGI server that hands accepted connections to a fixed-size thread pool instead of
+# spawning one thread per connection. A connection is only accepted when a thread is free,
+# so with every thread busy new connections stay in the listen queue, where another worker
+# process can take them.
+class PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+    request_queue_size = SERVER_BACKLOG
 
-// Keyboard shortcuts (desktop only)
-if (!isMobile) {
-    document.addEventListener('keydown', function(e) {
-        if (e.target.tagName === 'INPUT') return;
-        
-        // Prevent keyboard repeat (when holding key)
-        if (e.repeat) return;
-        
-        if (e.key === ' ') {
-            e.preventDefault();
-            if (player.paused) player.play();
-            else player.pause();
-        }
-        
-        // F key toggles fullpage mode
-        if (e.key === 'f' || e.key === 'F') {
-            e.preventDefault();
-            if (currentVideo) {
-                toggleFullpage();
-            }
-        }
-        
-        // Esc key exits fullpage mode
-        if (e.key === 'Escape' && isFullpageMode) {
-            e.preventDefault();
-            toggleFullpage();
-        }
-    });
-}
+    def __init__(self, host, port, app, threads=SERVER_THREADS):
+        super().__init__(host, port, app, handler=PooledRequestHandler)
+        # Workers share the listening socket: a worker that lost the race must not block in accept()
+        self.socket.setblocking(False)
+        self.threads = threads
+        self.pool = None
+        self.slots = threading.Semaphore(threads)
+        self.busy = 0
+        self.busy_lock = threading.Lock()
+        self.connections = set()
+        self.draining = False
 
-// Mobile sidebar toggle
-if (isMobile) {
-    sidebarHeader.addEventListener('click', function() {
-        sidebar.classList.toggle('collapsed');
-    });
-    
-    // No longer auto-collapse on initialization
-    // setTimeout(() => {
-    //     if (!currentVideo) {
-    //         sidebar.classList.add('collapsed');
-    //     }
-    // }, 2000);
-}
+    def _handle_request_noblock(self):
+        if not self.slots.acquire(timeout=SERVER_IDLE_POLL):
+            return
+        try:
+            request, client_address = self.get_request()
+        except OSError:
+            self.slots.release()
+            return
+        try:
+            self.process_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            self.slots.release()
 
-// Fullscreen functionality
-function toggleFullscreen() {
-    if (!document.fullscreenElement) {
-        if (player.requestFullscreen) {
-            player.requestFullscreen();
-        } else if (player.webkitRequestFullscreen) {
-            player.webkitRequestFullscreen();
-        } else if (player.webkitEnterFullscreen) {
-            player.webkitEnterFullscreen();
-        }
-    } else {
-        if (document.exitFullscreen) {
-            document.exitFullscreen();
-        } else if (document.webkitExitFullscreen) {
-            document.webkitExitFullscreen();
-        }
-    }
-}
+    def process_request(self, request, client_address):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='request')
+        with self.busy_lock:
+            self.busy += 1
+            self.connections.add(request)
+        count_connection(1)
+        self.pool.submit(self._process_request, request, client_address)
 
-// Fullpage mode functionality
-function toggleFullpage() {
-    isFullpageMode = !isFullpageMode;
-    updateFullpageButton();
-    
-    // Save state
-    const storageKey = isSecretMode ? 'fullpageSecretMode' : 'fullpageMode';
-    localStorage.setItem(storageKey, isFullpageMode.toString());
-}
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            count_connection(-1)
+            with self.busy_lock:
+                self.busy -= 1
+                self.connections.discard(request)
+            self.slots.release()
 
-// Update fullpage button state
-function updateFullpageButton() {
-    const btn = document.getElementById('fullpageBtn');
-    const icon = document.querySelector('.fullpage-icon');
-    const text = document.getElementById('fullpageText');
-    
-    if (isFullpageMode) {
-        document.body.classList.add('fullpage-mode');
-        btn.classList.add('active');
-        icon.textContent = '◱';
-        text.textContent = 'Fullpage: ON';
-    } else {
-        document.body.classList.remove('fullpage-mode');
-        btn.classList.remove('active');
-        icon.textContent = '⬜';
-        text.textContent = 'Fullpage: OFF';
-    }
-}
+    # Wait for the next request on a connection; False means close it instead
+    def wait_for_request(self, connection):
+        deadline = time.monotonic() + SERVER_KEEPALIVE_TIMEOUT
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(connection, selectors.EVENT_READ)
+                while not selector.select(SERVER_IDLE_POLL):
+                    if self.draining or time.monotonic() >= deadline:
+                        return False
+                    if self.busy >= self.threads and select.select([self.socket], [], [], 0)[0]:
+                        return False
+        except (OSError, ValueError):
+            return False
+        return True
 
-// Restore fullpage mode state
-function restoreFullpageMode() {
-    const storageKey = isSecretMode ? 'fullpageSecretMode' : 'fullpageMode';
-    const savedFullpage = localStorage.getItem(storageKey);
-    if (savedFullpage === 'true' && currentVideo) {
-        isFullpageMode = true;
-        updateFullpageButton();
-    }
-}
+    # Stop accepting (safe to call from any thread); serve_forever() then returns
+    def drain(self):
+        self.draining = True
+        self.shutdown()
 
-// Prevent double-tap zoom on mobile
-if (isMobile) {
-    let lastTouchEnd = 0;
-    document.addEventListener('touchend', function(e) {
-        const now = Date.now();
-        if (now - lastTouchEnd <= 300) {
-            e.preventDefault();
+    # After serve_forever() returns (drain or Ctrl+C): idle keep-alive connections close,
+    # in-flight requests get SERVER_GRACEFUL_TIMEOUT to finish, then their connections are cut
+    def finish(self):
+        self.draining = True
+        deadline = time.monotonic() + SERVER_GRACEFUL_TIMEOUT
+        while self.busy and time.monotonic() < deadline:
+            time.sleep(SERVER_IDLE_POLL)
+        with self.busy_lock:
+            remaining = list(self.connections)
+        for connection in remaining:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+# Asyncio serving engine: one event loop per worker holds every connection. Requests are
+# routed through the same Flask views on a small thread pool (stat, validators, range
+# parsing), then bodies are written without blocking: file-backed bodies go through
+# loop.sendfile() and everything else through writer.drain() backpressure. A slow client
+# only costs a socket and a coroutine, not a thread.
+class AsyncStreamingServer:
+    def __init__(self, host, port, app, threads=SERVER_THREADS):
+        self.app = app
+        self.host = host
+        self.socket = socket.create_server((host, port), backlog=SERVER_BACKLOG)
+        self.port = self.socket.getsockname()[1]
+        self.threads = threads
+        self.pool = None
+        self.loop = None
+        self.stopping = None
+        self.connections = set()
+
+    def serve_forever(self):
+        import asyncio  # Only the async engine pays for importing asyncio
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+
+    def server_close(self):
+        self.socket.close()
+
+    # serve_forever() already gave connections SERVER_GRACEFUL_TIMEOUT; only views on the pool remain
+    def finish(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+    # Stop accepting, then let in-flight responses finish (safe to call from any thread)
+    def drain(self):
+        if self.loop is not None and self.stopping is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def _main(self):
+        import asyncio
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='request')
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket)
+        async with server:
+            await self.stopping.wait()
+            server.close()
+            if self.connections:
+                await asyncio.wait(self.connections, timeout=SERVER_GRACEFUL_TIMEOUT)
+
+    async def _handle_connection(self, reader, writer):
+        import asyncio
+        task = asyncio.current_task()
+        self.connections.add(task)
+        count_connection(1)
+        try:
+            while not self.stopping.is_set():
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), SERVER_KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                environ = self._build_environ(head, writer)
+                if environ is None or not (environ.get('CONTENT_LENGTH') or '0').isdigit():
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+                if length > MAX_REQUEST_BODY:
+                    writer.write(b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                if length:
+                    body = await asyncio.wait_for(reader.readexactly(length), SERVER_REQUEST_TIMEOUT)
+                    environ['wsgi.input'] = io.BytesIO(body)
+                if not await self._respond(environ, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.connections.discard(task)
+            count_connection(-1)
+            writer.close()
+
+    def _build_environ(self, head, writer):
+        try:
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+        path, _, query = target.partition('?')
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
         }
-        lastTouchEnd = now;
-    }, false);
-}
-</script>
-</body>
-</html>
-''', is_mobile=is_mobile, is_secret_mode=is_secret_mode)
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+            key = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+            else:
+                key = 'HTTP_' + key
+                environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
 
-# Verify password and generate token
-@app.route('/verify-secret', methods=['POST'])
-def verify_secret():
-    data = request.get_json()
-    password = data.get('password', '')
-    
-    if password == SECRET_PASSWORD:
-        # Generate unique token
-        token = secrets.token_urlsafe(32)
-        # Set token validity to 5 minutes (user has 5 minutes to click the link)
-        valid_tokens[token] = time.time() + 300
-        return jsonify({'success': True, 'token': token})
-    else:
-        return jsonify({'success': False})
+    # Run the Flask view for one request (on the thread pool)
+    def _dispatch(self, environ):
+        with self.app.request_context(environ):
+            try:
+                resp = self.app.full_dispatch_request()
+            except Exception as e:
+                resp = self.app.make_response(self.app.handle_exception(e))
+        return resp
 
-# Invalidate token
-@app.route('/invalidate-token', methods=['POST'])
-def invalidate_token():
-    secret_token = request.args.get('secretnumber', '')
-    if secret_token and secret_token in valid_tokens:
-        del valid_tokens[secret_token]
-    return '', 204
+    # Write one response; returns whether the connection can be kept alive
+    async def _respond(self, environ, writer):
+        resp = await self.loop.run_in_executor(self.pool, self._dispatch, environ)
+        file_body = getattr(resp, 'file_body', None)
+        stats = getattr(resp, 'stream_stats', None)
+        try:
+            headers = resp.get_wsgi_headers(environ)
+            has_body = environ['REQUEST_METHOD'] != 'HEAD' and resp.status_code not in (204, 304)
+            keep_alive = (environ['SERVER_PROTOCOL'] == 'HTTP/1.1'
+                          and environ.get('HTTP_CONNECTION', '').lower() != 'close'
+                          and not self.stopping.is_set())
+            chunked = has_body and 'Content-Length' not in headers
+            if chunked:
+                if keep_alive:
+                    headers['Transfer-Encoding'] = 'chunked'
+                else:
+                    chunked = False
+            headers['Connection'] = 'keep-alive' if keep_alive else 'close'
 
-@app.route('/videos')
-def videos():
-    # Check if in secret mode
-    secret_token = request.args.get('secretnumber', '')
-    is_secret = False
-    
-    if secret_token and secret_token in valid_tokens:
-        # Token exists means it's valid (including used state -1)
-        is_secret = True
-    
-    return jsonify(get_video_list(is_secret=is_secret))
+            head = f'HTTP/1.1 {resp.status}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+            writer.write(head.encode('latin-1'))
+            await writer.drain()
+            if stats is not None:
+                stats.first_byte()
+            if not has_body:
+                return keep_alive
 
-@app.route('/video/<path:filename>')
-def video(filename):
-    # Check if in secret mode
-    secret_token = request.args.get('secretnumber', '')
-    is_secret = False
-    
-    if secret_token and secret_token in valid_tokens:
-        # Token exists means it's valid (including used state -1)
-        is_secret = True
-    
-    video_root = SECRET_VIDEO_ROOT if is_secret else VIDEO_ROOT
-    file_path = os.path.join(video_root, filename)
-    
-    if not os.path.isfile(file_path):
-        return 'File not found', 404
+            if file_body is not None:
+                # Unlimited and unshaped ranges go straight through sendfile. With a disk
+                # read limit the chunk is read on the pool while holding the volume's slot and
+                # written after releasing it, so a slow client never holds a disk slot.
+                # Reads and sends are all timed as send.
+                f, segments = file_body
+                device = os.fstat(f.fileno()).st_dev
+                limited = ADMISSION_DISK_READS > 0
+                started = time.perf_counter()
+                try:
+                    for segment in segments:
+                        if isinstance(segment, bytes):
+                            writer.write(segment)
+                            await writer.drain()
+                            stats.sent(len(segment))
+                            continue
+                        client = environ['REMOTE_ADDR']
+                        small = shaper.is_small(segment[1])
+                        offset, end = segment[0], segment[0] + segment[1]
+                        while offset < end:
+                            if shaper.active or limited:
+                                n = min(STREAM_CHUNK_SIZE, end - offset)
+                            else:
+                                n = min(SENDFILE_CHUNK_SIZE, end - offset)
+                            if shaper.active:
+                                await shaper.acquire_async(client, n, small)
+                            if limited:
+                                data = await admission.disk_read_async(device, f, offset, n, self.pool)
+                                if not data:
+                                    # The file shrank under us: the body is short, drop the connection
+                                    return False
+                                writer.write(data)
+                                await writer.drain()
+                                n = len(data)
+                            else:
+                                await self.loop.sendfile(writer.transport, f, offset, n)
+                            stats.sent(n)
+                            offset += n
+                finally:
+                    metrics.observe('video_share_stream_send_seconds', time.perf_counter() - started)
+                return keep_alive
 
-    range_header = request.headers.get('Range', None)
-    if not range_header:
-        return send_file(file_path)
+            app_iter = resp.get_app_iter(environ)
+            try:
+                chunks = iter(app_iter)
+                while True:
+                    if resp.is_sequence:
+                        chunk = next(chunks, None)
+                    else:
+                        # Generators may block (disk, catalog), pull them on the pool
+                        chunk = await self.loop.run_in_executor(self.pool, next, chunks, None)
+                    if chunk is None:
+                        break
+                    if not chunk:
+                        continue
+                    if chunked:
+                        writer.write(b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+                    else:
+                        writer.write(chunk)
+                    await writer.drain()
+                if chunked:
+                    writer.write(b'0\r\n\r\n')
+                    await writer.drain()
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            return keep_alive
+        finally:
+            if file_body is not None:
+                file_body[0].close()
+            resp.close()
 
-    size = os.path.getsize(file_path)
-    byte1, byte2 = 0, size - 1
-    m = range_header.replace('bytes=', '').split('-')
-    if m[0]: byte1 = int(m[0])
-    if m[1]: byte2 = int(m[1])
-    length = byte2 - byte1 + 1
+# Before serving: load the catalogs (from their snapshots when present, so forked workers
+# share them copy-on-write). Only a first start without snapshots walks the libraries here.
+def warm_up():
+    for is_secret in (False, True):
+        catalog = get_catalog(is_secret)
+        if not catalog.scanned and not catalog.load_snapshot():
+            catalog.refresh(full=True)
+            catalog.save_snapshot()
 
-    with open(file_path, 'rb') as f:
-        f.seek(byte1)
-        data = f.read(length)
+# Once a process is serving: revalidate the catalogs and render the index pages in the
+# background (a request arriving first renders them itself)
+def start_background_work():
+    for is_secret in (False, True):
+        get_catalog(is_secret).start()
+    def render():
+        get_index_pages()
+        get_static_assets()
+    threading.Thread(target=render, name='warm-up', daemon=True).start()
 
-    # Set correct MIME type based on file extension
-    ext = os.path.splitext(filename)[1].lower()
-    mime_types = {
-        '.mp4': 'video/mp4',
-        '.webm': 'video/webm',
-        '.ogg': 'video/ogg',
-        '.mkv': 'video/x-matroska',
-        '.rmvb': 'application/vnd.rn-realmedia-vbr',
-        '.avi': 'video/x-msvideo',
-        '.flv': 'video/x-flv',
-        '.mov': 'video/quicktime'
-    }
-    mimetype = mime_types.get(ext, 'video/mp4')
-    
-    resp = app.response_class(data, 206, mimetype=mimetype, direct_passthrough=True)
-    resp.headers.add('Content-Range', f'bytes {byte1}-{byte2}/{size}')
-    resp.headers.add('Accept-Ranges', 'bytes')
-    resp.headers.add('Content-Length', str(length))
-    return resp
+def run_worker(server):
+    # SIGTERM: stop accepting and finish active requests, then exit
+    def on_term(signum, frame):
+        threading.Thread(target=server.drain, daemon=True).start()
+    signal.signal(signal.SIGTERM, on_term)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    start_background_work()
+    server.serve_forever()
+    server.finish()
+    save_catalog_snapshots()
+
+def fork_worker(server):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(server)
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+# Production launcher: pre-forked worker processes share one listening socket, each with
+# its own request thread pool. Crashed workers are replaced; SIGTERM/SIGINT drains them
+# gracefully. Platforms without fork (Windows) run a single pooled process.
+def serve(host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS, threads=SERVER_THREADS, engine=SERVER_ENGINE):
+    global token_store
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if not hasattr(os, 'fork'):
+        workers = 1
+
+    # Every worker enforces its share of the stream limit and cache budget
+    admission.share = 1.0 / workers
+    if block_cache is not None:
+        block_cache.share = 1.0 / workers
+
+    # One-time links need a shared used/revoked list once there is more than one process
+    if workers > 1 and not TOKEN_REVOCATION_DB and isinstance(token_store, TokenStore):
+        token_store = SqliteTokenStore(os.path.join(tempfile.gettempdir(), f'video_share_tokens_{port}.db'))
+
+    if engine == 'async':
+        server = AsyncStreamingServer(host, port, app, threads=threads)
+    else:
+        server = PooledWSGIServer(host, port, app, threads=threads)
+    # Workers share metrics through snapshot files; the warm-up scans are recorded once
+    if workers > 1:
+        metrics.directory = os.path.join(tempfile.gettempdir(), f'video_share_metrics_{port}')
+        os.makedirs(metrics.directory, exist_ok=True)
+        for entry in os.scandir(metrics.directory):
+            if entry.name.endswith(('.json', '.tmp')):
+                os.remove(entry.path)
+    warm_up()
+    if workers > 1:
+        metrics.dump()
+        metrics.reset()
+    app.logger.warning('Serving on http://%s:%s with %d %s worker(s) x %d threads', host, server.port, workers, engine, threads)
+
+    if workers == 1:
+        def on_term(signum, frame):
+            threading.Thread(target=server.drain, daemon=True).start()
+        signal.signal(signal.SIGTERM, on_term)
+        start_background_work()
+        server.serve_forever()
+        server.finish()
+        save_catalog_snapshots()
+        return
+
+    children = set(fork_worker(server) for _ in range(workers))
+    stopping = False
+
+    def on_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+
+    deadline = None
+    while children:
+        if stopping and deadline is None:
+            deadline = time.time() + SERVER_GRACEFUL_TIMEOUT
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if deadline is not None and time.time() > deadline:
+                # Streams still running after the grace period are cut off
+                for pid in children:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                deadline = float('inf')
+            time.sleep(0.2)
+            continue
+        children.discard(pid)
+        if not stopping:
+            app.logger.warning('Worker %d exited (status %d), restarting', pid, status)
+            children.add(fork_worker(server))
+    server.server_close()
 
 if __name__ == '__main__':
-    app.run(threaded=True, host='0.0.0.0', port=80)
+    parser = argparse.ArgumentParser(description='Video sharing web server')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help='worker processes, 0 = one per CPU core')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help='request threads per worker')
+    parser.add_argument('--engine', choices=('threaded', 'async'), default=SERVER_ENGINE,
+                        help='threaded: one pooled thread per connection; async: asyncio event loop with sendfile')
+    parser.add_argument('--dev', action='store_true', help="use Flask's development server")
+    args = parser.parse_args()
+
+    if args.dev:
+        atexit.register(save_catalog_snapshots)
+        app.run(threaded=True, host=args.host, port=args.port)
+    else:
+        serve(args.host, args.port, args.workers, args.threads, args.engine)
 
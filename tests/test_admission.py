@@ -0,0 +1,73 @@
+import asyncio
+import http.client
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import single_file_videos_web_server as server
+
+
+def test_async_disk_reads_hold_a_slot_only_while_reading(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'ADMISSION_DISK_READS', 2)
+    path = tmp_path / 'a.bin'
+    path.write_bytes(bytes(range(256)) * 64)
+    admission = server.AdmissionController()
+    running, peak = 0, 0
+    original = path.open
+
+    class SlowFile:
+        def __init__(self):
+            self.f = original('rb')
+
+        def seek(self, offset):
+            self.f.seek(offset)
+
+        def read(self, n):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            time.sleep(0.02)
+            running -= 1
+            return self.f.read(n)
+
+    async def main():
+        with ThreadPoolExecutor(8) as pool:
+            return await asyncio.gather(*(admission.disk_read_async(7, SlowFile(), i * 100, 100, pool)
+                                          for i in range(6)))
+
+    chunks = asyncio.run(main())
+    assert chunks == [(bytes(range(256)) * 64)[i * 100:i * 100 + 100] for i in range(6)]
+    assert peak == 2
+    disk = admission.status()['disk_reads']['7']
+    assert disk['in_progress'] == 0 and disk['waited'] >= 1
+
+
+# Clients that stop reading must not hold the disk slots other async streams need
+def test_stalled_async_clients_do_not_block_other_streams(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'VIDEO_ROOT', str(tmp_path))
+    monkeypatch.setattr(server, 'ADMISSION_DISK_READS', 2)
+    monkeypatch.setattr(server, 'admission', server.AdmissionController())
+    monkeypatch.setattr(server, 'block_cache', None)
+    body = os.urandom(32 * 1024 * 1024)
+    (tmp_path / 'a.mp4').write_bytes(body)
+    srv = server.AsyncStreamingServer('127.0.0.1', 0, server.app, threads=4)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    stalled = []
+    try:
+        for _ in range(4):
+            s = socket.create_connection(('127.0.0.1', srv.port))
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            s.sendall(b'GET /video/a.mp4 HTTP/1.1\r\nHost: x\r\n\r\n')
+            stalled.append(s)
+        time.sleep(1)
+        conn = http.client.HTTPConnection('127.0.0.1', srv.port, timeout=10)
+        conn.request('GET', '/video/a.mp4', headers={'Range': 'bytes=0-999999'})
+        resp = conn.getresponse()
+        assert resp.status == 206
+        assert resp.read() == body[:1000000]
+    finally:
+        for s in stalled:
+            s.close()
+        srv.drain()
@@ -0,0 +1,91 @@
+import gzip
+import json
+import os
+import stat
+
+import pytest
+
+import single_file_videos_web_server as server
+
+
+def test_one_worker_scans_and_the_others_follow(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'CATALOG_SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(server, 'Observer', None)
+    root = tmp_path / 'videos'
+    root.mkdir()
+    (root / 'a.mp4').write_bytes(b'a')
+    scanner, follower = server.VideoCatalog(str(root)), server.VideoCatalog(str(root))
+    scanner.refresh(full=True)
+    scanner.save_snapshot()
+    assert follower.load_snapshot()
+    assert scanner._lead()
+    assert not follower._lead()
+
+    scanned = []
+    monkeypatch.setattr(follower, 'refresh', lambda full=False: scanned.append(full))
+    (root / 'b.mp4').write_bytes(b'b')
+    scanner.refresh()
+    scanner.save_snapshot()
+    assert follower.load_snapshot(follow=True)
+    assert follower.paths == ['a.mp4', 'b.mp4']
+    assert follower.digest == scanner.digest
+    assert scanned == []
+
+    # An unchanged snapshot is not reparsed; the lock is released with its holder
+    version = follower.version
+    assert follower.load_snapshot(follow=True) and follower.version == version
+    scanner.lock_file.close()
+    assert follower._lead()
+
+
+def saved_catalog(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    monkeypatch.setattr(server, 'CATALOG_SNAPSHOT_DIR', '')
+    root = tmp_path / 'videos'
+    (root / 'season 1').mkdir(parents=True)
+    (root / 'a.mp4').write_bytes(b'a')
+    (root / 'season 1' / 'é.mkv').write_bytes(b'b')
+    catalog = server.VideoCatalog(str(root))
+    catalog.refresh(full=True)
+    catalog.save_snapshot()
+    return catalog
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX permissions')
+def test_snapshot_round_trip_in_private_directory(tmp_path, monkeypatch):
+    catalog = saved_catalog(tmp_path, monkeypatch)
+    path = catalog.snapshot_path()
+    assert path.startswith(str(tmp_path / 'cache' / 'video_share'))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+
+    loaded = server.VideoCatalog(catalog.root)
+    assert loaded.load_snapshot()
+    assert loaded.paths == catalog.paths == ['a.mp4', 'season 1/é.mkv']
+    assert loaded.dirs == catalog.dirs
+    assert loaded.last_full_scan == catalog.last_full_scan
+
+
+@pytest.mark.parametrize('tamper', [
+    lambda s: s.update(format=1),
+    lambda s: s.update(root='/elsewhere'),
+    lambda s: s['dirs'][''][2].append('..'),
+    lambda s: s['dirs'][''][1].append(['x.mp4', 'big', 0]),
+    lambda s: s.update(dirs=[]),
+])
+def test_malformed_snapshot_is_rejected(tmp_path, monkeypatch, tamper):
+    catalog = saved_catalog(tmp_path, monkeypatch)
+    path = catalog.snapshot_path()
+    with open(path, 'rb') as f:
+        snapshot = json.loads(gzip.decompress(f.read()))
+    tamper(snapshot)
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(json.dumps(snapshot).encode()))
+    assert not server.VideoCatalog(catalog.root).load_snapshot()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX permissions')
+def test_snapshot_in_directory_writable_by_others_is_ignored(tmp_path, monkeypatch):
+    catalog = saved_catalog(tmp_path, monkeypatch)
+    os.chmod(os.path.dirname(catalog.snapshot_path()), 0o777)
+    assert not server.VideoCatalog(catalog.root).load_snapshot()
@@ -0,0 +1,55 @@
+import os
+import struct
+
+import single_file_videos_web_server as server
+
+box, full_box = server.mp4_box, server.mp4_full_box
+
+
+# ftyp, mdat with two chunks, then a moov whose stco points at them
+def write_mp4(path, trailer=b''):
+    ftyp = box(b'ftyp', b'isom\0\0\0\0isom')
+    mdat = box(b'mdat', b'A' * 100 + b'B' * 100)
+    first_chunk = len(ftyp) + 8
+    stco = full_box(b'stco', 0, 0, struct.pack('>III', 2, first_chunk, first_chunk + 100))
+    moov = box(b'moov', box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', stco)))))
+    data = ftyp + mdat + moov + trailer
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def read_virtual(path, layout):
+    out = b''
+    with open(path, 'rb') as f:
+        for segment in layout.segments(0, layout.size):
+            if isinstance(segment, bytes):
+                out += segment
+            else:
+                f.seek(segment[0])
+                out += f.read(segment[1])
+    return out
+
+
+def chunk_offsets(data):
+    pos = data.index(b'stco') + 8
+    count = struct.unpack_from('>I', data, pos)[0]
+    return struct.unpack_from(f'>{count}I', data, pos + 4)
+
+
+def test_moov_moves_first_with_patched_offsets(tmp_path):
+    path = str(tmp_path / 'a.mp4')
+    original = write_mp4(path)
+    layout = server.build_faststart_layout(path, os.path.getsize(path))
+    assert layout.size == len(original)
+    virtual = read_virtual(path, layout)
+    assert virtual.index(b'moov') < virtual.index(b'mdat')
+    a, b = chunk_offsets(virtual)
+    assert virtual[a:a + 100] == b'A' * 100
+    assert virtual[b:b + 100] == b'B' * 100
+
+
+def test_stray_trailing_bytes_serve_file_as_is(tmp_path):
+    path = str(tmp_path / 'a.mp4')
+    write_mp4(path, trailer=b'\0\0\0\0')
+    assert server.build_faststart_layout(path, os.path.getsize(path)) is None
@@ -0,0 +1,103 @@
+import os
+import struct
+import threading
+import time
+
+import single_file_videos_web_server as server
+
+box, full_box = server.mp4_box, server.mp4_full_box
+
+SAMPLES = 120           # 25 fps video, keyframe every 25 samples, 4 samples per chunk
+
+
+def write_mp4(path):
+    sizes = [50 + i % 9 for i in range(SAMPLES)]
+    data = b''.join(bytes([i % 251]) * size for i, size in enumerate(sizes))
+    ftyp = box(b'ftyp', b'isom\0\0\0\0isom')
+
+    def moov(data_start):
+        chunks, pos = [], data_start
+        for i in range(0, SAMPLES, 4):
+            chunks.append(pos)
+            pos += sum(sizes[i:i + 4])
+        stbl = box(b'stbl', full_box(b'stsd', 0, 0, struct.pack('>I', 1) + box(b'avc1', b'\0' * 20))
+                   + full_box(b'stts', 0, 0, struct.pack('>IIIII', 2, SAMPLES - 1, 1, 1, 3))
+                   + full_box(b'ctts', 0, 0, struct.pack('>IIiIi', 2, 1, 0, SAMPLES - 1, 2))
+                   + full_box(b'stss', 0, 0, struct.pack(f'>I{SAMPLES // 25 + 1}I', SAMPLES // 25 + 1, *range(1, SAMPLES + 1, 25)))
+                   + full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, 4, 1))
+                   + full_box(b'stsz', 0, 0, struct.pack(f'>II{SAMPLES}I', 0, SAMPLES, *sizes))
+                   + full_box(b'stco', 0, 0, struct.pack(f'>I{len(chunks)}I', len(chunks), *chunks)))
+        trak = box(b'trak', full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, 1, 0, 0) + b'\0' * 60)
+                   + box(b'mdia', full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, 25, SAMPLES, 0, 0))
+                         + full_box(b'hdlr', 0, 0, struct.pack('>I4s', 0, b'vide') + b'\0' * 12 + b'v\0')
+                         + box(b'minf', stbl)))
+        return box(b'moov', full_box(b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, 1000, 4800) + b'\0' * 80) + trak)
+
+    data_start = len(ftyp) + len(moov(0)) + 8
+    with open(path, 'wb') as f:
+        f.write(ftyp + moov(data_start) + struct.pack('>I4s', 8 + len(data), b'mdat') + data)
+    return data_start, sizes
+
+
+def test_sample_tables_expand_into_compact_arrays(tmp_path):
+    path = str(tmp_path / 'a.mp4')
+    data_start, sizes = write_mp4(path)
+    index = server.build_hls_index(path, os.path.getsize(path))
+    track = index.primary
+    assert [a.typecode for a in (track.offsets, track.sizes, track.dts, track.ctos)] == ['I', 'I', 'I', 'i']
+    assert list(track.offsets) == [data_start + sum(sizes[:i]) for i in range(SAMPLES)]
+    assert list(track.dts) == list(range(SAMPLES))
+    assert [track.duration(i) for i in (0, SAMPLES - 2, SAMPLES - 1)] == [1, 1, 3]
+    assert track.end == SAMPLES + 2
+    assert list(track.ctos) == [0] + [2] * (SAMPLES - 1)
+    assert list(track.sync) == list(range(0, SAMPLES, 25))
+
+    # Every segment's ranges cover exactly its samples' bytes
+    with open(path, 'rb') as f:
+        body = b''
+        for n in range(len(index.boundaries) - 1):
+            header, ranges, length = index.segment(n)
+            for offset, size in ranges:
+                f.seek(offset)
+                body += f.read(size)
+            assert length == len(header) + sum(size for _, size in ranges)
+    assert body == b''.join(bytes([i % 251]) * size for i, size in enumerate(sizes))
+
+
+def test_cache_is_bounded_by_bytes(tmp_path, monkeypatch):
+    paths = [str(tmp_path / f'{n}.mp4') for n in range(3)]
+    for path in paths:
+        write_mp4(path)
+    one = server.build_hls_index(paths[0], os.path.getsize(paths[0])).nbytes
+    monkeypatch.setattr(server, 'HLS_INDEX_CACHE_BYTES', one * 2)
+    monkeypatch.setattr(server, 'hls_cache', server.OrderedDict())
+    monkeypatch.setattr(server, 'hls_cache_bytes', 0)
+    for path in paths:
+        server.get_hls_index(path, os.stat(path))
+    assert [key[0] for key in server.hls_cache] == paths[1:]
+    assert server.hls_cache_bytes == 2 * one
+
+
+def test_concurrent_requests_build_once(tmp_path, monkeypatch):
+    path = str(tmp_path / 'a.mp4')
+    write_mp4(path)
+    monkeypatch.setattr(server, 'hls_cache', server.OrderedDict())
+    monkeypatch.setattr(server, 'hls_cache_bytes', 0)
+    builds = []
+    original = server.build_hls_index
+
+    def slow_build(file_path, size):
+        builds.append(file_path)
+        time.sleep(0.2)
+        return original(file_path, size)
+
+    monkeypatch.setattr(server, 'build_hls_index', slow_build)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(server.get_hls_index(path, os.stat(path))))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(builds) == 1
+    assert len(results) == 4 and all(r is results[0] for r in results)
@@ -0,0 +1,82 @@
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILE_SIZE = 3 * 1024 ** 3
+# Interpreter, Flask and the server module take about 35 MB; streaming 3 GB must not add much
+RSS_LIMIT_MB = 96
+
+SERVER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import single_file_videos_web_server as server
+library, port, engine = sys.argv[2], int(sys.argv[3]), sys.argv[4]
+server.VIDEO_ROOT = server.SECRET_VIDEO_ROOT = library
+server.CATALOG_SNAPSHOT_DIR = library + '/.snapshots'
+server.metadata_index.path = library + '/.metadata.db'
+server.block_cache = None
+server.serve('127.0.0.1', port, workers=1, threads=8, engine=engine)
+'''
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='reads /proc')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    raise AssertionError('no VmHWM')
+
+
+def download(port, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.request('GET', '/video/big.mp4', headers=headers or {})
+    resp = conn.getresponse()
+    total = 0
+    while True:
+        chunk = resp.read(1024 * 1024)
+        if not chunk:
+            break
+        total += len(chunk)
+    conn.close()
+    return resp.status, total
+
+
+@pytest.mark.parametrize('engine', ['threaded', 'async'])
+def test_streaming_sparse_file_keeps_rss_bounded(tmp_path, engine):
+    with open(tmp_path / 'big.mp4', 'wb') as f:
+        f.truncate(FILE_SIZE)
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, '-c', SERVER, ROOT, str(tmp_path), str(port), engine],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                assert proc.poll() is None, 'server exited'
+                assert time.time() < deadline, 'server did not start'
+                time.sleep(0.1)
+        assert download(port) == (200, FILE_SIZE)
+        assert download(port, {'Range': 'bytes=1000000000-'}) == (206, FILE_SIZE - 1000000000)
+        assert download(port, {'Range': 'bytes=0-99,-100'})[0] == 206
+        rss = peak_rss_mb(proc.pid)
+        assert rss < RSS_LIMIT_MB, f'{engine} engine peaked at {rss:.0f} MB'
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
@@ -0,0 +1,77 @@
+import builtins
+
+import pytest
+
+import single_file_videos_web_server as server
+
+
+@pytest.fixture
+def library(tmp_path):
+    root = tmp_path / 'videos'
+    root.mkdir()
+    # Not parseable as MP4, but identified as one by its first 8 bytes
+    (root / 'a.mp4').write_bytes(b'\0\0\0\x10ftypisom' + b'\0' * 4096)
+    (root / 'b.avi').write_bytes(b'RIFF' + b'\0' * 4096)
+    (root / 'c.mkv').write_bytes(b'\x1a\x45\xdf\xa3' + b'\0' * 4096)
+    catalog = server.VideoCatalog(str(root))
+    catalog.refresh(full=True)
+    return catalog
+
+
+@pytest.fixture
+def read_sizes(monkeypatch):
+    sizes = {}
+
+    class CountingFile:
+        def __init__(self, f):
+            self.f = f
+
+        def read(self, n=-1):
+            data = self.f.read(n)
+            sizes[self.f.name.rsplit('/', 1)[-1]] = sizes.get(self.f.name.rsplit('/', 1)[-1], 0) + len(data)
+            return data
+
+        def __getattr__(self, name):
+            return getattr(self.f, name)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.f.close()
+
+    monkeypatch.setattr(server, 'open', lambda *a, **k: CountingFile(builtins.open(*a, **k)), raising=False)
+    return sizes
+
+
+def test_only_matroska_reads_a_large_head(library, read_sizes):
+    for rel_path, size, mtime in library.entries:
+        server.probe_video(f'{library.root}/{rel_path}', size)
+    assert read_sizes['b.avi'] == 8
+    assert read_sizes['c.mkv'] > 8
+    assert read_sizes['a.mp4'] < server.METADATA_PROBE_BYTES
+
+
+def test_only_the_lock_holder_probes(library, tmp_path, monkeypatch):
+    probed = []
+    probe_video = server.probe_video
+    monkeypatch.setattr(server, 'probe_video', lambda path, size: probed.append(path) or probe_video(path, size))
+    db = str(tmp_path / 'metadata.db')
+    prober, follower = server.MetadataIndex(db), server.MetadataIndex(db)
+    assert prober._lead()
+    assert not follower._lead()
+
+    assert follower.sync(library, probe=False) == 0
+    assert probed == []
+    assert follower.get(library.root, library.entries[0]) is None
+
+    assert prober.sync(library) == 3
+    assert len(probed) == 3
+    assert follower.sync(library, probe=False) == 0
+    assert len(probed) == 3
+    for entry in library.entries:
+        assert follower.get(library.root, entry) == prober.get(library.root, entry)
+
+    # The lock is released with its holder
+    prober.lock_file.close()
+    assert follower._lead()
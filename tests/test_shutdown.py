@@ -0,0 +1,69 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRACE = 2
+
+SERVER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import single_file_videos_web_server as server
+library, port = sys.argv[2], int(sys.argv[3])
+server.VIDEO_ROOT = server.SECRET_VIDEO_ROOT = library
+server.CATALOG_SNAPSHOT_DIR = library + '/.snapshots'
+server.metadata_index.path = library + '/.metadata.db'
+server.SERVER_GRACEFUL_TIMEOUT = float(sys.argv[4])
+server.serve('127.0.0.1', port, workers=1, threads=4, engine='threaded')
+'''
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, 'SIGTERM') or sys.platform == 'win32', reason='POSIX signals')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# A stalled stream and an idle keep-alive connection must not outlive the grace period
+@pytest.mark.parametrize('signum', [signal.SIGTERM, signal.SIGINT])
+def test_single_process_shutdown_is_bounded(tmp_path, signum):
+    with open(tmp_path / 'big.mp4', 'wb') as f:
+        f.truncate(256 * 1024 * 1024)
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, '-c', SERVER, ROOT, str(tmp_path), str(port), str(GRACE)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    connections = []
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                assert time.time() < deadline and proc.poll() is None
+                time.sleep(0.1)
+        stalled = socket.create_connection(('127.0.0.1', port))
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.sendall(b'GET /video/big.mp4 HTTP/1.1\r\nHost: x\r\n\r\n')
+        idle = socket.create_connection(('127.0.0.1', port))
+        idle.sendall(b'GET /videos HTTP/1.1\r\nHost: x\r\n\r\n')
+        idle.recv(65536)
+        connections += [stalled, idle]
+        time.sleep(0.5)
+        started = time.time()
+        proc.send_signal(signum)
+        proc.wait(GRACE + 5)
+        assert time.time() - started < GRACE + 3
+    finally:
+        for s in connections:
+            s.close()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import single_file_videos_web_server as server
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+
+    def render(source, output):
+        calls.append(source)
+        if source.endswith('broken.mp4'):
+            return False
+        with open(output, 'wb') as f:
+            f.write(b'\xff\xd8 jpeg')
+        return True
+    monkeypatch.setattr(server, 'render_thumbnail', render)
+    return calls
+
+
+def wait_ready(cache, name, source='a.mp4'):
+    deadline = time.time() + 5
+    while True:
+        path = cache.get('thumb', source, name)
+        if path is not None:
+            return path
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def wait_idle(cache):
+    while cache.pending:
+        time.sleep(0.01)
+
+
+def test_image_rendered_by_another_worker_is_reused(tmp_path, renders):
+    first, second = server.ThumbnailCache(str(tmp_path)), server.ThumbnailCache(str(tmp_path))
+    # first indexes the directory before the image exists
+    first._load()
+    assert second.get('thumb', 'a.mp4', 'x.jpg') is None
+    wait_idle(second)
+    assert renders == ['a.mp4']
+    path = wait_ready(first, 'x.jpg')
+    assert renders == ['a.mp4']
+    assert path == str(tmp_path / 'x.jpg')
+    assert first.total == second.total == len(b'\xff\xd8 jpeg')
+
+
+def test_queued_job_skips_image_finished_elsewhere(tmp_path, renders):
+    cache = server.ThumbnailCache(str(tmp_path))
+    cache._load()
+    (tmp_path / 'x.jpg').write_bytes(b'done elsewhere')
+    cache._generate('thumb', 'a.mp4', 'x.jpg')
+    assert renders == []
+    assert cache.total == len(b'done elsewhere')
+
+
+def test_failures_are_retried_after_a_while(tmp_path, renders, monkeypatch):
+    cache = server.ThumbnailCache(str(tmp_path))
+    assert cache.get('thumb', 'broken.mp4', 'b.jpg') is None
+    wait_idle(cache)
+    assert cache.get('thumb', 'broken.mp4', 'b.jpg') is None
+    wait_idle(cache)
+    assert renders == ['broken.mp4']
+    monkeypatch.setattr(server, 'THUMB_RETRY_AFTER', 0)
+    assert cache.get('thumb', 'broken.mp4', 'b.jpg') is None
+    wait_idle(cache)
+    assert renders == ['broken.mp4', 'broken.mp4']
@@ -0,0 +1,54 @@
+import secrets
+import time
+
+import single_file_videos_web_server as server
+
+
+def test_evicted_entries_stay_used_or_revoked():
+    store = server.TokenStore(max_size=3)
+    now = int(time.time())
+    store.mark_used('used', now + 100)
+    store.revoke('revoked', now + 101)
+    for i in range(3):
+        store.mark_used(f'later{i}', now + 200 + i)
+    assert len(store) == 3 and 'used' not in store.tokens and 'revoked' not in store.tokens
+    assert store.state('used', now + 100) == server.TokenStore.REVOKED
+    assert store.state('revoked', now + 101) == server.TokenStore.REVOKED
+    assert not store.mark_used('used', now + 100)
+    # Tokens expiring after the floor are unaffected
+    assert store.state('fresh', now + 300) is None
+    assert store.mark_used('fresh', now + 300)
+
+
+# A token issued offset seconds from now, signed like issue_token() does
+def token_issued_at(offset):
+    issued = int(time.time()) + offset
+    payload = f'v1.secret.{issued + server.TOKEN_LINK_TTL:x}.{issued + server.TOKEN_USED_TTL:x}.{secrets.token_urlsafe(12)}'
+    return payload + '.' + server._sign(payload)
+
+
+# Use count tokens issued one second apart after the token under test
+def fill_store(count):
+    for i in range(count):
+        assert server.consume_secret_token(token_issued_at(i + 1)) == 'ok'
+
+
+def test_consumed_token_stays_consumed_past_max_size(monkeypatch):
+    monkeypatch.setattr(server, 'token_store', server.TokenStore(max_size=50))
+    token = server.issue_token('secret')
+    assert server.consume_secret_token(token) == 'ok'
+    fill_store(200)
+    assert len(server.token_store) == 50
+    assert server.consume_secret_token(token) != 'ok'
+
+
+def test_revoked_token_stays_invalid_past_max_size(monkeypatch):
+    monkeypatch.setattr(server, 'token_store', server.TokenStore(max_size=50))
+    token = server.issue_token('secret')
+    assert server.consume_secret_token(token) == 'ok'
+    server.revoke_secret_token(token)
+    assert not server.is_valid_secret_token(token)
+    fill_store(200)
+    assert len(server.token_store) == 50
+    assert not server.is_valid_secret_token(token)
+    assert server.consume_secret_token(token) == 'invalid'
@@ -0,0 +1,141 @@
+import os
+import sys
+import textwrap
+import time
+
+import pytest
+
+import single_file_videos_web_server as server
+
+# Stands in for ffmpeg: writes the output named by the last argument and reports progress.
+# STUB_FFMPEG_SECONDS makes it slow, STUB_FFMPEG_EXIT makes it fail after writing.
+STUB_FFMPEG = textwrap.dedent('''\
+    import os, sys, time
+    out = sys.argv[-1]
+    sys.stderr.write('  Duration: 00:00:01.00, start: 0.000000, bitrate: 1 kb/s\\n')
+    sys.stderr.flush()
+    with open(out, 'wb') as f:
+        f.write(b'partial')
+        f.flush()
+        steps = 10
+        for i in range(steps):
+            time.sleep(float(os.environ.get('STUB_FFMPEG_SECONDS', '0')) / steps)
+            print('out_time_us=%d' % ((i + 1) * 100000), flush=True)
+        f.write(b' mp4')
+    sys.exit(int(os.environ.get('STUB_FFMPEG_EXIT', '0')))
+''')
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    stub = tmp_path / 'ffmpeg'
+    stub.write_text(f'#!{sys.executable}\n' + STUB_FFMPEG)
+    stub.chmod(0o755)
+    root = tmp_path / 'videos'
+    root.mkdir()
+    monkeypatch.setattr(server, 'FFMPEG_BIN', str(stub))
+    monkeypatch.setattr(server, 'VIDEO_ROOT', str(root))
+    monkeypatch.delenv('STUB_FFMPEG_SECONDS', raising=False)
+    monkeypatch.delenv('STUB_FFMPEG_EXIT', raising=False)
+    return root
+
+
+def wait_finished(job, timeout=10):
+    deadline = time.time() + timeout
+    while job.finished is None:
+        assert time.time() < deadline, f'job {job.id} still {job.state}'
+        time.sleep(0.02)
+
+
+def test_transcode_replaces_output_atomically(library):
+    (library / 'a.mkv').write_bytes(b'source')
+    job = server.TranscodeManager(max_jobs=1).submit(False, 'a.mkv')
+    wait_finished(job)
+    assert job.state == 'done'
+    assert job.progress == 1.0
+    assert (library / 'a.mp4').read_bytes() == b'partial mp4'
+    assert not (library / 'a.mp4.part').exists()
+
+
+def test_up_to_date_output_is_not_queued(library):
+    (library / 'a.mkv').write_bytes(b'source')
+    (library / 'a.mp4').write_bytes(b'done')
+    assert server.TranscodeManager(max_jobs=1).submit(False, 'a.mkv') is None
+
+
+def test_skipped_job_keeps_part_of_other_process(library, monkeypatch):
+    monkeypatch.setenv('STUB_FFMPEG_SECONDS', '1')
+    (library / 'a.mkv').write_bytes(b'source')
+    first, second = server.TranscodeManager(max_jobs=1), server.TranscodeManager(max_jobs=1)
+    winner = first.submit(False, 'a.mkv')
+    # Wait until the winner's ffmpeg has the .part open and is writing to it
+    while winner.progress == 0:
+        time.sleep(0.01)
+    loser = second.submit(False, 'a.mkv')
+    wait_finished(loser)
+    assert loser.state == 'skipped'
+    assert (library / 'a.mp4.part').exists()
+    wait_finished(winner)
+    assert winner.state == 'done'
+    assert (library / 'a.mp4').read_bytes() == b'partial mp4'
+
+
+def test_cancel_queued_job_keeps_part_of_other_process(library, monkeypatch):
+    monkeypatch.setenv('STUB_FFMPEG_SECONDS', '0.5')
+    (library / 'a.mkv').write_bytes(b'source')
+    (library / 'b.mkv').write_bytes(b'source')
+    (library / 'b.mp4.part').write_bytes(b'another process')
+    manager = server.TranscodeManager(max_jobs=1)
+    running = manager.submit(False, 'a.mkv')
+    queued = manager.submit(False, 'b.mkv')
+    manager.cancel(queued.id)
+    wait_finished(queued)
+    assert queued.state == 'cancelled'
+    assert (library / 'b.mp4.part').read_bytes() == b'another process'
+    wait_finished(running)
+    assert running.state == 'done'
+
+
+def test_cancel_running_job_removes_its_part(library, monkeypatch):
+    monkeypatch.setenv('STUB_FFMPEG_SECONDS', '5')
+    (library / 'a.mkv').write_bytes(b'source')
+    manager = server.TranscodeManager(max_jobs=1)
+    job = manager.submit(False, 'a.mkv')
+    while job.state != 'running' or not (library / 'a.mp4.part').exists():
+        time.sleep(0.01)
+    manager.cancel(job.id)
+    wait_finished(job)
+    assert job.state == 'cancelled'
+    assert not (library / 'a.mp4.part').exists()
+    assert not (library / 'a.mp4').exists()
+
+
+def test_failed_ffmpeg_leaves_no_part(library, monkeypatch):
+    monkeypatch.setenv('STUB_FFMPEG_EXIT', '1')
+    (library / 'a.mkv').write_bytes(b'source')
+    job = server.TranscodeManager(max_jobs=1).submit(False, 'a.mkv')
+    wait_finished(job)
+    assert job.state == 'failed'
+    assert not (library / 'a.mp4.part').exists()
+    assert not (library / 'a.mp4').exists()
+
+
+def test_stale_crash_leftover_is_reclaimed(library):
+    (library / 'a.mkv').write_bytes(b'source')
+    leftover = library / 'a.mp4.part'
+    leftover.write_bytes(b'crashed')
+    old = time.time() - server.TRANSCODE_STALE_PART - 10
+    os.utime(leftover, (old, old))
+    job = server.TranscodeManager(max_jobs=1).submit(False, 'a.mkv')
+    wait_finished(job)
+    assert job.state == 'done'
+    assert (library / 'a.mp4').read_bytes() == b'partial mp4'
+
+
+def test_fresh_part_is_not_reclaimed(library):
+    (library / 'a.mkv').write_bytes(b'source')
+    (library / 'a.mp4.part').write_bytes(b'in progress elsewhere')
+    job = server.TranscodeManager(max_jobs=1).submit(False, 'a.mkv')
+    wait_finished(job)
+    assert job.state == 'skipped'
+    assert (library / 'a.mp4.part').read_bytes() == b'in progress elsewhere'
@@ -0,0 +1,21 @@
+import single_file_videos_web_server as server
+
+
+def test_paged_total_counts_matching_items(tmp_path, monkeypatch):
+    for name in ('show_ep1.mp4', 'show_ep2.mp4', 'show_ep3.mp4', 'movie.mp4', 'clip.mkv'):
+        (tmp_path / name).write_bytes(b'x')
+    monkeypatch.setattr(server, 'VIDEO_ROOT', str(tmp_path))
+    monkeypatch.setattr(server, 'catalogs', {})
+    monkeypatch.setattr(server.VideoCatalog, 'start', lambda self: None)
+    client = server.app.test_client()
+
+    page = client.get('/videos?q=show&limit=2').get_json()
+    assert len(page['items']) == 2 and page['total'] == 3
+    page = client.get('/videos?q=show&limit=2&cursor=' + page['next_cursor']).get_json()
+    assert len(page['items']) == 1 and page['total'] == 3
+    assert client.get('/videos?limit=2').get_json()['total'] == 5
+
+    # The cached count follows catalog changes
+    (tmp_path / 'show_ep4.mp4').write_bytes(b'x')
+    server.get_catalog().refresh()
+    assert client.get('/videos?q=show&limit=2').get_json()['total'] == 4